@@ -1,9 +1,29 @@
-from openai import OpenAI
 import textwrap
 import json
+import logging
+import hashlib
+import importlib
+import itertools
+import queue
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import os
 import sys
+import time
+
+import dedup
+import export
+import ingest
+import jobs
+import metrics
+import prior_art
+import profiling
+import scoring
+import search_index
+import validation
 
 def resource_path(relative_path):
     return relative_path
@@ -12,16 +32,26 @@ def resource_path(relative_path):
     #     return os.path.join(sys._MEIPASS, relative_path)
     # return os.path.join(os.path.abspath("."), relative_path)
 
+# 配置文件路径，可通过环境变量指定其他配置（例如压测时指向模拟服务）
+CONFIG_PATH = os.environ.get("PATENT_ASSISTANT_CONFIG") or resource_path('config.json')
+
 class ConfigLoader:
     _instance = None
+    _lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.load_config()
+            with cls._lock:
+                # 加载完成后再发布实例，避免并发线程拿到尚无config属性的对象
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance.load_config()
+                    cls._instance = instance
+        else:
+            cls._instance.reload_if_changed()
         return cls._instance
     
-    def load_config(self, config_path=resource_path('config.json')):
+    def load_config(self, config_path=CONFIG_PATH):
         """加载配置文件并验证参数"""
         default_config = {
             "openai_config": {
@@ -31,7 +61,110 @@ class ConfigLoader:
             },
             "generation_params": {
                 "temperature": 0.5,
-                "max_tokens": 1000
+                "max_tokens": 1000,
+                "context_window": 0,
+                "max_continuations": 3,
+                "max_document_tokens": 0,
+                "candidates": 1,
+                "use_n": True
+            },
+            "cache": {
+                "enabled": True,
+                "dir": "cache",
+                "max_age_days": 30,
+                "max_size_mb": 200
+            },
+            "routing": {
+                "hedge": True,
+                "hedge_percentile": 95,
+                "hedge_min_delay": 2.0,
+                "hedge_default_delay": 15.0,
+                "ewma_alpha": 0.3,
+                "error_threshold": 0.5,
+                "cooldown": 60
+            },
+            "rate_limit": {
+                "enabled": True,
+                "requests_per_minute": 0,
+                "tokens_per_minute": 0,
+                "headroom": 0.9,
+                "initial_concurrency": 8,
+                "min_concurrency": 1,
+                "max_concurrency": 32,
+                "max_retries": 4,
+                "backoff_base": 1.0,
+                "backoff_max": 60
+            },
+            "search": {
+                "index_path": "search_index.db"
+            },
+            "jobs": {
+                "db_path": "jobs.db",
+                "max_attempts": 3,
+                "keep_days": 30
+            },
+            "dedup": {
+                "enabled": True,
+                "threshold": 0.8,
+                "db_path": "history.db"
+            },
+            "export": {
+                "formats": ["docx"],
+                "dpi": 200,
+                "font": "",
+                "workers": 0,
+                "cache_dir": "cache/export",
+                "cache_max_mb": 100,
+                "pdf_converter": ""
+            },
+            "validation": {
+                "enabled": True,
+                "repair": True,
+                "max_repair_rounds": 2
+            },
+            "metrics": {
+                "request_usage": True,
+                "prometheus_file": ""
+            },
+            "http": {
+                "timeout": 600,
+                "connect_timeout": 10,
+                "max_connections": 20,
+                "max_keepalive_connections": 10,
+                "keepalive_expiry": 60,
+                "max_retries": 2
+            },
+            "server": {
+                "host": "127.0.0.1",
+                "port": 8765,
+                "workers": 4,
+                "queue_size": 16,
+                "output_dir": "server_output",
+                "api_keys": []
+            },
+            "remote": {
+                "url": "",
+                "api_key": ""
+            },
+            "ingest": {
+                "db_path": "ingest.db",
+                "chunk_chars": 6000,
+                "max_chunk_chars": 12000,
+                "summary_chars": 400,
+                "reduce_input_chars": 12000,
+                "ideas_chars": 1500,
+                "workers": 4,
+                "keep_days": 90
+            },
+            "prior_art": {
+                "enabled": True,
+                "index_dir": "prior_art_index",
+                "top_k": 5,
+                "abstract_chars": 200,
+                "max_terms": 16,
+                "max_df_ratio": 0.2,
+                "batch_postings": 2000000,
+                "max_segments": 8
             }
         }
         
@@ -39,21 +172,46 @@ class ConfigLoader:
             if not Path(config_path).exists():
                 raise FileNotFoundError(f"配置文件 {config_path} 不存在")
             
+            mtime = os.path.getmtime(config_path)
             with open(config_path, 'r', encoding='utf-8') as f:
                 user_config = json.load(f)
             
             # 深度合并配置
-            self.config = self._deep_merge(default_config, user_config)
+            config = self._deep_merge(default_config, user_config)
             
-            # 验证必要参数
-            if not self.config['openai_config']['api_key']:
+            # 验证必要参数（配置了多个端点时，每个端点都需要有可用的密钥；
+            # 作为瘦客户端连接生成服务时由服务端调用模型，本机不需要密钥）
+            if not config['remote']['url'] and not all(endpoint['api_key'] for endpoint in _parse_endpoints(config['openai_config'])):
                 raise ValueError("API密钥不能为空")
             
+            # 验证通过后整体替换，读取方不会看到半更新的配置
+            self.config = config
+            self.config_path = config_path
+            self._mtime = mtime
+            
         except json.JSONDecodeError:
             raise ValueError("配置文件格式错误，必须是有效的JSON格式")
         except Exception as e:
             raise RuntimeError(f"配置加载失败: {str(e)}")
     
+    def reload_if_changed(self):
+        """配置文件修改时间变化时重新加载；新配置无效则保留当前配置"""
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                self.load_config(self.config_path)
+            except Exception as e:
+                # 记下该修改时间，避免对同一个无效文件反复尝试
+                self._mtime = mtime
+                logging.warning(f"配置重新加载失败，继续使用原配置: {e}")
+
     def _deep_merge(self, base, update):
         """深度合并字典"""
         for key, value in update.items():
@@ -63,69 +221,1883 @@ class ConfigLoader:
                 base[key] = value
         return base
 
-def get_openai_client():
-    """根据配置创建OpenAI客户端"""
-    config = ConfigLoader().config['openai_config']
+# 长连接客户端注册表：键为 (base_url, api_key, 连接参数)，配置变化时自然切换到新客户端
+_clients = {}
+_clients_lock = threading.Lock()
+MAX_CACHED_CLIENTS = 8
+
+def _create_openai_client(endpoint, http_config, max_retries):
+    # openai/httpx 导入较慢，推迟到首次请求（或 warm_up 后台线程）时再导入
+    import httpx
+    from openai import OpenAI
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(http_config['timeout'], connect=http_config['connect_timeout']),
+        limits=httpx.Limits(
+            max_connections=http_config['max_connections'],
+            max_keepalive_connections=http_config['max_keepalive_connections'],
+            keepalive_expiry=http_config['keepalive_expiry'],
+        ),
+    )
     return OpenAI(
-        api_key=config['api_key'],
-        base_url=config['base_url']
+        api_key=endpoint['api_key'],
+        base_url=endpoint['base_url'],
+        http_client=http_client,
+        max_retries=max_retries,
     )
 
-def generate_patent_document(title, ideas):
-    system_prompt = textwrap.dedent(rf"""\
-    你是一个资深专利工程师，需要根据提供的发明名称和创意要点，撰写专业的专利交底书。文档结构应包含以下七个部分，要求技术细节详尽，逻辑严谨：
+def warm_up(on_done=None):
+    """在后台线程中预先导入openai并读取配置，缩短首次生成的等待
 
-    1. 专业领域
-    - 明确本发明的技术归属领域
-    
-    2. 技术背景与现有技术（需包含流程图）
-    - 详细说明技术演进过程（不少于300字）
-    - 用Mermaid语法绘制现有技术流程图（示例：
-        ```mermaid
-        graph TD
-            A[图像采集] --> B[预处理]
-            B --> C[特征提取]
-            C --> D[分类识别]
-        ```)
-    
-    3. 现有技术缺点与发明目的
-    - 列出至少3项量化缺点（使用数学公式说明，例如：ΔP = ρgh + ½ρv²）
-    - 对应提出本发明要解决的技术问题
-    
-    4. 本发明技术详细方案（需包含公式和流程图）
-    - 分步骤详细说明技术实现（技术方案不少于1000字），每个细节都需要详细展开说明
-    - 核心算法用LaTeX公式表示（例如：f(x) = \\sum_{{i=0}}^n \\alpha_i x^i）
-    - 用Mermaid语法绘制技术流程图（至少包含5个处理节点）
-    
-    5. 关键点与保护范围
-    - 提炼3-5个核心技术特征
-    - 按重要性排序权利要求项
-    
-    6. 技术优势对比
-    - 制作对比表格（参数指标不少于5项）
-    - 用具体数据量化优势（例如：处理速度提升30%）
-    
-    7. 替代实施方案
-    - 提供2种以上替代方案
-    - 每种方案需说明实施方式和选择条件
+    on_done(seconds) 在预热结束后于后台线程中调用；返回预热线程。
+    """
+    def run():
+        start = time.perf_counter()
+        try:
+            importlib.import_module("httpx")
+            importlib.import_module("openai")
+            ConfigLoader()
+        except Exception as e:
+            logging.warning(f"预热失败，将在首次生成时重试: {e}")
+        if on_done is not None:
+            on_done(time.perf_counter() - start)
 
-    当前发明名称：{title}
-    创意要点：{ideas}
-    """)
+    thread = threading.Thread(target=run, name="ai-warm-up", daemon=True)
+    thread.start()
+    return thread
 
+@profiling.staged("client")
+def get_openai_client(endpoint=None):
+    """返回与当前配置（或指定端点）对应的OpenAI客户端
+
+    客户端按 (base_url, api_key, 连接参数) 复用，保持连接池避免每次请求重新握手；
+    配置文件修改后自动切换到新客户端，旧客户端上的请求不受影响。
+    """
     config = ConfigLoader().config
-    client = get_openai_client()
-    
+    if endpoint is None:
+        endpoint = config['openai_config']
+    http_config = config['http']
+    # 启用客户端限流时由 _open_routed_stream 统一重试，SDK自身不再重试，429与5xx才能被限流器观察到
+    max_retries = 0 if config['rate_limit']['enabled'] else http_config['max_retries']
+    key = (endpoint['base_url'], endpoint['api_key'],
+           json.dumps(http_config, sort_keys=True), max_retries)
+
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_openai_client(endpoint, http_config, max_retries)
+                _clients[key] = client
+                # 只保留最近的若干个客户端；被移除的客户端可能仍在使用，交由垃圾回收关闭
+                while len(_clients) > MAX_CACHED_CLIENTS:
+                    _clients.pop(next(iter(_clients)))
+    return client
+
+def _parse_endpoints(openai_config):
+    """解析端点列表
+
+    openai_config.endpoints 为可选的端点数组，每项可包含 name、base_url、api_key、model，
+    缺省字段沿用openai_config顶层的值；未配置时使用顶层的单个端点。
+    """
+    endpoints = []
+    for item in openai_config.get('endpoints') or [openai_config]:
+        endpoint = {
+            'base_url': item.get('base_url', openai_config.get('base_url', '')),
+            'api_key': item.get('api_key', openai_config.get('api_key', '')),
+            'model': item.get('model', openai_config.get('model', '')),
+        }
+        endpoint['name'] = item.get('name') or f"{endpoint['model']}@{endpoint['base_url']}"
+        endpoints.append(endpoint)
+    return endpoints
+
+def get_endpoints():
+    """当前配置中的全部端点"""
+    return _parse_endpoints(ConfigLoader().config['openai_config'])
+
+class _EndpointHealth:
+    """单个端点的延迟与错误统计"""
+
+    # 用于计算延迟分位数的最近样本数
+    WINDOW = 50
+
+    def __init__(self):
+        self.latency = None  # 首块延迟的EWMA（秒）
+        self.error_rate = 0.0  # 错误率的EWMA
+        self.samples = []
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+class EndpointRouter:
+    """按延迟与错误率选择端点
+
+    对每个端点记录首块延迟（TTFT）与错误率的指数加权移动平均，
+    优先选择健康且最快的端点；尚无样本的端点会被优先尝试一次。
+    连续失败或错误率超过阈值的端点进入冷却期，冷却期内仅在没有其他可用端点时使用。
+    """
+
+    def __init__(self):
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint):
+        return self._health.setdefault(endpoint['name'], _EndpointHealth())
+
+    def ranked(self, endpoints=None):
+        """按优先级排序的端点列表"""
+        endpoints = endpoints if endpoints is not None else get_endpoints()
+        routing = ConfigLoader().config['routing']
+        now = time.monotonic()
+        with self._lock:
+            def score(indexed):
+                index, endpoint = indexed
+                health = self._get(endpoint)
+                unhealthy = (health.cooldown_until > now
+                             or health.error_rate > routing['error_threshold'])
+                latency = health.latency if health.latency is not None else 0.0
+                return (unhealthy, latency * (1 + health.error_rate), index)
+            return [endpoint for _, endpoint in sorted(enumerate(endpoints), key=score)]
+
+    def record_latency(self, endpoint, latency):
+        """记录一次首块延迟；对冲中落败的请求以已等待时间作为延迟下界记录"""
+        alpha = ConfigLoader().config['routing']['ewma_alpha']
+        with self._lock:
+            health = self._get(endpoint)
+            health.latency = latency if health.latency is None else (
+                alpha * latency + (1 - alpha) * health.latency)
+            health.samples.append(latency)
+            del health.samples[:-_EndpointHealth.WINDOW]
+
+    def record_success(self, endpoint, latency):
+        self.record_latency(endpoint, latency)
+        alpha = ConfigLoader().config['routing']['ewma_alpha']
+        with self._lock:
+            health = self._get(endpoint)
+            health.error_rate *= (1 - alpha)
+            health.consecutive_errors = 0
+
+    def record_failure(self, endpoint):
+        routing = ConfigLoader().config['routing']
+        alpha = routing['ewma_alpha']
+        with self._lock:
+            health = self._get(endpoint)
+            health.error_rate = alpha + (1 - alpha) * health.error_rate
+            health.consecutive_errors += 1
+            if health.consecutive_errors >= 3:
+                health.cooldown_until = time.monotonic() + routing['cooldown']
+
+    def hedge_delay(self, endpoint):
+        """发起对冲请求前的等待时间：该端点首块延迟的高分位数"""
+        routing = ConfigLoader().config['routing']
+        with self._lock:
+            samples = sorted(self._get(endpoint).samples)
+        if len(samples) < 5:
+            delay = routing['hedge_default_delay']
+        else:
+            index = min(len(samples) - 1, int(len(samples) * routing['hedge_percentile'] / 100))
+            delay = samples[index]
+        return max(routing['hedge_min_delay'], delay)
+
+    def snapshot(self):
+        """各端点当前统计，便于日志与界面展示"""
+        with self._lock:
+            return {name: {"latency": health.latency, "error_rate": health.error_rate,
+                           "cooling": health.cooldown_until > time.monotonic()}
+                    for name, health in self._health.items()}
+
+_router = EndpointRouter()
+
+def get_router():
+    return _router
+
+def _status_code(error):
+    """上游错误的HTTP状态码；连接失败、超时等没有响应的错误返回None"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+def _retry_after(error):
+    """错误响应中 Retry-After（或 retry-after-ms）建议的等待秒数，没有时返回None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    headers = {name.lower(): value for name, value in headers.items()}
     try:
-        response = client.chat.completions.create(
-            model=config['openai_config']['model'],
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": "请按照专利审查指南要求撰写完整的交底书，特别注意技术方案部分需要包含流程图和数学模型。"}
-            ],
-            temperature=0.3,
+        if 'retry-after-ms' in headers:
+            return max(0.0, float(headers['retry-after-ms']) / 1000)
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        # HTTP日期格式；打包版本可能没有 email 模块，此时忽略该头
+        try:
+            import email.utils
+        except ImportError:
+            return None
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _is_overload(error):
+    """429与5xx表示上游过载或限流，限流器据此收缩并发"""
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+def _is_retryable(error):
+    """过载、请求超时与连接失败可以稍后重试；其余错误（如鉴权失败、参数错误）重试也不会成功"""
+    if _is_overload(error) or _status_code(error) == 408:
+        return True
+    import openai
+    return isinstance(error, openai.APIConnectionError)
+
+def backoff_delay(retry, error=None):
+    """第 retry 次（从0开始）重试前的等待秒数：带抖动的指数退避，且不短于服务端的 Retry-After"""
+    settings = ConfigLoader().config['rate_limit']
+    ceiling = min(settings['backoff_max'], settings['backoff_base'] * 2 ** retry)
+    # 一半固定、一半随机，同时失败的请求不会在同一时刻一起重试
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    retry_after = _retry_after(error) if error is not None else None
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, settings['backoff_base']))
+    return delay
+
+class _TokenBucket:
+    """令牌桶：按 每分钟额度/60 每秒匀速补充，额度为0表示不限制
+
+    容量只有 BURST_SECONDS 秒的额度：服务商多按滑动的一分钟窗口计数，
+    容量为整分钟额度时，任意一分钟内的实际请求量最多可达额度的两倍。
+    """
+
+    BURST_SECONDS = 6
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute * self.BURST_SECONDS / 60) if per_minute else 0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """取出 amount 个令牌前还需等待的秒数；超过容量的请求等到桶满即可发出"""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) * 60 / self.per_minute)
+
+    def take(self, amount):
+        """取出（amount为负时归还）令牌；按实际用量补扣时余量可以为负，之后的请求相应等待"""
+        if self.per_minute:
+            self.level = min(self.capacity, self.level - amount)
+
+class RatePermit:
+    """一次已放行的请求；请求结束（或失败）时调用 release 归还并发名额"""
+
+    def __init__(self, limiter, tokens):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.issued_at = time.monotonic()
+        self._released = False
+
+    def release(self, used_tokens=None, error=None):
+        """归还名额（重复调用无效）
+
+        used_tokens 为实际用量时按差额结算token桶；error 为429或5xx时收缩并发上限。
+        """
+        if not self._released:
+            self._released = True
+            self.limiter._release(self, used_tokens, error)
+
+class RateLimiter:
+    """单个端点的客户端限流
+
+    请求数与token数各用一个令牌桶，速率为配置的每分钟额度乘以 headroom，略低于服务商的限额；
+    同时在途的请求数按AIMD调整：每个请求收到首块后上限增加 1/上限（约每轮请求加1），
+    遇到429或5xx时减半。同一轮中的多个失败只减半一次——只有在上次减半之后放行的请求失败才会再次减半。
+    服务端返回 Retry-After 时，该端点的新请求一律暂停到指定时间之后。
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self._requests = _TokenBucket(0)
+        self._tokens = _TokenBucket(0)
+        self._cond = threading.Condition()
+
+    def _configure(self, settings):
+        headroom = settings['headroom']
+        rpm = settings['requests_per_minute'] * headroom
+        tpm = settings['tokens_per_minute'] * headroom
+        # 额度修改后重建令牌桶；额度不变时保留当前余量
+        if self._requests.per_minute != rpm:
+            self._requests = _TokenBucket(rpm)
+        if self._tokens.per_minute != tpm:
+            self._tokens = _TokenBucket(tpm)
+        if self.limit is None:
+            self.limit = float(settings['initial_concurrency'])
+        self.limit = min(max(self.limit, settings['min_concurrency']), settings['max_concurrency'])
+
+    def acquire(self, tokens, abandoned=None):
+        """等待到可以发出一个预计消耗 tokens 个token的请求，返回 RatePermit
+
+        abandoned() 为真时放弃等待并返回None。
+        """
+        settings = ConfigLoader().config['rate_limit']
+        with self._cond:
+            self._configure(settings)
+            while True:
+                now = time.monotonic()
+                wait = max(self.paused_until - now, self._requests.wait_time(1, now),
+                           self._tokens.wait_time(tokens, now))
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                if abandoned is not None and abandoned():
+                    return None
+                # 名额被占满时等待其他请求归还；定时醒来以便检查是否已放弃
+                self._cond.wait(min(wait, 0.2) if wait > 0 else 0.2)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.in_flight += 1
+            return RatePermit(self, tokens)
+
+    def record_success(self):
+        """请求被上游接受（已收到首块），并发上限加性增加"""
+        settings = ConfigLoader().config['rate_limit']
+        with self._cond:
+            self.limit = min(settings['max_concurrency'], self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _release(self, permit, used_tokens, error):
+        settings = ConfigLoader().config['rate_limit']
+        with self._cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self._tokens.take(used_tokens - permit.tokens)
+            if error is not None and _is_overload(error):
+                now = time.monotonic()
+                if permit.issued_at >= self.last_decrease:
+                    self.limit = max(settings['min_concurrency'], self.limit / 2)
+                    self.last_decrease = now
+                    logging.warning(f"上游过载（HTTP {_status_code(error)}），并发上限降至{int(self.limit)}")
+                retry_after = _retry_after(error)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {"limit": self.limit, "in_flight": self.in_flight,
+                    "paused": max(0.0, self.paused_until - time.monotonic())}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(endpoint):
+    """返回端点共享的限流器（按端点名称区分）；未启用客户端限流时返回None"""
+    if not ConfigLoader().config['rate_limit']['enabled']:
+        return None
+    with _limiters_lock:
+        return _limiters.setdefault(endpoint['name'], RateLimiter())
+
+def rate_limiter_snapshot():
+    """各端点限流器的当前状态（并发上限、在途请求数、剩余暂停秒数）"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
+
+USER_PROMPT = "请按照专利审查指南要求撰写完整的交底书，特别注意技术方案部分需要包含流程图和数学模型。"
+
+# 流式写入时的临时文件后缀，生成完整后才重命名为正式文件
+PARTIAL_SUFFIX = jobs.PARTIAL_SUFFIX
+
+PRIOR_ART_PROMPT = ("以下是从本地专利摘要库检索到的相关现有技术。撰写第2部分“技术背景与现有技术”时，"
+                    "应以这些文献为依据介绍技术演进与现有方案，引用时注明公开号；不要编造未列出的专利文献。")
+# 需要附带现有技术检索结果的章节
+PRIOR_ART_SECTIONS = (2,)
+
+PROMPT_HEADER = "你是一个资深专利工程师，需要根据提供的发明名称和创意要点，撰写专业的专利交底书。文档结构应包含以下七个部分，要求技术细节详尽，逻辑严谨："
+
+# 交底书章节定义：(序号, 标题, 标题后的附加说明, 撰写要求, 依赖的章节序号)
+# 依赖关系仅用于分章节并行生成：章节只等待其依赖的章节完成，并以其内容作为上下文
+DOCUMENT_SECTIONS = [
+    (1, "专业领域", "", textwrap.dedent("""\
+        - 明确本发明的技术归属领域"""), ()),
+    (2, "技术背景与现有技术", "（需包含流程图）", textwrap.dedent("""\
+        - 详细说明技术演进过程（不少于300字）
+        - 用Mermaid语法绘制现有技术流程图（示例：
+            ```mermaid
+            graph TD
+                A[图像采集] --> B[预处理]
+                B --> C[特征提取]
+                C --> D[分类识别]
+            ```)"""), ()),
+    (3, "现有技术缺点与发明目的", "", textwrap.dedent("""\
+        - 列出至少3项量化缺点（使用数学公式说明，例如：ΔP = ρgh + ½ρv²）
+        - 对应提出本发明要解决的技术问题"""), (2,)),
+    (4, "本发明技术详细方案", "（需包含公式和流程图）", textwrap.dedent("""\
+        - 分步骤详细说明技术实现（技术方案不少于1000字），每个细节都需要详细展开说明
+        - 核心算法用LaTeX公式表示（例如：f(x) = \\sum_{i=0}^n \\alpha_i x^i）
+        - 用Mermaid语法绘制技术流程图（至少包含5个处理节点）"""), ()),
+    (5, "关键点与保护范围", "", textwrap.dedent("""\
+        - 提炼3-5个核心技术特征
+        - 按重要性排序权利要求项"""), (4,)),
+    (6, "技术优势对比", "", textwrap.dedent("""\
+        - 制作对比表格（参数指标不少于5项）
+        - 用具体数据量化优势（例如：处理速度提升30%）"""), (3, 4)),
+    (7, "替代实施方案", "", textwrap.dedent("""\
+        - 提供2种以上替代方案
+        - 每种方案需说明实施方式和选择条件"""), (4,)),
+]
+
+def _section_requirements(section):
+    """渲染单个章节的标题与撰写要求"""
+    number, name, note, requirements, _ = section
+    return f"{number}. {name}{note}\n{requirements}"
+
+def get_prior_art_index():
+    settings = ConfigLoader().config['prior_art']
+    return prior_art.get_index(resource_path(settings['index_dir']), batch_postings=settings['batch_postings'],
+                               max_segments=settings['max_segments'])
+
+@profiling.staged("retrieval")
+def find_prior_art(title, ideas):
+    """从本地专利摘要库检索与本发明最相关的现有技术（见 prior_art.py）
+
+    未启用、尚未建立索引或检索失败时返回空列表，生成照常进行。
+    """
+    settings = ConfigLoader().config['prior_art']
+    if not settings['enabled'] or not settings['top_k']:
+        return []
+    try:
+        return get_prior_art_index().search(f"{title}\n{ideas}", settings['top_k'], settings['max_terms'],
+                                            settings['max_df_ratio'])
+    except Exception as e:
+        logging.warning(f"现有技术检索失败: {e}")
+        return []
+
+def _prior_art_prompt(references):
+    """把检索到的现有技术渲染为提示词中的一段，没有结果时为空串"""
+    if not references:
+        return ""
+    limit = ConfigLoader().config['prior_art']['abstract_chars']
+    lines = []
+    for number, reference in enumerate(references, start=1):
+        abstract = reference.abstract if len(reference.abstract) <= limit else reference.abstract[:limit] + "…"
+        lines.append(f"[{number}] {reference.id} {reference.title}：{abstract}")
+    return f"\n{PRIOR_ART_PROMPT}\n" + "\n".join(lines) + "\n"
+
+def build_system_prompt(title, ideas, references=None):
+    """根据发明名称和创意要点渲染系统提示词；references 为检索到的现有技术（PriorArt 列表）"""
+    sections = "\n\n".join(_section_requirements(section) for section in DOCUMENT_SECTIONS)
+    return (f"{PROMPT_HEADER}\n\n{sections}\n\n当前发明名称：{title}\n创意要点：{ideas}\n"
+            + _prior_art_prompt(references))
+
+@profiling.staged("prompt")
+def build_messages(title, ideas):
+    """构造对话消息列表，附带检索到的现有技术"""
+    return [
+        {"role": "system", "content": build_system_prompt(title, ideas, find_prior_art(title, ideas))},
+        {"role": "user", "content": USER_PROMPT}
+    ]
+
+def _cache_identity():
+    """缓存键中的 (模型, 接口地址)；配置了多个端点时取全部端点的组合"""
+    endpoints = get_endpoints()
+    models = "|".join(sorted({endpoint['model'] for endpoint in endpoints}))
+    base_urls = "|".join(sorted({endpoint['base_url'] for endpoint in endpoints}))
+    return models, base_urls
+
+# 常见模型的上下文窗口（token），未列出的模型使用 DEFAULT_CONTEXT_WINDOW，
+# 也可通过 generation_params.context_window 显式指定
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-3.5-turbo": 16385,
+    "DeepSeek-R1": 65536,
+    "deepseek-chat": 65536,
+    "deepseek-reasoner": 65536,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# 每条消息的格式开销与估算误差余量（token）
+MESSAGE_OVERHEAD = 4
+CONTEXT_MARGIN = 256
+# 可用输出token低于该值时不再发起请求
+MIN_COMPLETION_TOKENS = 256
+
+def context_window():
+    """当前配置下的上下文窗口大小；配置了多个端点时取最小值"""
+    configured = ConfigLoader().config['generation_params']['context_window']
+    if configured:
+        return configured
+    return min(MODEL_CONTEXT_WINDOWS.get(endpoint['model'], DEFAULT_CONTEXT_WINDOW)
+               for endpoint in get_endpoints())
+
+def estimate_prompt_tokens(messages):
+    return sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages)
+
+def _generation_params(messages=None):
+    """本次请求使用的生成参数（参与缓存键计算）
+
+    给定 messages 时按本地估算的提示词长度把 max_tokens 收紧到上下文窗口内。
+    """
+    gen = ConfigLoader().config['generation_params']
+    max_tokens = gen['max_tokens'] or None
+    if messages is not None:
+        prompt_tokens = estimate_prompt_tokens(messages)
+        available = context_window() - prompt_tokens - CONTEXT_MARGIN
+        if available < MIN_COMPLETION_TOKENS:
+            raise GenerationTruncated(f"提示词过长（约{prompt_tokens}个token），超出模型上下文窗口")
+        max_tokens = min(max_tokens, available) if max_tokens else available
+    params = {"temperature": gen['temperature']}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
+    return params
+
+class TokenBudget:
+    """单篇文档（含续写与各章节请求）的token额度，limit为0表示不限制
+
+    每次请求前按 提示词 + max_tokens 预留额度，结束后按实际用量结算，
+    并发的章节请求因此不会合计超出额度。
+    """
+
+    def __init__(self, limit=None):
+        if limit is None:
+            limit = ConfigLoader().config['generation_params']['max_document_tokens']
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, prompt_tokens, max_tokens):
+        """为一次请求预留额度，返回本次允许的max_tokens；额度不足时抛出 GenerationTruncated"""
+        if not self.limit:
+            return max_tokens
+        with self._lock:
+            available = self.limit - self.spent - prompt_tokens
+            if available < MIN_COMPLETION_TOKENS:
+                raise GenerationTruncated(f"已达到单篇文档token上限（{self.limit}）")
+            granted = min(max_tokens, available) if max_tokens else available
+            self.spent += prompt_tokens + granted
+            return granted
+
+    def settle(self, reserved, used):
+        """按实际用量结算预留的额度"""
+        with self._lock:
+            self.spent += used - (reserved if self.limit else 0)
+
+class ResponseCache:
+    """基于磁盘的内容寻址响应缓存
+
+    缓存键由模型、接口地址、完整消息和生成参数共同决定，每条缓存保存为一个JSON文件。
+    命中时刷新文件修改时间，淘汰时先删除过期条目，再按最久未使用顺序删除直到总大小达标。
+    """
+
+    def __init__(self, cache_dir, max_age_days=30, max_size_mb=200):
+        self.cache_dir = cache_dir
+        self.max_age = max_age_days * 86400
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, base_url, messages, params):
+        payload = json.dumps(
+            {"model": model, "base_url": base_url, "messages": messages, "params": params},
+            ensure_ascii=False, sort_keys=True
         )
-        return response.choices[0].message.content
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @profiling.staged("cache")
+    def get(self, key):
+        """读取缓存内容，未命中或已过期时返回None"""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # 刷新最近使用时间
+            return entry["content"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @profiling.staged("cache")
+    def put(self, key, content, model=""):
+        """原子写入一条缓存，并按需淘汰"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "created": time.time(), "content": content},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """删除过期条目，并在超出容量时按最久未使用顺序淘汰"""
+        with self._lock:
+            try:
+                names = os.listdir(self.cache_dir)
+            except OSError:
+                return
+            now = time.time()
+            entries = []
+            total = 0
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.max_age:
+                    self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def get_response_cache():
+    """根据配置返回响应缓存，未启用时返回None"""
+    cache_config = ConfigLoader().config['cache']
+    if not cache_config.get('enabled', True):
+        return None
+    return ResponseCache(
+        resource_path(cache_config['dir']),
+        cache_config.get('max_age_days', 30),
+        cache_config.get('max_size_mb', 200)
+    )
+
+def get_search_index():
+    """根据配置返回已生成交底书的全文索引"""
+    return search_index.get_index(resource_path(ConfigLoader().config['search']['index_path']))
+
+@profiling.staged("index")
+def index_saved_document(path, title=None, ideas=None):
+    """将刚保存的交底书加入全文索引，给定输入时同时登记到近似重复检测库
+
+    索引失败只记录日志，不影响生成结果。
+    """
+    try:
+        get_search_index().add(path)
     except Exception as e:
-        print(f"API调用失败: {e}")
+        logging.warning(f"全文索引更新失败: {e}")
+    if title is not None and ConfigLoader().config['dedup']['enabled']:
+        try:
+            get_duplicate_store().add(title, ideas or "", os.path.abspath(path))
+        except Exception as e:
+            logging.warning(f"历史输入登记失败: {e}")
+
+def get_export_options():
+    """按 config.json 中的 export 部分构造导出参数（见 export.py）"""
+    settings = dict(ConfigLoader().config['export'])
+    settings['cache_dir'] = resource_path(settings['cache_dir'])
+    return export.ExportOptions(**settings)
+
+def get_job_store():
+    return jobs.get_store(resource_path(ConfigLoader().config['jobs']['db_path']))
+
+def get_duplicate_store():
+    return dedup.get_store(resource_path(ConfigLoader().config['dedup']['db_path']))
+
+def get_ingest_store():
+    return ingest.get_store(resource_path(ConfigLoader().config['ingest']['db_path']))
+
+def find_duplicates(title, ideas):
+    """查找与本次输入近似重复的历史生成记录（相似度阈值见 dedup.threshold），未启用时返回空列表"""
+    settings = ConfigLoader().config['dedup']
+    if not settings['enabled']:
+        return []
+    return get_duplicate_store().find(title, ideas, settings['threshold'])
+
+class GenerationTruncated(Exception):
+    """输出因长度上限被截断，且续写次数或token额度已用完"""
+
+class GenerationCancelled(Exception):
+    """生成任务被取消"""
+
+class CancelToken:
+    """协作式取消标记
+
+    取消时除设置标记外，还会调用已登记的回调（通常是关闭流式连接），
+    使阻塞在网络读取上的线程立即返回，而不必强行终止线程。
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def wait(self, timeout):
+        """最多等待 timeout 秒，期间被取消则立即返回；返回是否已取消"""
+        return self._event.wait(timeout)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        self._event.set()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def register(self, callback):
+        """登记取消回调；已取消时立即执行"""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+class _StreamAttempt:
+    """在后台线程中向单个端点发起流式请求，直到收到第一个数据块
+
+    发出请求前先向该端点的限流器（见 RateLimiter）申请名额，名额在 abandon 时归还。
+    """
+
+    def __init__(self, endpoint, messages, params, results):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.queue_wait = 0.0
+        self.connect_time = None
+        self.finished = False
+        self.stream = None
+        self.permit = None
+        self.abandoned = False
+        self._lock = threading.Lock()
+        self._args = (messages, params, results)
+        threading.Thread(target=profiling.bind(self._run), daemon=True).start()
+
+    @profiling.staged("rate-limit")
+    def _acquire(self, messages, params):
+        """向限流器申请名额；未启用限流时直接返回True，放弃等待时返回False"""
+        limiter = get_rate_limiter(self.endpoint)
+        if limiter is None:
+            return True
+        # 一次请求多个候选（n）时输出token按候选数计
+        completion_tokens = (params.get('max_tokens') or 0) * params.get('n', 1)
+        permit = limiter.acquire(estimate_prompt_tokens(messages) + completion_tokens, lambda: self.abandoned)
+        if permit is None:
+            return False
+        with self._lock:
+            self.permit = permit
+            abandoned = self.abandoned
+        if abandoned:
+            self.release()
+            return False
+        # 限流等待单独记录，不计入该端点的延迟统计
+        self.queue_wait = time.perf_counter() - self.started_at
+        self.started_at = time.perf_counter()
+        return True
+
+    def _run(self):
+        messages, params, results = self._args
+        try:
+            if not self._acquire(messages, params):
+                results.put((self, None, None, GenerationCancelled(), 0.0))
+                return
+            start = self.started_at
+            client = get_openai_client(self.endpoint)
+            extra = {}
+            if ConfigLoader().config['metrics']['request_usage']:
+                # 要求服务端在流末尾返回token用量
+                extra['stream_options'] = {"include_usage": True}
+            with profiling.stage("connect"):
+                stream = client.chat.completions.create(
+                    model=self.endpoint['model'],
+                    messages=messages,
+                    stream=True,
+                    **params,
+                    **extra,
+                )
+            self.connect_time = time.perf_counter() - start
+            with self._lock:
+                if self.abandoned:
+                    stream.close()
+                    return
+                self.stream = stream
+            iterator = iter(stream)
+            with profiling.stage("first-chunk"):
+                first = next(iterator, None)
+            limiter = get_rate_limiter(self.endpoint)
+            if limiter is not None and self.permit is not None:
+                limiter.record_success()
+            results.put((self, iterator, first, None, time.perf_counter() - start))
+        except Exception as e:
+            self.release(error=e)
+            results.put((self, None, None, e, time.perf_counter() - self.started_at))
+
+    def release(self, used_tokens=None, error=None):
+        """归还限流名额（可重复调用），参数含义见 RatePermit.release"""
+        with self._lock:
+            permit, self.permit = self.permit, None
+        if permit is not None:
+            permit.release(used_tokens, error)
+
+    def abandon(self, used_tokens=None):
+        """放弃该请求并关闭连接（可在任意线程调用）"""
+        with self._lock:
+            self.abandoned = True
+            stream = self.stream
+        if stream is not None:
+            stream.close()
+        self.release(used_tokens)
+
+@profiling.staged("route")
+def _open_routed_stream(messages, params, cancel=None, request_metrics=None):
+    """按路由顺序打开流式请求，返回 (attempt, iterator, 第一个数据块)；取消时返回None
+
+    所有端点都因过载、超时或连接失败而失败时，按带抖动的指数退避（不短于 Retry-After）
+    等待后整体重试，最多 rate_limit.max_retries 次；其他错误直接抛出。
+    """
+    settings = ConfigLoader().config['rate_limit']
+    # 未启用客户端限流时由SDK按 http.max_retries 自行重试
+    max_retries = settings['max_retries'] if settings['enabled'] else 0
+    for retry in itertools.count():
+        try:
+            return _race_endpoints(messages, params, cancel, request_metrics)
+        except Exception as e:
+            if retry >= max_retries or not _is_retryable(e):
+                raise
+            delay = backoff_delay(retry, e)
+            logging.warning(f"请求失败，{delay:.1f}秒后第{retry + 1}次重试：{e}")
+        if cancel is not None:
+            if cancel.wait(delay):
+                return None
+        else:
+            time.sleep(delay)
+
+def _race_endpoints(messages, params, cancel=None, request_metrics=None):
+    """按路由顺序打开流式请求，返回 (attempt, iterator, 第一个数据块)；取消时返回None
+
+    首选端点超过其首块延迟高分位数仍无响应时，向次选端点发起对冲请求，
+    先返回数据的请求胜出，另一个立即关闭；请求出错时依次切换到下一个端点。
+    """
+    router = get_router()
+    ranked = router.ranked()
+    hedge = ConfigLoader().config['routing']['hedge'] and len(ranked) > 1
+    results = queue.Queue()
+    attempts = [_StreamAttempt(ranked[0], messages, params, results)]
+    hedge_at = time.monotonic() + router.hedge_delay(ranked[0]) if hedge else None
+    pending = 1
+    last_error = None
+    # 之前各轮重试已发出的请求数
+    previous_attempts = request_metrics.attempts if request_metrics is not None else 0
+
+    def abandon_all(keep=None):
+        for attempt in attempts:
+            if attempt is not keep:
+                attempt.abandon()
+
+    while pending:
+        try:
+            attempt, iterator, first, error, latency = results.get(timeout=0.2)
+        except queue.Empty:
+            if cancel is not None and cancel.cancelled:
+                abandon_all()
+                return None
+            if hedge_at is not None and time.monotonic() >= hedge_at and len(attempts) < len(ranked):
+                hedge_at = None
+                logging.info(f"端点 {ranked[0]['name']} 响应慢，向 {ranked[len(attempts)]['name']} 发起对冲请求")
+                attempts.append(_StreamAttempt(ranked[len(attempts)], messages, params, results))
+                pending += 1
+            continue
+
+        pending -= 1
+        attempt.finished = True
+        if request_metrics is not None:
+            request_metrics.attempts = previous_attempts + len(attempts)
+            request_metrics.retries = request_metrics.attempts - 1
+        if attempt.abandoned:
+            continue
+        if error is not None:
+            router.record_failure(attempt.endpoint)
+            last_error = error
+            if pending == 0 and len(attempts) < len(ranked) and not (cancel is not None and cancel.cancelled):
+                logging.warning(f"端点 {attempt.endpoint['name']} 请求失败，切换到 {ranked[len(attempts)]['name']}：{error}")
+                attempts.append(_StreamAttempt(ranked[len(attempts)], messages, params, results))
+                pending += 1
+            continue
+
+        router.record_success(attempt.endpoint, latency)
+        for loser in attempts:
+            if loser is not attempt and not loser.finished:
+                router.record_latency(loser.endpoint, time.perf_counter() - loser.started_at)
+        abandon_all(keep=attempt)
+        return attempt, iterator, first
+
+    if cancel is not None and cancel.cancelled:
         return None
+    raise last_error
+
+def estimate_tokens(text):
+    """本地粗略估算token数：中日韩字符按每字1个token，其余字符按每4个字符1个token"""
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uf900' <= ch <= '\ufaff')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def metrics_registry():
+    """返回指标汇总对象，并同步配置中的Prometheus输出路径"""
+    registry = metrics.get_registry()
+    registry.prometheus_file = ConfigLoader().config['metrics']['prometheus_file']
+    return registry
+
+def _stream_chat(messages, params, cancel=None, request_metrics=None):
+    """发起流式补全请求并逐块产出文本（只取第一个候选，其余行为见 _stream_choices）"""
+    choices = _stream_choices(messages, params, cancel, request_metrics)
+    try:
+        for _, delta in choices:
+            yield delta
+    finally:
+        choices.close()
+
+def _stream_choices(messages, params, cancel=None, request_metrics=None, finish_reasons=None):
+    """发起流式补全请求并逐块产出 (候选序号, 文本)
+
+    params 中带 n 时服务端在同一个流中交替返回多个候选。
+    端点由 EndpointRouter 选择，必要时发起对冲请求（见 _open_routed_stream）。
+    cancel 被触发时关闭连接并静默结束产出，调用方通过 cancel.cancelled 判断是否完整。
+    请求结束后将连接耗时、首字延迟、token用量等写入 request_metrics 并记录到指标日志；
+    request_metrics.finish_reason 为第一个候选的结束原因，finish_reasons 为字典时记录每个候选的结束原因。
+    """
+    if cancel is not None and cancel.cancelled:
+        return
+    m = request_metrics if request_metrics is not None else metrics.RequestMetrics("chat")
+    attempt = None
+    usage = None
+    completion_chars = []
+    try:
+        opened = _open_routed_stream(messages, params, cancel, m)
+        if opened is None:
+            return
+        attempt, iterator, first = opened
+        m.endpoint = attempt.endpoint['name']
+        m.model = attempt.endpoint['model']
+        m.queue_wait = attempt.queue_wait
+        m.connect_time = attempt.connect_time
+        if cancel is not None:
+            cancel.register(attempt.abandon)
+        chunks = itertools.chain([first], iterator) if first is not None else iterator
+        # 剖析时逐块计时：等待网络与SDK解析数据块的时间
+        chunks = profiling.timed_iter(chunks, "stream")
+        for chunk in chunks:
+            if cancel is not None and cancel.cancelled:
+                break
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            for choice in chunk.choices:
+                index = choice.index or 0
+                if choice.finish_reason:
+                    if index == 0:
+                        m.finish_reason = choice.finish_reason
+                    if finish_reasons is not None:
+                        finish_reasons[index] = choice.finish_reason
+                if choice.delta.content:
+                    delta = choice.delta.content
+                    if m.ttft is None:
+                        m.ttft = m.elapsed()
+                    m.output_bytes += len(delta.encode('utf-8'))
+                    completion_chars.append(delta)
+                    yield index, delta
+        m.success = not (cancel is not None and cancel.cancelled)
+        if not m.success:
+            m.error = "已取消"
+    except Exception as e:
+        # 取消时主动关闭连接会让读取抛出异常，属于正常结束
+        if cancel is None or not cancel.cancelled:
+            m.error = str(e)
+            if attempt is not None:
+                get_router().record_failure(attempt.endpoint)
+            raise
+        m.error = "已取消"
+    finally:
+        m.total_latency = m.elapsed()
+        if usage is not None:
+            m.prompt_tokens = usage.prompt_tokens or 0
+            m.completion_tokens = usage.completion_tokens or 0
+        else:
+            m.usage_estimated = True
+            m.prompt_tokens = sum(estimate_tokens(msg['content']) for msg in messages)
+            m.completion_tokens = estimate_tokens("".join(completion_chars))
+        if attempt is not None:
+            if cancel is not None:
+                cancel.unregister(attempt.abandon)
+            # 关闭连接并归还限流名额，token桶按实际用量结算
+            attempt.abandon(m.prompt_tokens + m.completion_tokens)
+        metrics_registry().record_request(m)
+
+CONTINUE_PROMPT = "上面的输出因长度限制被截断。请从截断处紧接着继续输出，不要重复已输出的内容，不要添加任何说明。"
+# 续写请求只附带已输出内容的末尾，节省提示词token
+CONTINUATION_TAIL_CHARS = 2000
+# 续写开头与已输出末尾可能重复，最多检查这么多字符；短于 MIN_OVERLAP_CHARS 的重合视为巧合
+OVERLAP_CHECK_CHARS = 200
+MIN_OVERLAP_CHARS = 10
+
+def _continuation_messages(messages, produced):
+    tail = produced[-CONTINUATION_TAIL_CHARS:]
+    return messages + [
+        {"role": "assistant", "content": tail},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+def _strip_overlap(produced, text):
+    """去掉续写开头与已输出末尾重复的部分"""
+    tail = produced[-OVERLAP_CHECK_CHARS:]
+    for size in range(min(len(tail), len(text)), MIN_OVERLAP_CHARS - 1, -1):
+        if tail.endswith(text[:size]):
+            return text[size:]
+    return text
+
+def _stream_document(messages, cancel=None, kind="chat", budget=None, requests=None, prefix=""):
+    """流式生成并在输出被截断（finish_reason == "length"）时自动续写
+
+    续写请求只带上已输出内容的末尾，从截断处接着生成而不是整篇重来；
+    每次请求的 max_tokens 按上下文窗口与 budget 剩余额度确定。
+    续写次数或额度用完仍未结束时抛出 GenerationTruncated（已产出的内容不会撤回）。
+    requests 为列表时，每次请求的 RequestMetrics 会追加到其中。
+    prefix 为此前已得到的开头部分（如中断任务的部分文件）时，第一次请求即为续写，只产出新内容。
+    """
+    if budget is None:
+        budget = TokenBudget()
+    max_continuations = ConfigLoader().config['generation_params']['max_continuations']
+    produced = [prefix] if prefix else []
+    request_messages = _continuation_messages(messages, prefix) if prefix else messages
+    for round_index in range(max_continuations + 1):
+        params = _generation_params(request_messages)
+        prompt_tokens = estimate_prompt_tokens(request_messages)
+        granted = budget.reserve(prompt_tokens, params.get("max_tokens"))
+        if granted:
+            params["max_tokens"] = granted
+        continuing = bool(round_index or prefix)
+        m = metrics.RequestMetrics(f"{kind}-continue" if continuing else kind)
+        if requests is not None:
+            requests.append(m)
+        pending = "" if continuing else None
+        for delta in _stream_chat(request_messages, params, cancel, m):
+            if pending is not None:
+                # 续写的开头先缓冲，去掉与已输出内容重复的部分后再产出
+                pending += delta
+                if len(pending) < OVERLAP_CHECK_CHARS:
+                    continue
+                delta, pending = _strip_overlap("".join(produced), pending), None
+            if delta:
+                produced.append(delta)
+                yield delta
+        if pending:
+            pending = _strip_overlap("".join(produced), pending)
+            produced.append(pending)
+            yield pending
+        budget.settle(prompt_tokens + (granted or 0), m.prompt_tokens + m.completion_tokens)
+        if (cancel is not None and cancel.cancelled) or m.finish_reason != "length":
+            return
+        if round_index == max_continuations:
+            break
+        logging.info(f"输出被截断（已生成{sum(map(len, produced))}字），第{round_index + 1}次续写")
+        request_messages = _continuation_messages(messages, "".join(produced))
+    raise GenerationTruncated(f"输出被截断：已续写{max_continuations}次仍未完成")
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def _coalesce(key, func, cancel=None):
+    """合并并发的相同请求：同一键只有第一个调用者真正执行func，其余等待并共享结果
+
+    等待中的调用者被自己的 cancel 取消时立即抛出 GenerationCancelled，不影响正在执行的请求。
+    """
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _InFlightCall()
+            _inflight[key] = call
+
+    if not leader:
+        while not call.done.wait(0.1):
+            if cancel is not None and cancel.cancelled:
+                raise GenerationCancelled()
+        if isinstance(call.error, GenerationCancelled):
+            # 被取消的是发起请求的那个任务，本任务并未取消，重新发起
+            return _coalesce(key, func, cancel)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = func()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+def _complete(messages, use_cache=True, cancel=None, kind="chat", budget=None, requests=None):
+    """发起一次补全请求并返回完整文本，带磁盘缓存与并发请求合并
+
+    底层使用流式传输，以便取消时能立即中断连接；取消时抛出 GenerationCancelled。
+    输出被截断时自动续写（见 _stream_document）。
+    """
+    params = _generation_params()
+    key = ResponseCache.make_key(*_cache_identity(), messages, params)
+    cache = get_response_cache() if use_cache else None
+
+    if cache is not None:
+        content = cache.get(key)
+        if content is not None:
+            return content
+
+    def call():
+        content = "".join(_stream_document(messages, cancel, kind, budget, requests))
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled()
+        if cache is not None and content:
+            cache.put(key, content, _cache_identity()[0])
+        return content
+
+    return _coalesce(key, call, cancel)
+
+# 各章节流程图的最少节点数（与 DOCUMENT_SECTIONS 中的撰写要求一致）
+FLOWCHART_MIN_NODES = {4: 5}
+REPAIR_PROMPT = "你是Markdown技术文档的格式修复助手。只修复给定片段中的语法问题，保持原有技术内容和含义不变，只输出修复后的片段，不要输出任何解释。"
+# 修复请求附带的片段前文长度
+REPAIR_CONTEXT_CHARS = 300
+
+def _repair_messages(text, issue):
+    if issue.kind == "mermaid":
+        target = "Mermaid流程图（使用graph TD/LR语法，输出完整的```mermaid代码块）"
+    else:
+        target = "LaTeX公式（行内公式用$...$，独立公式用$$...$$，输出包含定界符的完整片段）"
+    context = text[max(0, issue.start - REPAIR_CONTEXT_CHARS):issue.start]
+    problems = "\n".join(f"- {problem}" for problem in issue.problems)
+    return [
+        {"role": "system", "content": REPAIR_PROMPT},
+        {"role": "user", "content": f"以下{target}存在问题：\n{problems}\n\n"
+                                    f"片段前文（仅供参考，不要输出）：\n{context}\n\n需要修复的片段：\n{issue.text}"},
+    ]
+
+def _extract_repair(issue, reply):
+    """从修复回复中取出替换片段，无法识别时返回None"""
+    reply = reply.strip()
+    if issue.kind == "mermaid":
+        match = validation.MERMAID_BLOCK.search(reply + ("\n" if not reply.endswith("\n") else ""))
+        if match:
+            return match.group(0)
+        if reply.startswith(("graph", "flowchart")):
+            return f"```mermaid\n{reply}\n```"
+        return None
+    reply = re.sub(r"^```\w*\n|\n```$", "", reply).strip()
+    return reply or None
+
+# 修复结果明显长于原片段时，视为模型输出了片段以外的内容
+MAX_REPAIR_GROWTH = 500
+
+def _repair_is_valid(issue, snippet):
+    if len(snippet) > 2 * len(issue.text) + MAX_REPAIR_GROWTH:
+        return False
+    if issue.kind == "mermaid":
+        problems, node_count = validation.check_mermaid(validation.MERMAID_BLOCK.search(snippet).group(1))
+        return not problems and node_count >= FLOWCHART_MIN_NODES.get(issue.section, 0)
+    return not validation.find_latex_issues(snippet)
+
+@profiling.staged("validate")
+def postprocess_document(text, repair=None, use_cache=True, cancel=None):
+    """离线校验全文中的流程图与公式，只把有问题的片段发回模型修复并拼回原文
+
+    返回 (处理后的全文, validation.ValidationReport)。每个片段单独请求，
+    修复结果再次离线校验，未通过时最多重试 validation.max_repair_rounds 次，仍失败则保留原文。
+    """
+    settings = ConfigLoader().config['validation']
+    report = validation.ValidationReport()
+    if not settings['enabled']:
+        return text, report
+    repair = settings['repair'] if repair is None else repair
+
+    start = time.perf_counter()
+    report.issues = validation.validate_document(text, FLOWCHART_MIN_NODES)
+    report.validation_time = time.perf_counter() - start
+    repairable = [issue for issue in report.issues if issue.repairable]
+    report.unresolved = [issue for issue in report.issues if not issue.repairable]
+    if not repairable or not repair:
+        report.unresolved = list(report.issues)
+        return text, report
+
+    requests = []
+
+    def repair_issue(issue):
+        messages = _repair_messages(text, issue)
+        for round_index in range(settings['max_repair_rounds']):
+            # 重试时不读缓存，避免再次拿到同一个不合格的回复
+            reply = _complete(messages, use_cache and round_index == 0, cancel, kind=f"repair-{issue.kind}",
+                              requests=requests)
+            snippet = _extract_repair(issue, reply)
+            if snippet is not None and _repair_is_valid(issue, snippet):
+                return snippet
+        return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(len(repairable), 4)) as pool:
+        results = list(pool.map(profiling.bind(repair_issue), repairable))
+    report.repair_time = time.perf_counter() - start
+    report.repair_requests = len(requests)
+    report.repair_prompt_tokens = sum(m.prompt_tokens for m in requests)
+    report.repair_completion_tokens = sum(m.completion_tokens for m in requests)
+
+    # 从后往前替换，前面片段的偏移量不受影响；与已替换片段重叠的修复不再拼接
+    boundary = len(text)
+    for issue, snippet in sorted(zip(repairable, results), key=lambda item: -item[0].start):
+        if snippet is None or issue.end > boundary:
+            report.unresolved.append(issue)
+            continue
+        text = text[:issue.start] + snippet + text[issue.end:]
+        boundary = issue.start
+        report.repaired += 1
+    return text, report
+
+def _record_validation(report):
+    if report.issues:
+        logging.info(f"校验发现{len(report.issues)}处问题，已修复{report.repaired}处")
+    metrics_registry().record_event("validation", **report.to_dict())
+
+def generate_patent_document(title, ideas, use_cache=True, candidates=None):
+    """生成专利交底书全文；use_cache=False 时跳过缓存读取强制重新生成
+
+    candidates 大于1时一次请求多份候选稿，返回评分最高的一份（见 generate_patent_candidates），
+    默认使用 generation_params.candidates。
+    请求失败（重试用完后）时抛出异常，而不是返回None。
+    """
+    candidates = candidates or ConfigLoader().config['generation_params']['candidates']
+    if candidates > 1:
+        return generate_patent_candidates(title, ideas, candidates, use_cache)[0].content
+    content = _complete(build_messages(title, ideas), use_cache, kind="document")
+    content, report = postprocess_document(content, use_cache=use_cache)
+    _record_validation(report)
+    return content
+
+# 候选稿评分的硬性要求（与 DOCUMENT_SECTIONS 中的撰写要求一致）
+CANDIDATE_MIN_CHARS = {4: 1000}
+CANDIDATE_MIN_NODES = {2: 1, **FLOWCHART_MIN_NODES}
+CANDIDATE_MIN_TABLE_ROWS = {6: 5}
+
+def score_document(text):
+    """按提示词的硬性要求离线评分，返回 scoring.CandidateScore"""
+    return scoring.score_document(text, parse_document(text).sections, [section[0] for section in DOCUMENT_SECTIONS],
+                                  CANDIDATE_MIN_CHARS, CANDIDATE_MIN_NODES, CANDIDATE_MIN_TABLE_ROWS)
+
+class Candidate:
+    """一份候选稿：index 为其在请求中的序号，score 为 scoring.CandidateScore"""
+
+    def __init__(self, index, content, score):
+        self.index = index
+        self.content = content
+        self.score = score
+
+# 拒绝 n 参数或只返回一个候选的模型（按 _cache_identity），之后直接并发单独请求
+_n_unsupported = set()
+
+def _request_candidates(messages, n, cancel=None, requests=None, on_delta=None):
+    """生成 n 份候选稿的原始文本，按候选序号返回列表
+
+    优先在一次请求中用 n 参数取得全部候选，共享的提示词只计一次费用；
+    端点拒绝该参数或返回的候选不足时，缺少的部分改为并发单独请求。
+    输出被截断的候选各自续写（见 _stream_document 的 prefix）。
+    on_delta(文本) 在收到每个文本块时回调，可能在多个线程中调用。
+    n 份候选（含续写与单独请求）共用 n 篇文档的token额度；额度不足时抛出 GenerationTruncated。
+    """
+    identity = _cache_identity()
+    config = ConfigLoader().config['generation_params']
+    budget = TokenBudget(config['max_document_tokens'] * n)
+    texts = {}
+    finish_reasons = {}
+    if n > 1 and config['use_n'] and identity not in _n_unsupported:
+        params = dict(_generation_params(messages), n=n)
+        # 共享的提示词只预留一次，每份候选各预留 max_tokens
+        prompt_tokens = estimate_prompt_tokens(messages)
+        max_tokens = params.get("max_tokens")
+        granted = budget.reserve(prompt_tokens, max_tokens * n if max_tokens else None)
+        if granted:
+            params["max_tokens"] = granted // n
+        m = metrics.RequestMetrics("candidates")
+        if requests is not None:
+            requests.append(m)
+        try:
+            for index, delta in _stream_choices(messages, params, cancel, m, finish_reasons):
+                texts.setdefault(index, []).append(delta)
+                if on_delta is not None:
+                    on_delta(delta)
+        except Exception as e:
+            if texts or _status_code(e) not in (400, 422):
+                raise
+            logging.warning(f"端点不支持 n 参数，改为并发请求{n}份候选：{e}")
+            _n_unsupported.add(identity)
+        finally:
+            budget.settle(prompt_tokens + (granted or 0), m.prompt_tokens + m.completion_tokens)
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled()
+        if texts and len(texts) < n:
+            logging.warning(f"端点只返回了{len(texts)}份候选，其余改为并发请求")
+            _n_unsupported.add(identity)
+    texts = ["".join(parts) for _, parts in sorted(texts.items())][:n]
+
+    def complete(prefix=""):
+        parts = []
+        for delta in _stream_document(messages, cancel, "candidate", budget, requests, prefix):
+            parts.append(delta)
+            if on_delta is not None:
+                on_delta(delta)
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled()
+        return prefix + "".join(parts)
+
+    truncated = [index for index in range(len(texts)) if finish_reasons.get(index) == "length"]
+    missing = n - len(texts)
+    if not truncated and not missing:
+        return texts
+    with ThreadPoolExecutor(max_workers=len(truncated) + missing) as pool:
+        continued = {index: pool.submit(profiling.bind(complete), texts[index]) for index in truncated}
+        extra = [pool.submit(profiling.bind(complete)) for _ in range(missing)]
+        for index, future in continued.items():
+            texts[index] = future.result()
+        texts.extend(future.result() for future in extra)
+    return texts
+
+def generate_patent_candidates(title, ideas, n=None, use_cache=True, cancel=None, stats=None, on_delta=None):
+    """一次请求生成 n 份候选交底书，离线评分后按得分从高到低返回 Candidate 列表
+
+    评分只做本地检查（见 score_document）；只有得分最高的一份再做流程图与公式的校验修复，
+    其余候选保留模型的原始输出。全部候选作为一条缓存保存。
+    stats 为 StreamStats 时记录首字时间、字数与每次上游请求；on_delta 见 _request_candidates。
+    cancel 被触发时抛出 GenerationCancelled。
+    """
+    n = max(1, n or ConfigLoader().config['generation_params']['candidates'])
+    if stats is None:
+        stats = StreamStats()
+    messages = build_messages(title, ideas)
+    params = dict(_generation_params(), n=n)
+    cache = get_response_cache() if use_cache else None
+    key = ResponseCache.make_key(*_cache_identity(), messages, params)
+    cached = cache.get(key) if cache is not None else None
+    lock = threading.Lock()
+
+    def received(delta):
+        with lock:
+            if stats.first_token_at is None:
+                stats.first_token_at = time.perf_counter()
+            stats.chars += len(delta)
+            stats.bytes += len(delta.encode("utf-8"))
+        if on_delta is not None:
+            on_delta(delta)
+
+    try:
+        if cached is not None:
+            texts = json.loads(cached)
+            for text in texts:
+                received(text)
+        else:
+            texts = _request_candidates(messages, n, cancel, stats.requests, received)
+            if cache is not None and all(texts):
+                cache.put(key, json.dumps(texts, ensure_ascii=False), _cache_identity()[0])
+        candidates = [Candidate(index, text, score_document(text)) for index, text in enumerate(texts)]
+        candidates.sort(key=lambda candidate: candidate.score.sort_key(), reverse=True)
+        best = candidates[0]
+        best.content, stats.validation = postprocess_document(best.content, use_cache=use_cache, cancel=cancel)
+        _record_validation(stats.validation)
+        best.score = score_document(best.content)
+        stats.completed = True
+    finally:
+        stats.finished_at = time.perf_counter()
+    metrics_registry().record_event("candidates", title=title, count=n, chosen=best.index,
+                                    scores=[candidate.score.to_dict() for candidate in candidates])
+    logging.info(f"[{title}] {n}份候选稿得分：" + "，".join(f"#{c.index + 1} {c.score.score}" for c in candidates))
+    return candidates
+
+def write_candidates(out_path, candidates):
+    """得分最高的候选写入 out_path，其余写在旁边（“<文件名>_候选2.md”等），返回全部保存路径"""
+    stem, extension = os.path.splitext(out_path)
+    paths = [out_path]
+    write_document(out_path, candidates[0].content)
+    for rank, candidate in enumerate(candidates[1:], start=2):
+        path = f"{stem}_候选{rank}{extension}"
+        write_document(path, candidate.content)
+        paths.append(path)
+    return paths
+
+INGEST_MAP_PROMPT = ("你是资深专利工程师，正在阅读一项发明的技术资料（设计文档、代码摘录或测试报告）的一个片段。"
+                     "请提炼其中与发明创造相关的要点：要解决的技术问题、关键技术手段（模块、步骤、算法、参数）、"
+                     "关键数据与实测效果。只依据片段内容，不要臆造；没有相关内容时只输出“无”。"
+                     "以要点列表输出，不超过{limit}字，不要输出任何说明。")
+INGEST_REDUCE_PROMPT = ("你是资深专利工程师。下面是从同一项发明的技术资料中逐段提炼的要点，"
+                        "请合并去重，整理为撰写专利交底书用的创意要点：依次写明要解决的技术问题、核心技术方案"
+                        "（关键模块与步骤、算法与参数）、与现有做法相比的改进与效果（尽量保留实测数据）。"
+                        "以编号要点列表输出，不超过{limit}字，不要输出任何说明。")
+# 片段中没有相关内容时模型的回答，合并时略去
+EMPTY_SUMMARY = "无"
+
+class IngestResult:
+    """资料导入结果：ideas 为合并后的创意要点；reused 为复用已有摘要的片段数"""
+
+    def __init__(self, ideas, chunks, reused, elapsed):
+        self.ideas = ideas
+        self.chunks = chunks
+        self.reused = reused
+        self.elapsed = elapsed
+
+    @property
+    def summarized(self):
+        return self.chunks - self.reused
+
+def _ingest_map_messages(chunk):
+    limit = ConfigLoader().config['ingest']['summary_chars']
+    return [
+        {"role": "system", "content": INGEST_MAP_PROMPT.format(limit=limit)},
+        {"role": "user", "content": chunk.text},
+    ]
+
+def _ingest_reduce_messages(summaries, title="", ideas="", limit=None):
+    limit = limit or ConfigLoader().config['ingest']['summary_chars']
+    parts = []
+    if title:
+        parts.append(f"发明名称：{title}")
+    if ideas:
+        parts.append(f"已有的创意要点（须保留）：\n{ideas}")
+    parts.append("逐段提炼的要点：\n\n" + "\n\n".join(summaries))
+    return [
+        {"role": "system", "content": INGEST_REDUCE_PROMPT.format(limit=limit)},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
+
+def _summarize_chunk(chunk, store, cancel=None, requests=None):
+    """摘要一个片段，返回 (摘要, 是否复用了已有摘要)
+
+    摘要按“提示词 + 模型 + 片段内容”的哈希保存在摘要库中，与发明名称无关，
+    同一片段在不同文档、不同任务中都可复用。
+    """
+    messages = _ingest_map_messages(chunk)
+    key = ResponseCache.make_key(*_cache_identity(), messages, _generation_params())
+    summary = store.get(key)
+    if summary is not None:
+        return summary, True
+    summary = _complete(messages, use_cache=False, cancel=cancel, kind="ingest-map", requests=requests).strip()
+    if summary:
+        store.put(key, summary)
+    return summary, False
+
+def _reduce_summaries(summaries, title, ideas, cancel=None, requests=None):
+    """分层合并片段摘要：每次合并不超过 reduce_input_chars 字，直到只剩一组，最后一次合并带上发明名称"""
+    settings = ConfigLoader().config['ingest']
+    summaries = [s for s in summaries if s and s != EMPTY_SUMMARY]
+    if not summaries:
+        return ideas
+    while True:
+        groups = [[]]
+        size = 0
+        for summary in summaries:
+            # 每组至少两条，保证每一轮都在减少摘要数
+            if len(groups[-1]) >= 2 and size + len(summary) > settings['reduce_input_chars']:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += len(summary)
+        if len(groups) > 1 and len(groups[-1]) == 1:
+            groups[-2].extend(groups.pop())
+        if len(groups) == 1:
+            break
+        with ThreadPoolExecutor(max_workers=settings['workers']) as pool:
+            futures = [pool.submit(profiling.bind(_complete), _ingest_reduce_messages(group), True, cancel,
+                                   "ingest-reduce", None, requests)
+                       for group in groups]
+            summaries = [future.result().strip() for future in futures]
+    return _complete(_ingest_reduce_messages(summaries, title, ideas, settings['ideas_chars']), True, cancel,
+                     kind="ingest-reduce", requests=requests).strip()
+
+def ingest_sources(paths, title="", ideas="", cancel=None, on_progress=None, requests=None):
+    """把本地技术资料（TXT、MD、DOCX、PDF）摘要为交底书的创意要点，返回 IngestResult
+
+    资料逐个流式读取并切成片段（见 ingest.iter_chunks），片段一边读取一边提交给 ingest.workers 个线程摘要
+    （map），在途片段不超过线程数的两倍，内存占用与资料大小无关；全部摘要再分层合并为创意要点（reduce）。
+    已摘要过的片段直接复用摘要库中的结果，修改过的资料只会重新摘要内容变化的片段。
+    title、ideas 为已填写的发明名称与创意要点，合并时用于取舍并保留已有要点。
+    on_progress(已完成数, 已读取的片段数, 复用数) 在每个片段完成时回调（在工作线程中调用）。
+    资料无法读取时抛出 ingest.IngestError；cancel 被触发时抛出 GenerationCancelled。
+    """
+    settings = ConfigLoader().config['ingest']
+    store = get_ingest_store()
+    started = time.perf_counter()
+    summaries = []
+    pending = []
+    total = done = reused = 0
+    lock = threading.Lock()
+
+    def summarize(chunk):
+        nonlocal done, reused
+        summary, hit = _summarize_chunk(chunk, store, cancel, requests)
+        with lock:
+            done += 1
+            reused += hit
+            progress = done, total, reused
+        if on_progress is not None:
+            on_progress(*progress)
+        return summary
+
+    pool = ThreadPoolExecutor(max_workers=settings['workers'])
+    try:
+        for path in paths:
+            for chunk in ingest.iter_chunks(path, settings['chunk_chars'], settings['max_chunk_chars']):
+                if cancel is not None and cancel.cancelled:
+                    raise GenerationCancelled()
+                with lock:
+                    total += 1
+                pending.append(pool.submit(profiling.bind(summarize), chunk))
+                # 在途片段过多时先等最早的完成，读取速度不会远超摘要速度
+                while len(pending) >= settings['workers'] * 2:
+                    summaries.append(pending.pop(0).result())
+        summaries.extend(future.result() for future in pending)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if cancel is not None and cancel.cancelled:
+        raise GenerationCancelled()
+    result_ideas = _reduce_summaries(summaries, title, ideas, cancel, requests)
+    try:
+        store.purge(settings['keep_days'])
+    except Exception as e:
+        logging.warning(f"清理过期的资料摘要失败: {e}")
+    result = IngestResult(result_ideas, total, reused, time.perf_counter() - started)
+    metrics_registry().record_event("ingest", files=len(paths), chunks=result.chunks, reused=result.reused,
+                                    elapsed=round(result.elapsed, 3))
+    logging.info(f"资料导入完成：{len(paths)}个文件，{result.chunks}个片段（复用{result.reused}个），"
+                 f"耗时{result.elapsed:.1f}秒")
+    return result
+
+def build_section_messages(title, ideas, section, context=None):
+    """构造单个章节的生成消息
+
+    context 为依赖章节的已完成内容 {序号: 文本}，用于保持各章节术语和方案一致。
+    """
+    number, name = section[0], section[1]
+    outline = "\n".join(f"{n}. {nm}" for n, nm, *_ in DOCUMENT_SECTIONS)
+    prompt = (
+        f"{PROMPT_HEADER}\n\n{outline}\n\n"
+        f"本次只撰写其中第{number}部分，要求如下：\n{_section_requirements(section)}\n\n"
+        f"当前发明名称：{title}\n创意要点：{ideas}\n"
+    )
+    if number in PRIOR_ART_SECTIONS:
+        prompt += _prior_art_prompt(find_prior_art(title, ideas))
+    if context:
+        related = "\n\n".join(context[n] for n in sorted(context))
+        prompt += f"\n以下是已完成的相关章节，请保持术语和技术方案一致：\n\n{related}\n"
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": f"请只输出第{number}部分的内容，以“## {number}. {name}”作为标题，不要输出其他部分。"}
+    ]
+
+def _normalize_section(section, text):
+    """确保章节内容以统一的“## 序号. 标题”开头，便于按固定顺序拼接"""
+    number, name = section[0], section[1]
+    text = (text or "").strip()
+    first_line = text.split("\n", 1)[0]
+    if re.match(rf"^#*\s*{number}[\.、．]", first_line):
+        text = text.split("\n", 1)[1].strip() if "\n" in text else ""
+    return f"## {number}. {name}\n\n{text}"
+
+def generate_patent_document_parallel(title, ideas, use_cache=True, max_workers=None, on_section=None,
+                                     cancel=None):
+    """分章节并发生成专利交底书，并按固定顺序拼接为完整文档
+
+    每个章节单独请求，只等待其依赖的章节（见 DOCUMENT_SECTIONS）。
+    on_section(序号, 内容) 在每个章节完成时回调（在工作线程中调用）。
+    任一章节失败时抛出异常；cancel 被触发时抛出 GenerationCancelled。
+    generation_params.max_document_tokens 限制的是全部章节请求的token总和。
+    """
+    max_workers = max_workers or len(DOCUMENT_SECTIONS)
+    futures = {}
+    budget = TokenBudget()
+
+    def generate_section(section):
+        # 依赖章节总是先于本章节提交，线程池按提交顺序取任务，因此等待不会死锁
+        context = {n: futures[n].result() for n in section[4]}
+        content = _complete(build_section_messages(title, ideas, section, context), use_cache, cancel,
+                            kind=f"section{section[0]}", budget=budget)
+        content = _normalize_section(section, content)
+        if on_section is not None:
+            on_section(section[0], content)
+        return content
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for section in DOCUMENT_SECTIONS:
+            futures[section[0]] = pool.submit(profiling.bind(generate_section), section)
+        sections = [futures[section[0]].result() for section in DOCUMENT_SECTIONS]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    content, report = postprocess_document(f"# {title} 专利交底书\n\n" + "\n\n".join(sections) + "\n",
+                                           use_cache=use_cache, cancel=cancel)
+    _record_validation(report)
+    return content
+
+# 章节标题行：“## 4. 本发明技术详细方案”“4、本发明技术详细方案”“**4. 本发明技术详细方案**”等
+SECTION_HEADING_PATTERN = r"^\s*(#+\s*)?(\*\*)?\s*{number}\s*[\.、．]\s*(.*)$"
+# 重新生成章节时，非直接相关的章节只附带开头这么多字作为上下文
+CONTEXT_EXCERPT_CHARS = 300
+
+class ParsedDocument:
+    """按章节拆分的交底书：preamble 为首个章节之前的内容（文档标题等），sections 为 {序号: 章节全文}"""
+
+    def __init__(self, preamble, sections):
+        self.preamble = preamble
+        self.sections = sections
+
+    @property
+    def title(self):
+        """从“# 发明名称 专利交底书”形式的文档标题中取出发明名称，找不到时返回空字符串"""
+        match = re.search(r"^#\s*(.+?)\s*(专利交底书)?\s*$", self.preamble, re.M)
+        return match.group(1) if match else ""
+
+    def render(self):
+        parts = [self.preamble.rstrip()] if self.preamble.strip() else []
+        parts += [self.sections[number].strip() for number in sorted(self.sections)]
+        return "\n\n".join(parts) + "\n"
+
+def parse_document(text):
+    """将交底书全文拆分为 ParsedDocument
+
+    按 DOCUMENT_SECTIONS 的顺序依次查找各章节标题；以“#”开头或包含章节名称的序号行才视为标题，
+    以免把章节内的编号列表误认为标题。缺失的章节不会出现在 sections 中。
+    """
+    lines = text.splitlines()
+    starts = []
+    position = 0
+    for number, name, *_ in DOCUMENT_SECTIONS:
+        pattern = re.compile(SECTION_HEADING_PATTERN.format(number=number))
+        for index in range(position, len(lines)):
+            match = pattern.match(lines[index])
+            if match and (match.group(1) or name in match.group(3)):
+                starts.append((number, index))
+                position = index + 1
+                break
+    if not starts:
+        return ParsedDocument(text, {})
+    sections = {}
+    for i, (number, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else len(lines)
+        sections[number] = "\n".join(lines[start:end]).strip()
+    return ParsedDocument("\n".join(lines[:starts[0][1]]), sections)
+
+def _regeneration_context(document, section):
+    """重新生成某章节时的上下文：直接依赖与被依赖的章节给全文，其余章节只给开头摘录"""
+    number = section[0]
+    related = set(section[4]) | {s[0] for s in DOCUMENT_SECTIONS if number in s[4]}
+    context = {}
+    for other, text in document.sections.items():
+        if other == number:
+            continue
+        if other in related or len(text) <= CONTEXT_EXCERPT_CHARS:
+            context[other] = text
+        else:
+            context[other] = text[:CONTEXT_EXCERPT_CHARS] + "……（节选）"
+    return context
+
+def regenerate_sections(path, numbers, ideas="", title=None, feedback="", use_cache=False,
+                        on_section=None, cancel=None):
+    """只重新生成已保存交底书中的指定章节，并原地改写文件
+
+    其余章节作为上下文（见 _regeneration_context），请求量与所选章节的篇幅相当，而不是整篇文档。
+    多个章节按序号依次生成，先生成的新内容会作为后续章节的上下文。
+    feedback 为审阅意见，会附加到每个章节的请求中。返回改写后的全文。
+    文件中找不到所选章节时抛出 ValueError；cancel 被触发时抛出 GenerationCancelled，文件保持不变。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        document = parse_document(f.read())
+    missing = [number for number in numbers if number not in document.sections]
+    if missing:
+        raise ValueError(f"文件中未找到第{'、'.join(map(str, missing))}部分")
+    title = title or document.title or os.path.splitext(os.path.basename(path))[0]
+    budget = TokenBudget()
+
+    for section in DOCUMENT_SECTIONS:
+        number = section[0]
+        if number not in numbers:
+            continue
+        messages = build_section_messages(title, ideas, section, _regeneration_context(document, section))
+        if feedback:
+            messages[-1]["content"] += f"\n审阅意见：{feedback}"
+        content = _complete(messages, use_cache, cancel, kind=f"regenerate{number}", budget=budget)
+        document.sections[number] = _normalize_section(section, content)
+        if on_section is not None:
+            on_section(number, document.sections[number])
+
+    content, report = postprocess_document(document.render(), use_cache=use_cache, cancel=cancel)
+    _record_validation(report)
+    write_document(path, content)
+    return content
+
+@profiling.staged("save")
+def write_document(out_path, content):
+    """先写入临时文件再重命名，保证目标文件要么完整要么不存在"""
+    part_path = out_path + PARTIAL_SUFFIX
+    with open(part_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(part_path, out_path)
+
+@profiling.staged("naming")
+def allocate_save_path(save_dir, title):
+    """按"发明名称前10字_专利交底书.md"规则分配不重名的保存路径
+
+    序号由任务记录库分配（见 jobs.JobStore.allocate_path），已分配但尚未落盘的路径不会被重复分配，
+    并发的任务与同时运行的多个进程之间也不会冲突。
+    """
+    base_name = title[:10].strip().replace(" ", "_")
+    return get_job_store().allocate_path(save_dir, f"{base_name}_专利交底书")
+
+class StreamStats:
+    """流式生成过程中的计时与字数统计"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.chars = 0
+        self.bytes = 0
+        self.write_time = 0.0
+        self.completed = False
+        self.requests = []  # 每次上游请求（含续写）的 RequestMetrics，缓存命中时为空
+        self.validation = None  # 生成结束后的 validation.ValidationReport
+
+    @property
+    def prompt_tokens(self):
+        return sum(m.prompt_tokens for m in self.requests) if self.requests else None
+
+    @property
+    def completion_tokens(self):
+        return sum(m.completion_tokens for m in self.requests) if self.requests else None
+
+    @property
+    def ttft(self):
+        """首字延迟（秒），尚未收到内容时为None"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def elapsed(self):
+        """已用时（秒）"""
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+def stream_patent_document(title, ideas, out_path=None, stats=None, use_cache=True, cancel=None, resume=False):
+    """流式生成专利交底书，逐块产出文本
+
+    指定out_path时，内容边接收边追加到 out_path + PARTIAL_SUFFIX，
+    完整结束后再重命名为out_path；中途取消或连接中断时保留该临时文件以便恢复。
+    resume 为True且该临时文件存在时，从其中已有的内容处续写（只产出新内容）。
+    缓存命中时一次性产出全部内容；完整生成的结果会写入缓存。
+    cancel 被触发时立即关闭连接并结束产出（stats.completed 保持为False）。
+    输出被截断时自动续写；续写后仍不完整时抛出 GenerationTruncated，临时文件保留。
+    生成结束后校验流程图与公式（见 postprocess_document），修复后的全文覆盖写入文件，
+    已产出的文本块仍为模型的原始输出。
+    异常直接向上抛出，由调用方处理。
+    """
+    if stats is None:
+        stats = StreamStats()
+    messages = build_messages(title, ideas)
+    params = _generation_params()
+    part_path = out_path + PARTIAL_SUFFIX if out_path else None
+
+    cache = get_response_cache() if use_cache else None
+    key = ResponseCache.make_key(*_cache_identity(), messages, params)
+    cached = cache.get(key) if cache is not None else None
+
+    prefix = jobs.read_partial(part_path) if resume and part_path and cached is None else ""
+    if prefix:
+        logging.info(f"[{title}] 从已接收的{len(prefix)}字处继续生成")
+        stats.chars += len(prefix)
+        stats.bytes += len(prefix.encode("utf-8"))
+    chunks = [prefix] if prefix else []
+    parts = [cached] if cached is not None else _stream_document(messages, cancel, "document",
+                                                                    requests=stats.requests, prefix=prefix)
+    f = open(part_path, "a" if prefix else "w", encoding="utf-8") if part_path else None
+    try:
+        for delta in parts:
+            if not delta:
+                continue
+            if stats.first_token_at is None:
+                stats.first_token_at = time.perf_counter()
+            stats.chars += len(delta)
+            stats.bytes += len(delta.encode("utf-8"))
+            chunks.append(delta)
+            if f:
+                write_start = time.perf_counter()
+                with profiling.stage("save"):
+                    f.write(delta)
+                    f.flush()
+                stats.write_time += time.perf_counter() - write_start
+            yield delta
+        if cancel is not None and cancel.cancelled:
+            return
+        if cache is not None and cached is None and chunks:
+            cache.put(key, "".join(chunks), _cache_identity()[0])
+        try:
+            content, stats.validation = postprocess_document("".join(chunks), use_cache=use_cache, cancel=cancel)
+        except GenerationCancelled:
+            return
+        except Exception as e:
+            # 修复失败不影响已完整生成的正文
+            logging.warning(f"公式/流程图修复失败，保留原文: {e}")
+        else:
+            _record_validation(stats.validation)
+            if f and stats.validation.repaired:
+                write_start = time.perf_counter()
+                f.seek(0)
+                f.truncate()
+                f.write(content)
+                stats.write_time += time.perf_counter() - write_start
+        stats.completed = True
+    finally:
+        stats.finished_at = time.perf_counter()
+        if not isinstance(parts, list):
+            parts.close()
+        if f:
+            write_start = time.perf_counter()
+            f.close()
+            if stats.completed:
+                os.replace(part_path, out_path)
+            stats.write_time += time.perf_counter() - write_start
@@ -0,0 +1,246 @@
+"""无界面批量生成入口
+
+从JSONL或CSV文件读取 (title, ideas) 行，按并发上限批量生成专利交底书，
+文件命名规则与界面中的 Worker 一致。本模块不依赖PyQt5，可在无图形界面的服务器上运行。
+每个任务记录在任务记录库中（见 jobs.py）：对同一输入文件再次运行时跳过已完成的行，
+中断的行从已接收的内容处续写。
+
+用法示例：
+    python batch.py ideas.jsonl -o output -j 4
+    python batch.py ideas.jsonl -o output --export docx pdf
+    python batch.py ideas.jsonl -o output --profile   # 每个任务的分阶段耗时与火焰图数据写入 profiles/
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ai
+import export
+import profiling
+from jobs import JobRecord
+
+
+class BatchJob:
+    """单个批量任务的输入与结果"""
+
+    def __init__(self, index, title, ideas):
+        self.index = index
+        self.title = title
+        self.ideas = ideas
+        self.save_path = ""
+        self.record_id = None
+        self.skipped = False
+        self.success = False
+        self.error = ""
+        self.latency = 0.0
+        self.ttft = None
+        self.chars = 0
+
+
+def load_jobs(input_path):
+    """读取JSONL或CSV文件，返回任务列表（按扩展名判断格式）"""
+    jobs = []
+    ext = os.path.splitext(input_path)[1].lower()
+    with open(input_path, "r", encoding="utf-8-sig", newline="") as f:
+        if ext == ".csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for line_no, row in enumerate(rows, 1):
+            title = (row.get("title") or "").strip()
+            ideas = (row.get("ideas") or "").strip()
+            if not title or not ideas:
+                print(f"跳过第{line_no}条记录：title与ideas均不能为空", file=sys.stderr)
+                continue
+            jobs.append(BatchJob(len(jobs) + 1, title, ideas))
+    return jobs
+
+
+class BatchRunner:
+    """按并发上限执行批量任务"""
+
+    def __init__(self, output_dir, concurrency=4, use_cache=True, parallel_sections=False, source="batch",
+                 candidates=1):
+        self.output_dir = output_dir
+        self.concurrency = max(1, concurrency)
+        self.use_cache = use_cache
+        self.parallel_sections = parallel_sections
+        self.candidates = 1 if parallel_sections else max(1, candidates)
+        self.mode = "parallel" if parallel_sections else ("candidates" if self.candidates > 1 else "stream")
+        self.source = source
+        self.store = ai.get_job_store()
+
+    def attach_records(self, jobs, resume=True):
+        """将任务与记录库中本输入文件的记录对应起来
+
+        resume 为True时，上次已完成且文件仍在的行标记为跳过，其余沿用原记录（中断的流式任务从部分文件续写）；
+        输入内容有变化的行登记为新任务。
+        """
+        previous = {}
+        if resume:
+            for record in self.store.by_source(self.source):
+                previous[record.params.get("index")] = record  # 同一行取最近的记录
+        for job in jobs:
+            record = previous.get(job.index)
+            if record is not None and (record.title, record.ideas) == (job.title, job.ideas):
+                if record.state == JobRecord.DONE and os.path.exists(record.save_path):
+                    job.skipped = job.success = True
+                job.record_id = record.id
+                job.save_path = record.save_path
+                continue
+            job.record_id = self.store.add(job.title, job.ideas, self.output_dir, mode=self.mode,
+                                           params={"index": job.index, "use_cache": self.use_cache,
+                                                   "candidates": self.candidates},
+                                           source=self.source)
+
+    def run_job(self, job):
+        with profiling.job(f"batch-{job.index}-{job.title}"):
+            return self.execute_job(job)
+
+    def execute_job(self, job):
+        stats = ai.StreamStats()
+        try:
+            resumed = bool(job.save_path)
+            if not resumed:
+                job.save_path = ai.allocate_save_path(self.output_dir, job.title)
+            if job.record_id is not None:
+                self.store.start(job.record_id, job.save_path)
+            if self.parallel_sections:
+                patent_doc = ai.generate_patent_document_parallel(job.title, job.ideas, self.use_cache)
+                write_start = time.perf_counter()
+                ai.write_document(job.save_path, patent_doc)
+                stats.write_time = time.perf_counter() - write_start
+                stats.chars = len(patent_doc)
+                stats.bytes = len(patent_doc.encode("utf-8"))
+            elif self.candidates > 1:
+                candidates = ai.generate_patent_candidates(job.title, job.ideas, self.candidates, self.use_cache,
+                                                           stats=stats)
+                write_start = time.perf_counter()
+                ai.write_candidates(job.save_path, candidates)
+                stats.write_time = time.perf_counter() - write_start
+            else:
+                for _ in ai.stream_patent_document(job.title, job.ideas, job.save_path, stats,
+                                                   use_cache=self.use_cache, resume=resumed):
+                    pass
+            ai.index_saved_document(job.save_path, job.title, job.ideas)
+            job.success = True
+        except Exception as e:
+            job.error = str(e)
+        finally:
+            if job.record_id is not None:
+                self.store.finish(job.record_id, JobRecord.DONE if job.success else JobRecord.FAILED, job.error)
+            job.latency = stats.elapsed
+            job.ttft = stats.ttft
+            job.chars = stats.chars
+            ai.metrics_registry().record_job(
+                title=job.title,
+                mode=f"batch-{self.mode}" if self.mode != "stream" else "batch",
+                queue_wait=0.0,
+                total=job.latency,
+                ttft=job.ttft,
+                chars=job.chars,
+                output_bytes=stats.bytes,
+                save_time=stats.write_time,
+                prompt_tokens=stats.prompt_tokens,
+                completion_tokens=stats.completion_tokens,
+                validation_time=stats.validation.validation_time if stats.validation else None,
+                repair_tokens=(stats.validation.repair_prompt_tokens + stats.validation.repair_completion_tokens
+                               if stats.validation else None),
+                success=job.success,
+                error=job.error,
+                path=job.save_path if job.success else "",
+            )
+            state = "成功" if job.success else f"失败：{job.error}"
+            print(f"[{job.index}] {job.title[:20]} {state}（{job.latency:.1f}秒）", flush=True)
+        return job
+
+    def run(self, jobs):
+        os.makedirs(self.output_dir, exist_ok=True)
+        pending = [job for job in jobs if not job.skipped]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(self.run_job, pending))
+        return jobs
+
+
+def print_summary(jobs, wall_time):
+    """打印每个任务的耗时与结果汇总"""
+    print()
+    print(f"{'序号':<6}{'结果':<6}{'耗时(秒)':>10}{'首字(秒)':>10}{'字数':>8}  文件/错误")
+    for job in jobs:
+        ttft = f"{job.ttft:.2f}" if job.ttft is not None else "-"
+        detail = job.save_path if job.success else job.error
+        state = "跳过" if job.skipped else ("成功" if job.success else "失败")
+        print(f"{job.index:<6}{state:<6}"
+              f"{job.latency:>10.2f}{ttft:>10}{job.chars:>8}  {detail}")
+    succeeded = sum(1 for job in jobs if job.success and not job.skipped)
+    skipped = sum(1 for job in jobs if job.skipped)
+    failed = len(jobs) - succeeded - skipped
+    print(f"\n共{len(jobs)}个任务，成功{succeeded}个，跳过已完成{skipped}个，失败{failed}个，总用时{wall_time:.1f}秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成专利交底书（无界面）")
+    parser.add_argument("input", help="输入文件（.jsonl 或 .csv，字段为 title 与 ideas）")
+    parser.add_argument("-o", "--output", default=os.getcwd(), help="保存目录，默认为当前目录")
+    parser.add_argument("-j", "--concurrency", type=int, default=4, help="最大并发生成数，默认4")
+    parser.add_argument("--no-cache", action="store_true", help="忽略响应缓存，强制重新生成")
+    parser.add_argument("--parallel-sections", action="store_true",
+                        help="各章节分别并发请求后按固定顺序拼接")
+    parser.add_argument("--candidates", type=int, default=1, metavar="N",
+                        help="每篇一次请求N份候选稿，保存离线评分最高的一份，其余保存在旁边（默认1）")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="忽略对同一输入文件的上次运行记录，全部重新生成")
+    parser.add_argument("--export", nargs="+", choices=export.FORMATS, metavar="FORMAT",
+                        help="生成完成后把成功的文档导出为 docx 和/或 pdf")
+    parser.add_argument("--profile", nargs="?", const=profiling.DEFAULT_DIR, metavar="DIR",
+                        help=f"剖析每个任务的各阶段耗时并写出火焰图数据，默认写入 {profiling.DEFAULT_DIR}/")
+    args = parser.parse_args(argv)
+
+    # 与界面相同，指标以JSON行写入 app.log
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler('app.log', mode='a')],
+    )
+    if args.profile:
+        profiling.enable(args.profile)
+
+    jobs = load_jobs(args.input)
+    if not jobs:
+        print("输入文件中没有有效任务", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    runner = BatchRunner(args.output, args.concurrency, not args.no_cache, args.parallel_sections,
+                         source=f"batch:{os.path.abspath(args.input)}", candidates=args.candidates)
+    runner.attach_records(jobs, resume=not args.no_resume)
+    results = runner.run(jobs)
+    print_summary(results, time.perf_counter() - start)
+    succeeded = all(job.success for job in results)
+
+    saved = [job.save_path for job in results if job.success]
+    if args.export and saved:
+        options = ai.get_export_options()
+        options.formats = tuple(args.export)
+        start = time.perf_counter()
+        try:
+            exported = export.export_documents(saved, options)
+        except export.ExportError as e:
+            print(f"导出失败：{e}", file=sys.stderr)
+            return 1
+        for result in exported:
+            if not result.success:
+                print(f"导出失败：{result.path}：{result.error}", file=sys.stderr)
+        print(f"已导出{sum(len(result.outputs) for result in exported)}个文件"
+              f"（用时{time.perf_counter() - start:.1f}秒）")
+        succeeded = succeeded and all(result.success for result in exported)
+    return 0 if succeeded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""生成链路基准测试
+
+针对本地模拟服务（见 mock_server.py）驱动 ai.generate_patent_document、流式生成、
+分章节并行生成、界面 Worker 以及 batch.py 的批量路径，统计吞吐（请求/秒）、
+p50/p95/p99 延迟、首字延迟与峰值内存，并将结果保存为JSON以便跨版本比较。
+
+用法示例：
+    python bench.py -n 20 -c 4
+    python bench.py --url http://127.0.0.1:8000/v1 --scenarios generate,stream
+    python bench.py --compare bench_results/bench-20240101-120000.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_server
+import profiling
+
+SCENARIOS = ["generate", "stream", "parallel", "worker", "batch"]
+BENCH_TITLE = "一种基于深度学习的图像识别方法"
+BENCH_IDEAS = "多尺度卷积特征提取；注意力加权的特征融合；自适应归一化"
+
+
+def percentile(values, pct):
+    """最近秩法计算分位数，空列表返回None"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def peak_rss_mb():
+    """进程迄今为止的峰值常驻内存（MB），无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为KB，macOS 为字节
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class Sample:
+    """单次请求的测量结果"""
+
+    def __init__(self, latency, success, ttft=None, chars=0, error=""):
+        self.latency = latency
+        self.success = success
+        self.ttft = ttft
+        self.chars = chars
+        self.error = error
+
+
+def bench_title(index):
+    # 每个请求使用不同的标题，避免相同请求被合并为一次上游调用
+    return f"{BENCH_TITLE}（样例{index}）"
+
+
+def run_generate(ai, index):
+    start = time.perf_counter()
+    try:
+        doc = ai.generate_patent_document(bench_title(index), BENCH_IDEAS, use_cache=False)
+        return Sample(time.perf_counter() - start, True, chars=len(doc))
+    except Exception as e:
+        return Sample(time.perf_counter() - start, False, error=str(e))
+
+
+def run_stream(ai, index):
+    stats = ai.StreamStats()
+    try:
+        for _ in ai.stream_patent_document(bench_title(index), BENCH_IDEAS, stats=stats, use_cache=False):
+            pass
+        return Sample(stats.elapsed, True, stats.ttft, stats.chars)
+    except Exception as e:
+        return Sample(stats.elapsed, False, stats.ttft, stats.chars, str(e))
+
+
+def run_parallel(ai, index):
+    start = time.perf_counter()
+    try:
+        doc = ai.generate_patent_document_parallel(bench_title(index), BENCH_IDEAS, use_cache=False)
+        return Sample(time.perf_counter() - start, True, chars=len(doc))
+    except Exception as e:
+        return Sample(time.perf_counter() - start, False, error=str(e))
+
+
+def make_worker_runner(ai, output_dir):
+    """返回驱动界面 Worker 的执行函数；未安装PyQt5时返回None"""
+    try:
+        from PyQt5.QtCore import QCoreApplication, Qt
+        import main
+    except ImportError:
+        return None
+    if QCoreApplication.instance() is None:
+        make_worker_runner.app = QCoreApplication([])
+
+    def run_worker(ai, index):
+        worker = main.Worker(index, bench_title(index), BENCH_IDEAS, {}, output_dir, use_cache=False)
+        result = {}
+        # 基准测试中没有事件循环，使用直接连接在工作线程中接收信号
+        worker.signals.first_token.connect(lambda job_id, ttft: result.update(ttft=ttft), Qt.DirectConnection)
+        worker.signals.progress.connect(lambda job_id, chars, elapsed: result.update(chars=chars),
+                                        Qt.DirectConnection)
+        worker.signals.finished.connect(
+            lambda job_id, error, path, success: result.update(success=success, error=error),
+            Qt.DirectConnection)
+        start = time.perf_counter()
+        worker.run()
+        return Sample(time.perf_counter() - start, result.get("success", False), result.get("ttft"),
+                      result.get("chars", 0), result.get("error", ""))
+
+    return run_worker
+
+
+def run_requests(ai, func, requests, concurrency, name=None):
+    """并发执行 func；给定 name 时每个请求作为一个剖析任务（--profile）"""
+    def run_one(index):
+        if name is None:
+            return func(ai, index)
+        with profiling.job(f"{name}-{index}"):
+            return func(ai, index)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(run_one, range(requests)))
+
+
+def run_batch(requests, concurrency, output_dir):
+    import batch
+    jobs = [batch.BatchJob(i + 1, bench_title(i + 1), BENCH_IDEAS) for i in range(requests)]
+    runner = batch.BatchRunner(output_dir, concurrency, use_cache=False)
+    results = runner.run(jobs)
+    return [Sample(job.latency, job.success, job.ttft, job.chars, job.error) for job in results]
+
+
+def summarize(name, samples, wall_time):
+    latencies = [s.latency for s in samples if s.success]
+    ttfts = [s.ttft for s in samples if s.success and s.ttft is not None]
+    succeeded = sum(1 for s in samples if s.success)
+    errors = sorted({s.error for s in samples if not s.success and s.error})
+    return {
+        "scenario": name,
+        "requests": len(samples),
+        "succeeded": succeeded,
+        "failed": len(samples) - succeeded,
+        "wall_time": wall_time,
+        "rps": len(samples) / wall_time if wall_time > 0 else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "chars_per_request": sum(s.chars for s in samples) / len(samples) if samples else 0,
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": errors[:5],
+    }
+
+
+def write_bench_config(path, base_url, api_key, model, rate_limit=None):
+    """写入指向被测服务的临时配置（关闭缓存与对冲，保证每次都真实请求）"""
+    config = {
+        "openai_config": {"api_key": api_key, "base_url": base_url, "model": model},
+        "cache": {"enabled": False},
+        "routing": {"hedge": False},
+        "rate_limit": rate_limit or {},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def fmt(value, pattern="{:.3f}"):
+    return pattern.format(value) if value is not None else "-"
+
+
+def print_report(results):
+    print(f"{'场景':<10}{'请求':>6}{'失败':>6}{'请求/秒':>10}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'首字p50':>10}{'峰值内存MB':>12}")
+    for r in results:
+        print(f"{r['scenario']:<10}{r['requests']:>6}{r['failed']:>6}{fmt(r['rps'], '{:.2f}'):>10}"
+              f"{fmt(r['latency_p50']):>9}{fmt(r['latency_p95']):>9}{fmt(r['latency_p99']):>9}"
+              f"{fmt(r['ttft_p50']):>10}{fmt(r['peak_rss_mb'], '{:.1f}'):>12}")
+
+
+def print_comparison(current, baseline_path):
+    """与历史结果逐场景比较吞吐与延迟"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    print(f"\n与 {baseline_path} 比较：")
+    for r in current:
+        old = baseline.get(r["scenario"])
+        if old is None:
+            continue
+        parts = []
+        for key in ("rps", "latency_p50", "latency_p95", "ttft_p50"):
+            if r.get(key) and old.get(key):
+                parts.append(f"{key} {(r[key] - old[key]) / old[key] * 100:+.1f}%")
+        print(f"  {r['scenario']:<10}" + "  ".join(parts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="专利交底书生成链路基准测试")
+    parser.add_argument("-n", "--requests", type=int, default=20, help="每个场景的请求数，默认20")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="并发数，默认4")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景列表，可选：{','.join(SCENARIOS)}")
+    parser.add_argument("--url", help="被测服务地址；不指定时在进程内启动模拟服务")
+    parser.add_argument("--api-key", default="mock-key")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("-o", "--output", help="结果JSON路径，默认写入 bench_results/ 目录")
+    parser.add_argument("--compare", help="与指定的历史结果JSON比较")
+    parser.add_argument("--client-rpm", type=int, default=0, help="客户端限流的每分钟请求数，默认不限")
+    parser.add_argument("--no-client-limit", action="store_true", help="关闭客户端限流（由SDK自行重试）")
+    parser.add_argument("--profile", nargs="?", const=profiling.DEFAULT_DIR, metavar="DIR",
+                        help=f"剖析每个请求的各阶段耗时并写出火焰图数据，默认写入 {profiling.DEFAULT_DIR}/")
+    mock_server.add_option_arguments(parser)
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景：{', '.join(sorted(unknown))}")
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = mock_server.start_mock_server(options=mock_server.options_from_args(args))
+        base_url = server.base_url
+
+    workdir = tempfile.mkdtemp(prefix="patent-bench-")
+    config_path = os.path.join(workdir, "config.json")
+    write_bench_config(config_path, base_url, args.api_key, args.model,
+                       {"enabled": not args.no_client_limit, "requests_per_minute": args.client_rpm})
+    # ai 在导入时读取配置路径，必须先设置环境变量
+    os.environ["PATENT_ASSISTANT_CONFIG"] = config_path
+    import ai
+    if args.profile:
+        profiling.enable(args.profile)
+
+    runners = {"generate": run_generate, "stream": run_stream, "parallel": run_parallel}
+    results = []
+    for name in scenarios:
+        output_dir = os.path.join(workdir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        start = time.perf_counter()
+        if name == "batch":
+            samples = run_batch(args.requests, args.concurrency, output_dir)
+        elif name == "worker":
+            run_worker = make_worker_runner(ai, output_dir)
+            if run_worker is None:
+                print("跳过 worker 场景：未安装PyQt5")
+                continue
+            samples = run_requests(ai, run_worker, args.requests, args.concurrency)
+        else:
+            samples = run_requests(ai, runners[name], args.requests, args.concurrency, name)
+        results.append(summarize(name, samples, time.perf_counter() - start))
+
+    if server is not None:
+        server.shutdown()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "url": args.url,
+            "token_rate": args.token_rate,
+            "first_token_delay": args.first_token_delay,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "rpm_limit": args.rpm_limit,
+            "concurrency_limit": args.concurrency_limit,
+            "client_rpm": args.client_rpm,
+            "client_limit": not args.no_client_limit,
+            "output_chars": args.output_chars,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join("bench_results", time.strftime("bench-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_report(results)
+    print(f"\n结果已保存至：{output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""历史输入的近似重复检测
+
+对每次成功生成的 (发明名称, 技术特点) 计算 MinHash 签名，并按 LSH 分段写入 SQLite。
+查询时只取至少一个分段完全相同的候选项，再用签名估计 Jaccard 相似度，
+因此查询量与候选数相关，不随历史条目总数线性增长。
+"""
+import contextlib
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+
+NUM_PERM = 64
+# 16段 × 每段4行：相似度约0.5以上的输入大概率至少有一段完全相同
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SHINGLE_SIZE = 2
+# 参与比较的字符：汉字、字母与数字（标点、空白与大小写差异不影响相似度）
+TEXT_CHARS = re.compile(r"[\u3400-\u9fff\uf900-\ufaffA-Za-z0-9]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    ideas TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_lookup ON bands(band, hash);
+"""
+
+
+def _permutations():
+    """由固定种子生成的 (a, b) 参数，保证签名在不同进程间一致"""
+    params = []
+    for i in range(NUM_PERM):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a, b = struct.unpack("<QQ", digest)
+        params.append((a % (MERSENNE_PRIME - 1) + 1, b % MERSENNE_PRIME))
+    return params
+
+
+PERMUTATIONS = _permutations()
+
+
+def shingles(title, ideas):
+    """标题与技术特点的字符二元组集合"""
+    text = "".join(TEXT_CHARS.findall(f"{title} {ideas}".lower()))
+    if len(text) < SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    """计算 MinHash 签名（NUM_PERM 个32位整数）"""
+    hashes = [struct.unpack("<I", hashlib.blake2b(s.encode(), digest_size=4).digest())[0]
+              for s in shingle_set]
+    if not hashes:
+        return [MAX_HASH] * NUM_PERM
+    return [min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes) for a, b in PERMUTATIONS]
+
+
+def band_hashes(signature):
+    """每段签名压缩为一个64位整数，作为LSH桶的键"""
+    result = []
+    for band in range(BANDS):
+        chunk = struct.pack(f"<{ROWS}I", *signature[band * ROWS:(band + 1) * ROWS])
+        result.append(struct.unpack("<q", hashlib.blake2b(chunk, digest_size=8).digest())[0])
+    return result
+
+
+def estimate_similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def jaccard(set_a, set_b):
+    if not set_a and not set_b:
+        return 1.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
+class DuplicateMatch:
+    """一条近似重复的历史记录"""
+
+    def __init__(self, title, ideas, path, created_at, similarity):
+        self.title = title
+        self.ideas = ideas
+        self.path = path
+        self.created_at = created_at
+        self.similarity = similarity
+
+
+class DuplicateStore:
+    """历史输入的签名库；每次操作使用独立连接，可在多个线程中同时调用"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """打开连接，正常结束时提交，异常时回滚，最后关闭"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, title, ideas, path):
+        """登记一次成功生成的输入"""
+        signature = minhash(shingles(title, ideas))
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO entries(title, ideas, path, created_at, signature) VALUES(?, ?, ?, ?, ?)",
+                (title, ideas, path, time.time(), struct.pack(f"<{NUM_PERM}I", *signature)))
+            conn.executemany("INSERT INTO bands(band, hash, entry_id) VALUES(?, ?, ?)",
+                             [(band, value, cursor.lastrowid)
+                              for band, value in enumerate(band_hashes(signature))])
+
+    def find(self, title, ideas, threshold=0.8, limit=5):
+        """查找相似度不低于 threshold 的历史输入，按相似度从高到低返回
+
+        先按LSH分段取候选，再以签名估计值粗筛、以字符二元组的精确Jaccard相似度排序；
+        对应文件已不存在的记录会被跳过。
+        """
+        query_shingles = shingles(title, ideas)
+        signature = minhash(query_shingles)
+        conditions = " OR ".join("(band = ? AND hash = ?)" for _ in range(BANDS))
+        args = [value for band, value in enumerate(band_hashes(signature)) for value in (band, value)]
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, title, ideas, path, created_at, signature FROM entries WHERE id IN ("
+                f"SELECT DISTINCT entry_id FROM bands WHERE {conditions})", args).fetchall()
+
+        matches = []
+        # 签名估计有误差，粗筛时放宽一些
+        loose = threshold - 0.15
+        for _, other_title, other_ideas, path, created_at, blob in rows:
+            if estimate_similarity(signature, struct.unpack(f"<{NUM_PERM}I", blob)) < loose:
+                continue
+            similarity = jaccard(query_shingles, shingles(other_title, other_ideas))
+            if similarity >= threshold and os.path.exists(path):
+                matches.append(DuplicateMatch(other_title, other_ideas, path, created_at, similarity))
+        matches.sort(key=lambda match: (-match.similarity, -match.created_at))
+        return matches[:limit]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path):
+    """返回指定路径的签名库（同一路径复用同一个对象）"""
+    db_path = os.path.abspath(db_path)
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = DuplicateStore(db_path)
+        return _stores[db_path]
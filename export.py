@@ -0,0 +1,911 @@
+"""交底书导出为 Word（DOCX）与 PDF
+
+Markdown 中的标题、段落、列表、表格与代码块按对应的 Word 样式输出；
+LaTeX 公式用 matplotlib mathtext 离线渲染为图片，Mermaid 流程图在本地分层布局后绘制为图片。
+公式与流程图（统称“片段”）按内容哈希缓存为PNG，未命中的片段在进程池中并行渲染，
+批量导出时所有文档的片段合并去重后一起渲染。PDF 由本机的 LibreOffice（或 Windows 上的
+docx2pdf/Word）从DOCX转换而来。
+
+依赖 python-docx 与 matplotlib（pip install python-docx matplotlib），仅在导出时才导入。
+
+用法示例：
+    python export.py output/*_专利交底书.md -f docx pdf
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import metrics
+import validation
+
+FORMATS = ("docx", "pdf")
+PARTIAL_SUFFIX = ".part"
+# 渲染方式变化时递增，使旧的缓存图片失效
+RENDER_VERSION = 1
+MATH_FONT_SIZE = 12
+DIAGRAM_FONT_SIZE = 11
+# 页面可用宽度（英寸），更宽的图片按比例缩小
+MAX_IMAGE_WIDTH = 6.0
+# 待渲染片段少于该数量时直接在当前进程渲染，省去启动子进程与导入matplotlib的开销
+POOL_MIN_FRAGMENTS = 4
+PDF_TIMEOUT = 300
+BODY_FONT = "宋体"
+CODE_FONT = "Consolas"
+# 未指定字体时依次尝试的中文字体
+CJK_FONTS = ["Microsoft YaHei", "SimHei", "SimSun", "PingFang SC", "Heiti SC", "Noto Sans CJK SC",
+             "Noto Sans SC", "Source Han Sans SC", "WenQuanYi Micro Hei", "WenQuanYi Zen Hei"]
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+LIST_ITEM = re.compile(r"^\s*(?:([-*+])|(\d+)[.、)])\s+(.*)$")
+TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+FENCE = re.compile(r"^\s*```\s*([\w-]*)")
+HORIZONTAL_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+CJK_CHAR = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+# mathtext 不支持、但有等价写法的命令
+MATH_REPLACEMENTS = [(r"\tfrac", r"\frac"), (r"\displaystyle", "")]
+INLINE = re.compile(r"(\$\$.+?\$\$|(?<![\\$])\$(?!\$)[^\n$]+?(?<!\\)\$|\*\*.+?\*\*|`[^`\n]+`)")
+
+logger = logging.getLogger(__name__)
+
+
+class ExportError(Exception):
+    """导出失败（缺少依赖、找不到PDF转换工具或转换出错）"""
+
+
+class ExportOptions:
+    """导出参数，对应 config.json 中的 export 部分"""
+
+    def __init__(self, formats=("docx",), dpi=200, font="", workers=0, cache_dir="cache/export",
+                 cache_max_mb=100, pdf_converter=""):
+        self.formats = tuple(formats)
+        self.dpi = dpi
+        self.font = font
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.cache_max_mb = cache_max_mb
+        self.pdf_converter = pdf_converter
+
+
+class Block:
+    """Markdown 中的一个块：heading、paragraph、bullet、number、table、code、mermaid 或 math
+
+    text 为块的文本（表格为行列表，每行为单元格文本列表），level 为标题级别。
+    """
+
+    def __init__(self, kind, text, level=0):
+        self.kind = kind
+        self.text = text
+        self.level = level
+
+
+class ExportResult:
+    """一篇文档的导出结果与耗时"""
+
+    def __init__(self, path):
+        self.path = path
+        self.outputs = []
+        self.fragments = 0
+        self.failed_fragments = 0
+        self.error = ""
+        self.total_time = 0.0
+
+    @property
+    def success(self):
+        return not self.error
+
+
+# ---------- Markdown 解析 ----------
+
+def _join_lines(lines):
+    """合并段落中的多行：中文之间直接相连，其余以空格分隔"""
+    text = ""
+    for line in lines:
+        line = line.strip()
+        if text and (text[-1].isascii() or line[:1].isascii()):
+            text += " "
+        text += line
+    return text
+
+
+def _table_cells(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def parse_markdown(text):
+    """将交底书拆分为 Block 列表（只处理生成文档中出现的 Markdown 子集）"""
+    blocks = []
+    paragraph = []
+    lines = text.splitlines()
+
+    def flush():
+        if paragraph:
+            blocks.append(Block("paragraph", _join_lines(paragraph)))
+            paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        fence = FENCE.match(line)
+        if fence:
+            flush()
+            body = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                body.append(lines[i])
+                i += 1
+            kind = "mermaid" if fence.group(1).lower() == "mermaid" else "code"
+            blocks.append(Block(kind, "\n".join(body)))
+        elif stripped.startswith("$$"):
+            flush()
+            body = stripped[2:]
+            while "$$" not in body and i + 1 < len(lines):
+                i += 1
+                body += "\n" + lines[i].strip()
+            formula, _, rest = body.partition("$$")
+            blocks.append(Block("math", formula.strip()))
+            if rest.strip():
+                paragraph.append(rest)
+        elif HEADING.match(line):
+            flush()
+            match = HEADING.match(line)
+            blocks.append(Block("heading", match.group(2), len(match.group(1))))
+        elif TABLE_ROW.match(line) and i + 1 < len(lines) and TABLE_RULE.match(lines[i + 1]):
+            flush()
+            rows = [_table_cells(line)]
+            i += 2
+            while i < len(lines) and TABLE_ROW.match(lines[i]):
+                rows.append(_table_cells(lines[i]))
+                i += 1
+            blocks.append(Block("table", rows))
+            continue
+        elif LIST_ITEM.match(line) and not HORIZONTAL_RULE.match(line):
+            flush()
+            match = LIST_ITEM.match(line)
+            blocks.append(Block("bullet" if match.group(1) else "number", match.group(3)))
+        elif not stripped or HORIZONTAL_RULE.match(line):
+            flush()
+        else:
+            paragraph.append(line)
+        i += 1
+    flush()
+    return blocks
+
+
+def inline_segments(text):
+    """把一段文字拆为 (类型, 内容) 列表，类型为 text、math、bold 或 code"""
+    segments = []
+    pos = 0
+    for match in INLINE.finditer(text):
+        if match.start() > pos:
+            segments.append(("text", text[pos:match.start()]))
+        token = match.group(0)
+        if token.startswith("$$"):
+            segments.append(("math", token[2:-2].strip()))
+        elif token.startswith("$"):
+            segments.append(("math", token[1:-1].strip()))
+        elif token.startswith("**"):
+            segments.append(("bold", token[2:-2]))
+        else:
+            segments.append(("code", token[1:-1]))
+        pos = match.end()
+    if pos < len(text):
+        segments.append(("text", text[pos:]))
+    return segments
+
+
+def _block_texts(block):
+    if block.kind == "table":
+        return [cell for row in block.text for cell in row]
+    if block.kind in ("heading", "paragraph", "bullet", "number"):
+        return [block.text]
+    return []
+
+
+def document_fragments(blocks):
+    """文档中需要渲染为图片的片段：[(kind, source)]，kind 为 math 或 mermaid"""
+    fragments = []
+    for block in blocks:
+        if block.kind == "math":
+            fragments.append(("math", block.text))
+        elif block.kind == "mermaid":
+            fragments.append(("mermaid", block.text))
+        for text in _block_texts(block):
+            fragments += [("math", source) for kind, source in inline_segments(text) if kind == "math"]
+    return fragments
+
+
+# ---------- 片段缓存 ----------
+
+def fragment_key(kind, source, options):
+    payload = json.dumps([RENDER_VERSION, kind, source, options.dpi, options.font], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cached(cache_dir, key):
+    """返回缓存的图片路径；渲染失败过的片段返回 ""，未缓存返回None"""
+    image = os.path.join(cache_dir, f"{key}.png")
+    error = os.path.join(cache_dir, f"{key}.err")
+    for path in (image, error):
+        if os.path.exists(path):
+            os.utime(path)  # 刷新最近使用时间
+            return image if path == image else ""
+    return None
+
+
+def _evict(cache_dir, max_size):
+    """片段缓存超出容量时按最久未使用顺序删除"""
+    try:
+        entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith((".png", ".err"))]
+    except OSError:
+        return
+    stats = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in stats:
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+# ---------- 片段渲染（在子进程中执行，只依赖 matplotlib） ----------
+
+_fonts = {}
+
+
+def _resolve_font(font):
+    """返回可用的字体名：优先使用配置的字体，否则取第一个已安装的中文字体"""
+    if font not in _fonts:
+        from matplotlib import font_manager
+        installed = {entry.name for entry in font_manager.fontManager.ttflist}
+        candidates = [font] if font else CJK_FONTS
+        _fonts[font] = next((name for name in candidates if name in installed), None)
+    return _fonts[font]
+
+
+def _render_math(source, path, dpi, font):
+    import matplotlib
+    from matplotlib import mathtext
+    from matplotlib.font_manager import FontProperties
+    for command, replacement in MATH_REPLACEMENTS:
+        source = source.replace(command, replacement)
+    family = _resolve_font(font)
+    prop = FontProperties(family=family or "DejaVu Sans", size=MATH_FONT_SIZE)
+    settings = {}
+    if family and CJK_CHAR.search(source):
+        # 公式中含汉字（如 \text{损失}）时，正体文字改用中文字体
+        settings = {"mathtext.fontset": "custom", "mathtext.rm": family, "mathtext.it": f"{family}:italic"}
+    with matplotlib.rc_context(settings):
+        mathtext.math_to_image(f"${source}$", path, prop=prop, dpi=dpi, format="png")
+
+
+def render_fragment(kind, source, cache_dir, key, dpi, font):
+    """渲染一个片段并写入缓存目录，返回错误信息（成功时为空字符串）
+
+    失败的片段写入同名 .err 文件，再次导出时直接按原文输出而不重复尝试。
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    matplotlib.rcParams["mathtext.fontset"] = "cm"
+    import warnings
+    warnings.filterwarnings("ignore", message="Glyph .* missing from")
+    logging.getLogger("matplotlib.mathtext").setLevel(logging.ERROR)
+
+    image = os.path.join(cache_dir, f"{key}.png")
+    tmp_path = f"{image}.{os.getpid()}.tmp"
+    try:
+        if kind == "math":
+            _render_math(source, tmp_path, dpi, font)
+        else:
+            _render_mermaid(source, tmp_path, dpi, font)
+        os.replace(tmp_path, image)
+        return ""
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e).strip().splitlines()[0] if str(e).strip() else ''}"
+        with open(os.path.join(cache_dir, f"{key}.err"), "w", encoding="utf-8") as f:
+            f.write(error)
+        return error
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def render_fragments(fragments, options):
+    """确保所有片段已在缓存中，返回 ({key: 图片路径，失败为""}, 新渲染数)
+
+    未缓存的片段不少于 POOL_MIN_FRAGMENTS 个时在进程池中并行渲染。
+    """
+    os.makedirs(options.cache_dir, exist_ok=True)
+    images = {}
+    pending = {}
+    for kind, source in fragments:
+        key = fragment_key(kind, source, options)
+        if key in images or key in pending:
+            continue
+        cached = _cached(options.cache_dir, key)
+        if cached is None:
+            pending[key] = (kind, source)
+        else:
+            images[key] = cached
+
+    jobs = [(kind, source, options.cache_dir, key, options.dpi, options.font)
+            for key, (kind, source) in pending.items()]
+    workers = min(options.workers, len(jobs))
+    if workers > 1 and len(jobs) >= POOL_MIN_FRAGMENTS:
+        # 使用spawn启动子进程：界面进程中有多个线程，fork不安全
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            errors = list(pool.map(render_fragment, *zip(*jobs)))
+    else:
+        errors = [render_fragment(*job) for job in jobs]
+    for (kind, source, _, key, _, _), error in zip(jobs, errors):
+        if error:
+            logger.warning(f"{kind} 渲染失败，按原文输出：{error}（{source[:40]}）")
+        images[key] = "" if error else os.path.join(options.cache_dir, f"{key}.png")
+    if jobs:
+        _evict(options.cache_dir, options.cache_max_mb * 1024 * 1024)
+    return images, len(jobs)
+
+
+# ---------- Mermaid 流程图布局与绘制 ----------
+
+NODE_PARTS = re.compile(
+    r"^([A-Za-z0-9_\u4e00-\u9fff]+)\s*(?:\[\[(.*?)\]\]|\[\((.*?)\)\]|\(\((.*?)\)\)|\[(.*?)\]|\((.*?)\)"
+    r"|\{(.*?)\}|>(.*?)\])?$")
+# NODE_PARTS 各分组对应的形状
+NODE_SHAPES = [None, "rect", "round", "circle", "rect", "round", "diamond", "rect"]
+LINK_SPLIT = re.compile(rf"\s*({validation.LINK})\s*")
+LAYER_GAP = 3.0
+NODE_GAP = 2.0
+WRAP_CHARS = 10
+# 跨层连线经过的虚拟节点所占的宽度
+DUMMY_SIZE = 0.5
+
+
+def _split_statements(line):
+    """按括号外的分号拆分一行中的多条语句"""
+    statements, depth, start = [], 0, 0
+    for index, ch in enumerate(line):
+        if ch in "[({":
+            depth += 1
+        elif ch in "])}":
+            depth -= 1
+        elif ch == ";" and depth <= 0:
+            statements.append(line[start:index])
+            start = index + 1
+    statements.append(line[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def parse_mermaid(source):
+    """解析流程图，返回 (方向, {节点ID: (文本, 形状)}, [(起点, 终点, 说明, 样式)])
+
+    样式为 arrow、line 或 dotted。无法解析的语句抛出 ValueError。
+    """
+    lines = [line.strip() for line in source.strip().splitlines()]
+    lines = [line for line in lines if line and not line.startswith("%%")]
+    if not lines:
+        raise ValueError("流程图为空")
+    header = validation.GRAPH_HEADER.match(lines[0])
+    if not header:
+        raise ValueError(f"无法识别的图类型：{lines[0][:40]}")
+    direction = header.group(2)
+    nodes, edges = {}, []
+
+    def node(text):
+        match = NODE_PARTS.match(text.strip())
+        if not match:
+            raise ValueError(f"无法识别的节点：{text[:40]}")
+        node_id = match.group(1)
+        for group in range(2, 9):
+            if match.group(group) is not None:
+                nodes[node_id] = (match.group(group).strip().strip('"'), NODE_SHAPES[group - 1])
+                break
+        else:
+            nodes.setdefault(node_id, (node_id, "rect"))
+        return node_id
+
+    for line in lines[1:]:
+        for statement in _split_statements(line):
+            if validation.KEYWORD_STATEMENT.match(statement):
+                continue
+            parts = LINK_SPLIT.split(statement)
+            groups = [[node(text) for text in part.split("&")] for part in parts[0::2]]
+            for (sources, targets), link in zip(zip(groups, groups[1:]), parts[1::2]):
+                label = re.search(r"\|([^|]*)\||^(?:--|==)([^->|=]+)(?:-->|==>)", link)
+                label = (label.group(1) or label.group(2) or "").strip().strip('"') if label else ""
+                style = "dotted" if "." in link else ("arrow" if ">" in link else "line")
+                edges += [(a, b, label, style) for a in sources for b in targets]
+    return direction, nodes, edges
+
+
+def layout_graph(node_ids, edges):
+    """分层布局：去环后按最长路径分层，跨层的连线经过每层的虚拟节点，再用重心法减少交叉
+
+    edges 为 [(起点, 终点)]。返回 (层列表, 回边集合, 每条连线经过的虚拟节点列表)；
+    虚拟节点为 ("dummy", 连线序号, 序号) 形式的元组。
+    """
+    successors = {node: [] for node in node_ids}
+    for a, b in edges:
+        if a != b:
+            successors[a].append(b)
+
+    # 深度优先找出回边，分层时忽略它们
+    back, state = set(), {}
+    for root in node_ids:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            current, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[current] = 2
+                stack.pop()
+            elif state.get(child) == 1:
+                back.add((current, child))
+            elif child not in state:
+                state[child] = 1
+                stack.append((child, iter(successors[child])))
+
+    forward = [(a, b) for a in node_ids for b in successors[a] if (a, b) not in back]
+    indegree = {node: 0 for node in node_ids}
+    for _, b in forward:
+        indegree[b] += 1
+    layer = {node: 0 for node in node_ids}
+    ready = [node for node in node_ids if indegree[node] == 0]
+    while ready:
+        current = ready.pop(0)
+        for a, b in forward:
+            if a == current:
+                layer[b] = max(layer[b], layer[a] + 1)
+                indegree[b] -= 1
+                if indegree[b] == 0:
+                    ready.append(b)
+
+    layers = [[] for _ in range(max(layer.values(), default=0) + 1)]
+    for node in node_ids:
+        layers[layer[node]].append(node)
+    neighbours = {node: [] for node in node_ids}
+    routes = []
+    for index, (a, b) in enumerate(edges):
+        route = []
+        if a != b and (a, b) not in back:
+            route = [("dummy", index, k) for k in range(layer[b] - layer[a] - 1)]
+            for k, dummy in enumerate(route):
+                layers[layer[a] + 1 + k].append(dummy)
+        chain = [a] + route + [b]
+        for first, second in zip(chain, chain[1:]):
+            neighbours.setdefault(first, []).append(second)
+            neighbours.setdefault(second, []).append(first)
+        routes.append(route)
+    # 自上而下、自下而上交替扫描，每层按相邻层中邻居的平均位置排序
+    for _ in range(4):
+        for index, reference in [(i, i - 1) for i in range(1, len(layers))] + \
+                                [(i, i + 1) for i in range(len(layers) - 2, -1, -1)]:
+            _sort_by_barycenter(layers[index], layers[reference], neighbours)
+    return layers, back, routes
+
+
+def _sort_by_barycenter(nodes, reference, neighbours):
+    position = {node: i for i, node in enumerate(reference)}
+    current = {node: i for i, node in enumerate(nodes)}
+
+    def barycenter(node):
+        linked = [position[other] for other in neighbours[node] if other in position]
+        return sum(linked) / len(linked) if linked else current[node]
+    nodes.sort(key=barycenter)
+
+
+def _text_width(text):
+    return sum(1.0 if not ch.isascii() else 0.55 for ch in text)
+
+
+def _wrap(text):
+    """按显示宽度折行，每行约 WRAP_CHARS 个汉字"""
+    lines, line = [], ""
+    for ch in text.replace("<br>", "\n").replace("<br/>", "\n"):
+        if ch == "\n" or _text_width(line + ch) > WRAP_CHARS:
+            lines.append(line)
+            line = "" if ch == "\n" else ch
+        else:
+            line += ch
+    lines.append(line)
+    return "\n".join(lines)
+
+
+def _border_point(center, size, shape, toward):
+    """从节点中心指向 toward 的直线与节点边框的交点"""
+    (x, y), (w, h) = center, size
+    dx, dy = toward[0] - x, toward[1] - y
+    if not dx and not dy:
+        return center
+    if shape == "diamond":
+        t = 1 / (abs(dx) / (w / 2) + abs(dy) / (h / 2))
+    elif shape == "circle":
+        t = max(w, h) / 2 / (dx * dx + dy * dy) ** 0.5
+    else:
+        t = min(w / 2 / abs(dx) if dx else float("inf"), h / 2 / abs(dy) if dy else float("inf"))
+    return x + dx * t, y + dy * t
+
+
+def _render_mermaid(source, path, dpi, font):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Ellipse, FancyBboxPatch, Polygon
+
+    direction, nodes, edges = parse_mermaid(source)
+    layers, back, routes = layout_graph(list(nodes), [(a, b) for a, b, _, _ in edges])
+    family = [name for name in (_resolve_font(font), "DejaVu Sans") if name]
+
+    # 以字号为单位计算节点尺寸：1个单位约等于一个汉字的宽度
+    labels = {node: _wrap(text) for node, (text, _) in nodes.items()}
+    sizes = {}
+    for node, label in labels.items():
+        rows = label.split("\n")
+        width = max(_text_width(row) for row in rows) + 1.6
+        height = len(rows) * 1.3 + 0.9
+        if nodes[node][1] == "diamond":
+            width, height = width * 1.5, height * 1.5
+        elif nodes[node][1] == "circle":
+            width = height = max(width, height)
+        sizes[node] = (width, height)
+    for route in routes:
+        sizes.update({dummy: (DUMMY_SIZE, DUMMY_SIZE) for dummy in route})
+
+    horizontal = direction in ("LR", "RL")
+    centers = {}
+    main = 0.0
+    for nodes_in_layer in layers:
+        # 主方向上的层厚度取本层最大的节点尺寸，交叉方向上依次排开并居中
+        depth = max(sizes[node][0 if horizontal else 1] for node in nodes_in_layer)
+        spans = [sizes[node][1 if horizontal else 0] for node in nodes_in_layer]
+        cross = -(sum(spans) + NODE_GAP * (len(spans) - 1)) / 2
+        for node, span in zip(nodes_in_layer, spans):
+            offset = cross + span / 2
+            centers[node] = (main + depth / 2, offset) if horizontal else (offset, -(main + depth / 2))
+            cross += span + NODE_GAP
+        main += depth + LAYER_GAP
+    if direction == "RL":
+        centers = {node: (-x, y) for node, (x, y) in centers.items()}
+    elif direction == "BT":
+        centers = {node: (x, -y) for node, (x, y) in centers.items()}
+
+    xs = [x + sign * sizes[node][0] / 2 for node, (x, _) in centers.items() for sign in (-1, 1)]
+    ys = [y + sign * sizes[node][1] / 2 for node, (_, y) in centers.items() for sign in (-1, 1)]
+    margin = 1.0
+    x0, x1, y0, y1 = min(xs) - margin, max(xs) + margin, min(ys) - margin, max(ys) + margin
+    unit = DIAGRAM_FONT_SIZE / 72  # 一个单位对应的英寸数
+    figure = Figure(figsize=((x1 - x0) * unit, (y1 - y0) * unit))
+    FigureCanvasAgg(figure)
+    ax = figure.add_axes([0, 0, 1, 1])
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    ax.axis("off")
+
+    for node in nodes:
+        (x, y), (w, h) = centers[node], sizes[node]
+        shape = nodes[node][1]
+        style = dict(facecolor="#eef3fb", edgecolor="#3c5a8a", linewidth=1.2, zorder=2)
+        if shape == "diamond":
+            patch = Polygon([(x, y + h / 2), (x + w / 2, y), (x, y - h / 2), (x - w / 2, y)], **style)
+        elif shape == "circle":
+            patch = Ellipse((x, y), w, h, **style)
+        else:
+            rounding = "round,pad=0,rounding_size=0.6" if shape == "round" else "square,pad=0"
+            patch = FancyBboxPatch((x - w / 2, y - h / 2), w, h, boxstyle=rounding, **style)
+        ax.add_patch(patch)
+        ax.text(x, y, labels[node], ha="center", va="center", fontsize=DIAGRAM_FONT_SIZE,
+                family=family, zorder=3, linespacing=1.3)
+
+    for (a, b, label, style), route in zip(edges, routes):
+        waypoints = [centers[dummy] for dummy in route]
+        start = _border_point(centers[a], sizes[a], nodes[a][1], (waypoints or [centers[b]])[0])
+        end = _border_point(centers[b], sizes[b], nodes[b][1], (waypoints or [centers[a]])[-1])
+        points = [start] + waypoints + [end]
+        line = dict(color="#444444", linewidth=1.1, linestyle="--" if style == "dotted" else "-")
+        if waypoints:
+            ax.plot([x for x, _ in points[:-1]], [y for _, y in points[:-1]], zorder=1, **line)
+        curved = (a, b) in back or a == b
+        ax.annotate("", xy=end, xytext=points[-2], zorder=1, arrowprops=dict(
+            arrowstyle="-|>" if style != "line" else "-", shrinkA=0, shrinkB=0,
+            connectionstyle="arc3,rad=0.4" if curved else "arc3", **line))
+        if label:
+            # 标签放在折线中间一段的中点
+            middle = (len(points) - 1) // 2
+            (px, py), (qx, qy) = points[middle], points[middle + 1]
+            ax.text((px + qx) / 2, (py + qy) / 2, label, ha="center", va="center",
+                    fontsize=DIAGRAM_FONT_SIZE - 2, family=family, zorder=3,
+                    bbox=dict(facecolor="white", edgecolor="none", pad=1))
+    figure.savefig(path, dpi=dpi, format="png", facecolor="white")
+
+
+# ---------- DOCX 生成 ----------
+
+def _require_docx():
+    try:
+        import docx
+        return docx
+    except ImportError:
+        raise ExportError("导出Word需要安装 python-docx：pip install python-docx")
+
+
+def _image_width(path, dpi):
+    """PNG图片按渲染DPI换算的宽度（英寸），不超过页面可用宽度"""
+    with open(path, "rb") as f:
+        width = struct.unpack(">I", f.read(24)[16:20])[0]
+    return min(width / dpi, MAX_IMAGE_WIDTH)
+
+
+def _set_font(run, name):
+    from docx.oxml.ns import qn
+    run.font.name = name
+    run.element.get_or_add_rPr().get_or_add_rFonts().set(qn("w:eastAsia"), name)
+
+
+def _add_inline(paragraph, text, images, options, bold=False):
+    """按行内格式添加文字、加粗、代码与公式图片"""
+    from docx.shared import Inches
+    for kind, content in inline_segments(text):
+        if kind == "math":
+            image = images.get(fragment_key("math", content, options))
+            if image:
+                paragraph.add_run().add_picture(image, width=Inches(_image_width(image, options.dpi)))
+                continue
+            run = paragraph.add_run(f"${content}$")
+            _set_font(run, CODE_FONT)
+        elif kind == "code":
+            run = paragraph.add_run(content)
+            _set_font(run, CODE_FONT)
+        else:
+            run = paragraph.add_run(content)
+            run.bold = bold or kind == "bold"
+
+
+def _add_picture(document, image, dpi):
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Inches
+    paragraph = document.add_paragraph()
+    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    paragraph.add_run().add_picture(image, width=Inches(_image_width(image, dpi)))
+
+
+def _add_code(document, source):
+    from docx.shared import Pt
+    for line in source.splitlines() or [""]:
+        paragraph = document.add_paragraph()
+        paragraph.paragraph_format.space_after = Pt(0)
+        run = paragraph.add_run(line)
+        run.font.size = Pt(9)
+        _set_font(run, CODE_FONT)
+
+
+def build_docx(blocks, images, out_path, options):
+    """按 Block 列表生成DOCX；先写入临时文件再重命名"""
+    docx = _require_docx()
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml.ns import qn
+
+    document = docx.Document()
+    normal = document.styles["Normal"]
+    normal.font.name = BODY_FONT
+    normal.element.get_or_add_rPr().get_or_add_rFonts().set(qn("w:eastAsia"), BODY_FONT)
+
+    for block in blocks:
+        if block.kind == "heading":
+            # “#”对应Word的“标题”样式，“##”起依次对应标题1、标题2……
+            paragraph = document.add_heading(level=min(block.level - 1, 9))
+            _add_inline(paragraph, block.text, images, options)
+        elif block.kind in ("paragraph", "bullet", "number"):
+            style = {"bullet": "List Bullet", "number": "List Number"}.get(block.kind)
+            _add_inline(document.add_paragraph(style=style), block.text, images, options)
+        elif block.kind == "table":
+            columns = max(len(row) for row in block.text)
+            table = document.add_table(rows=len(block.text), cols=columns)
+            table.style = "Table Grid"
+            for row_index, row in enumerate(block.text):
+                for column, cell_text in enumerate(row):
+                    cell = table.cell(row_index, column)
+                    _add_inline(cell.paragraphs[0], cell_text, images, options, bold=row_index == 0)
+        elif block.kind in ("math", "mermaid"):
+            image = images.get(fragment_key(block.kind, block.text, options))
+            if image:
+                _add_picture(document, image, options.dpi)
+            elif block.kind == "math":
+                paragraph = document.add_paragraph()
+                paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                _set_font(paragraph.add_run(f"$${block.text}$$"), CODE_FONT)
+            else:
+                _add_code(document, block.text)
+        else:
+            _add_code(document, block.text)
+
+    part_path = out_path + PARTIAL_SUFFIX
+    document.save(part_path)
+    os.replace(part_path, out_path)
+
+
+# ---------- PDF 转换 ----------
+
+def _find_converter(configured):
+    """返回 LibreOffice 可执行文件路径；未找到时返回None"""
+    if configured:
+        return configured
+    for name in ("soffice", "libreoffice"):
+        found = shutil.which(name)
+        if found:
+            return found
+    for base in (os.environ.get("PROGRAMFILES", ""), os.environ.get("PROGRAMFILES(X86)", "")):
+        candidate = os.path.join(base, "LibreOffice", "program", "soffice.exe")
+        if base and os.path.exists(candidate):
+            return candidate
+    if sys.platform == "darwin" and os.path.exists("/Applications/LibreOffice.app"):
+        return "/Applications/LibreOffice.app/Contents/MacOS/soffice"
+    return None
+
+
+def convert_to_pdf(docx_paths, output_dir, options):
+    """把多个DOCX一次性转换为PDF，写入 output_dir，返回PDF路径列表"""
+    converter = _find_converter(options.pdf_converter)
+    pdf_paths = [os.path.join(output_dir, Path(path).stem + ".pdf") for path in docx_paths]
+    if converter:
+        # 使用独立的用户配置目录，避免与正在运行的 LibreOffice 实例冲突
+        profile = Path(os.path.abspath(os.path.join(options.cache_dir, "libreoffice_profile"))).as_uri()
+        command = [converter, f"-env:UserInstallation={profile}", "--headless",
+                   "--convert-to", "pdf", "--outdir", output_dir, *docx_paths]
+        try:
+            subprocess.run(command, check=True, capture_output=True, timeout=PDF_TIMEOUT)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ExportError(f"PDF转换失败：{e}")
+    else:
+        try:
+            from docx2pdf import convert  # Windows/macOS 上通过 Word 转换
+        except ImportError:
+            raise ExportError("导出PDF需要安装 LibreOffice（或在装有Word的系统上 pip install docx2pdf），"
+                              "也可在 export.pdf_converter 中指定 soffice 的路径")
+        for docx_path, pdf_path in zip(docx_paths, pdf_paths):
+            convert(docx_path, pdf_path)
+    missing = [path for path in pdf_paths if not os.path.exists(path)]
+    if missing:
+        raise ExportError(f"PDF转换未生成文件：{', '.join(missing)}")
+    return pdf_paths
+
+
+# ---------- 导出入口 ----------
+
+def export_documents(paths, options=None, output_dir=None):
+    """导出多篇交底书，返回 ExportResult 列表（单篇失败不影响其他文档）
+
+    所有文档的片段合并去重后统一渲染；PDF按输出目录分组后一次性转换。
+    """
+    options = options or ExportOptions()
+    unknown = set(options.formats) - set(FORMATS)
+    if unknown:
+        raise ExportError(f"不支持的导出格式：{', '.join(sorted(unknown))}")
+    _require_docx()
+    start = time.perf_counter()
+    results = [ExportResult(os.path.abspath(path)) for path in paths]
+
+    parsed = {}
+    fragments = []
+    for result in results:
+        try:
+            with open(result.path, "r", encoding="utf-8") as f:
+                blocks = parse_markdown(f.read())
+        except OSError as e:
+            result.error = f"读取失败：{e}"
+            continue
+        parsed[result.path] = blocks
+        found = document_fragments(blocks)
+        result.fragments = len(found)
+        fragments += found
+
+    render_start = time.perf_counter()
+    images, rendered = render_fragments(fragments, options)
+    render_time = time.perf_counter() - render_start
+
+    pdf_groups = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for result in results:
+            if result.error:
+                continue
+            target_dir = output_dir or os.path.dirname(result.path)
+            stem = Path(result.path).stem
+            keep_docx = "docx" in options.formats
+            docx_path = os.path.join(target_dir if keep_docx else tmp_dir, stem + ".docx")
+            try:
+                os.makedirs(target_dir, exist_ok=True)
+                build_docx(parsed[result.path], images, docx_path, options)
+            except Exception as e:
+                result.error = f"生成Word失败：{e}"
+                continue
+            if keep_docx:
+                result.outputs.append(docx_path)
+            result.failed_fragments = sum(1 for kind, source in document_fragments(parsed[result.path])
+                                          if not images.get(fragment_key(kind, source, options)))
+            if "pdf" in options.formats:
+                pdf_groups.setdefault(target_dir, []).append((result, docx_path))
+
+        for target_dir, group in pdf_groups.items():
+            try:
+                pdf_paths = convert_to_pdf([docx_path for _, docx_path in group], target_dir, options)
+            except ExportError as e:
+                for result, _ in group:
+                    result.error = str(e)
+                continue
+            for (result, _), pdf_path in zip(group, pdf_paths):
+                result.outputs.append(pdf_path)
+
+    total_time = time.perf_counter() - start
+    for result in results:
+        result.total_time = total_time
+    metrics.get_registry().record_event(
+        "export",
+        documents=len(results),
+        failures=sum(1 for result in results if not result.success),
+        formats=list(options.formats),
+        fragments=len(fragments),
+        rendered=rendered,
+        render_time=round(render_time, 4),
+        total_time=round(total_time, 4),
+    )
+    return results
+
+
+def export_document(path, options=None, output_dir=None):
+    """导出单篇交底书，返回生成的文件路径列表；失败时抛出 ExportError"""
+    result = export_documents([path], options, output_dir)[0]
+    if result.error:
+        raise ExportError(result.error)
+    return result.outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="将交底书导出为 Word/PDF")
+    parser.add_argument("paths", nargs="+", help="Markdown格式的交底书")
+    parser.add_argument("-f", "--formats", nargs="+", choices=FORMATS,
+                        help="导出格式，默认使用 config.json 中的 export.formats")
+    parser.add_argument("-o", "--output", help="输出目录，默认与源文件相同")
+    parser.add_argument("-j", "--workers", type=int, help="渲染进程数，默认为CPU核数")
+    args = parser.parse_args(argv)
+
+    import ai
+    options = ai.get_export_options()
+    if args.formats:
+        options.formats = tuple(args.formats)
+    if args.workers:
+        options.workers = args.workers
+
+    start = time.perf_counter()
+    try:
+        results = export_documents(args.paths, options, args.output)
+    except ExportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for result in results:
+        detail = "，".join(result.outputs) if result.success else f"失败：{result.error}"
+        failed = f"（{result.failed_fragments}个片段按原文输出）" if result.failed_fragments else ""
+        print(f"{result.path} -> {detail}{failed}")
+    print(f"共{len(results)}个文档，用时{time.perf_counter() - start:.2f}秒")
+    return 0 if all(result.success for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""技术资料的读取与分块
+
+把设计文档、代码摘录、测试报告等本地资料（TXT、MD、DOCX、PDF）切成片段，由 ai.ingest_sources
+并发摘要每个片段（map），再合并为交底书的创意要点（reduce）：
+- 读取是流式的：文本文件逐行读取，DOCX 逐段落与表格，PDF 逐页，片段边读边交给摘要线程；
+- 片段边界由内容决定：在段落结尾处、按该段落的哈希决定是否结束片段（另有最小与最大长度），
+  修改文档的某处只会改变所在的一两个片段，其余片段内容不变，摘要可直接复用；
+- 片段摘要按“提示词 + 模型 + 片段内容”的哈希保存在 SQLite 中（SummaryStore）。
+
+DOCX 需要 python-docx，PDF 需要 pypdf（pip install pypdf），仅在读取对应格式时才导入。
+
+用法示例：
+    python ingest.py 设计文档.docx 测试报告.pdf --title "一种……的方法"
+"""
+import argparse
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown")
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + (".docx", ".pdf")
+# 判断文本文件编码时读取的字节数
+ENCODING_PROBE_BYTES = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+"""
+
+
+class IngestError(Exception):
+    """资料无法读取（格式不支持、缺少依赖或文件损坏）"""
+
+
+class Chunk:
+    """一个资料片段；index 为其在所属文件中的序号"""
+
+    def __init__(self, source, index, text):
+        self.source = source
+        self.index = index
+        self.text = text
+
+    @property
+    def digest(self):
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+
+def _detect_encoding(path):
+    """UTF-8（可带BOM）解码失败时按 GB18030 读取，覆盖国内 Windows 上常见的编码"""
+    with open(path, "rb") as f:
+        head = f.read(ENCODING_PROBE_BYTES)
+    try:
+        # 探测的字节可能截断在多字节字符中间，末尾不完整的字符不算失败
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            return "gb18030"
+    return "utf-8-sig"
+
+
+def _text_paragraphs(path):
+    paragraph = []
+    with open(path, "r", encoding=_detect_encoding(path), errors="replace") as f:
+        for line in f:
+            if line.strip():
+                paragraph.append(line.rstrip())
+            elif paragraph:
+                yield "\n".join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield "\n".join(paragraph)
+
+
+def _require(module, package):
+    try:
+        return __import__(module)
+    except ImportError:
+        raise IngestError(f"读取该格式需要安装 {package}：pip install {package}")
+
+
+def _docx_paragraphs(path):
+    """按文档顺序产出段落与表格（表格每行一段，单元格以“ | ”分隔）"""
+    docx = _require("docx", "python-docx")
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    try:
+        document = docx.Document(path)
+    except Exception as e:
+        raise IngestError(f"无法打开DOCX文件：{e}")
+    for child in document.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            text = Paragraph(child, document).text.strip()
+            if text:
+                yield text
+        elif tag == "tbl":
+            for row in Table(child, document).rows:
+                cells = [cell.text.strip() for cell in row.cells]
+                if any(cells):
+                    yield " | ".join(cells)
+
+
+def _pdf_paragraphs(path):
+    pypdf = _require("pypdf", "pypdf")
+    try:
+        reader = pypdf.PdfReader(path)
+    except Exception as e:
+        raise IngestError(f"无法打开PDF文件：{e}")
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        for paragraph in text.split("\n\n"):
+            if paragraph.strip():
+                yield paragraph.strip()
+
+
+def iter_paragraphs(path):
+    """逐段产出资料文件的文本"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        return _text_paragraphs(path)
+    if extension == ".docx":
+        return _docx_paragraphs(path)
+    if extension == ".pdf":
+        return _pdf_paragraphs(path)
+    raise IngestError(f"不支持的资料格式：{extension or path}（支持 {'、'.join(SUPPORTED_EXTENSIONS)}）")
+
+
+def _split_long(paragraph, max_chars):
+    """超过 max_chars 的段落（如没有空行的代码）按行切开，单行仍过长时硬切"""
+    if len(paragraph) <= max_chars:
+        yield paragraph
+        return
+    piece = []
+    size = 0
+    for line in paragraph.split("\n"):
+        if len(line) > max_chars and piece:
+            yield "\n".join(piece)
+            piece, size = [], 0
+        while len(line) > max_chars:
+            yield line[:max_chars]
+            line = line[max_chars:]
+        if size + len(line) > max_chars and piece:
+            yield "\n".join(piece)
+            piece, size = [], 0
+        piece.append(line)
+        size += len(line) + 1
+    if piece:
+        yield "\n".join(piece)
+
+
+def iter_chunks(path, target_chars=6000, max_chars=12000):
+    """把资料文件切成片段，逐个产出 Chunk
+
+    片段至少 target_chars 的一半；之后每个段落以 len(段落)/target_chars 的概率（由段落内容的哈希决定）
+    成为片段结尾，超过 max_chars 时强制结束。片段平均长度约为 target_chars。
+    """
+    min_chars = target_chars // 2
+    pieces = []
+    size = 0
+    index = 0
+    for paragraph in iter_paragraphs(path):
+        for piece in _split_long(paragraph, max_chars):
+            if pieces and size + len(piece) > max_chars:
+                yield Chunk(path, index, "\n\n".join(pieces))
+                index += 1
+                pieces, size = [], 0
+            pieces.append(piece)
+            size += len(piece) + 2
+            if size >= min_chars and zlib.crc32(piece.encode("utf-8")) % target_chars < len(piece):
+                yield Chunk(path, index, "\n\n".join(pieces))
+                index += 1
+                pieces, size = [], 0
+    if pieces:
+        yield Chunk(path, index, "\n\n".join(pieces))
+
+
+class SummaryStore:
+    """片段摘要库；每次操作使用独立连接，可在多个线程中同时调用"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """读取摘要并刷新最近使用时间，不存在时返回None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE summaries SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def put(self, key, summary):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO summaries(key, summary, created_at, used_at) VALUES(?, ?, ?, ?)",
+                         (key, summary, now, now))
+
+    def purge(self, max_age_days):
+        """删除超过 max_age_days 天未使用的摘要，返回删除数"""
+        cutoff = time.time() - max_age_days * 86400
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM summaries WHERE used_at < ?", (cutoff,)).rowcount
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path):
+    """返回指定路径的摘要库（同一路径复用同一个对象）"""
+    db_path = os.path.abspath(db_path)
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = SummaryStore(db_path)
+        return _stores[db_path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把技术资料摘要为交底书的创意要点")
+    parser.add_argument("paths", nargs="+", help=f"资料文件（{'、'.join(SUPPORTED_EXTENSIONS)}）")
+    parser.add_argument("--title", default="", help="发明名称，用于引导合并时的取舍")
+    parser.add_argument("--ideas", default="", help="已有的创意要点，合并时保留")
+    args = parser.parse_args(argv)
+
+    # ai 在导入时引用本模块，这里再导入以免循环
+    import ai
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.FileHandler('app.log', mode='a')])
+
+    def on_progress(done, total, reused):
+        print(f"\r已摘要 {done}/{total} 个片段（复用{reused}个）", end="", file=sys.stderr, flush=True)
+
+    try:
+        result = ai.ingest_sources(args.paths, args.title, args.ideas, on_progress=on_progress)
+    except IngestError as e:
+        print(f"\n{e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+    print(result.ideas)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
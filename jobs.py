@@ -0,0 +1,197 @@
+"""生成任务的持久化记录
+
+每个任务的输入、状态、尝试次数与保存路径记录在 SQLite 中（WAL模式，每次状态变化一个事务），
+生成中的正文仍边接收边写入“保存路径 + .part”。程序被关闭或崩溃后，界面与批量入口在下次启动时
+从这里找回未完成的任务：流式任务从 .part 中已接收的内容处续写，已完成的任务不再重复生成。
+
+保存文件名也由这里分配：每个“目录 + 文件名前缀”记录下一个可用序号，
+分配时不必从1开始逐个探测已存在的文件。
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PARTIAL_SUFFIX = ".part"
+FILE_EXTENSION = ".md"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    ideas TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    params TEXT NOT NULL,
+    save_dir TEXT NOT NULL,
+    save_path TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, source);
+CREATE TABLE IF NOT EXISTS names (
+    directory TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    next INTEGER NOT NULL,
+    PRIMARY KEY (directory, stem)
+);
+"""
+
+
+class JobRecord:
+    """一条任务记录；params 为各模式特有的参数（如是否使用缓存、需要重新生成的章节）"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    # 程序退出时被中断，下次启动时恢复
+    INTERRUPTED = "interrupted"
+    RESUMABLE = (QUEUED, RUNNING, INTERRUPTED)
+
+    COLUMNS = "id, source, title, ideas, mode, params, save_dir, save_path, state, attempts, error, created_at"
+
+    def __init__(self, row):
+        (self.id, self.source, self.title, self.ideas, self.mode, params, self.save_dir, self.save_path,
+         self.state, self.attempts, self.error, self.created_at) = row
+        self.params = json.loads(params)
+
+    @property
+    def part_path(self):
+        return self.save_path + PARTIAL_SUFFIX if self.save_path else ""
+
+
+class JobStore:
+    """任务记录库；每次操作使用独立连接，可在多个线程与进程中同时调用"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self, immediate=False):
+        """打开连接，正常结束时提交，异常时回滚，最后关闭
+
+        immediate 为True时立即取得写锁，用于先读后写、不能被其他进程插入的操作。
+        """
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                if immediate:
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, title, ideas, save_dir, mode="stream", params=None, source="gui", save_path=""):
+        """登记一个新任务（状态为排队中），返回任务编号"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs(source, title, ideas, mode, params, save_dir, save_path, state, "
+                "created_at, updated_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, title, ideas, mode, json.dumps(params or {}, ensure_ascii=False),
+                 os.path.abspath(save_dir), save_path, JobRecord.QUEUED, now, now))
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return JobRecord(row) if row else None
+
+    def start(self, job_id, save_path):
+        """任务开始执行：记录保存路径并累加尝试次数"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, save_path = ?, attempts = attempts + 1, updated_at = ? "
+                         "WHERE id = ?", (JobRecord.RUNNING, save_path, time.time(), job_id))
+
+    def finish(self, job_id, state, error=""):
+        """记录任务的最终状态（done、failed、cancelled 或 interrupted）"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                         (state, error, time.time(), job_id))
+
+    def unfinished(self, source):
+        """指定来源中需要恢复的任务，按登记顺序返回"""
+        placeholders = ", ".join("?" for _ in JobRecord.RESUMABLE)
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs WHERE source = ? "
+                                f"AND state IN ({placeholders}) ORDER BY id",
+                                (source, *JobRecord.RESUMABLE)).fetchall()
+        return [JobRecord(row) for row in rows]
+
+    def by_source(self, source):
+        """指定来源的全部任务（批量入口据此跳过已完成的输入）"""
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs WHERE source = ? ORDER BY id",
+                                (source,)).fetchall()
+        return [JobRecord(row) for row in rows]
+
+    def purge(self, max_age_days):
+        """删除早于 max_age_days 天结束的任务记录，返回删除数"""
+        cutoff = time.time() - max_age_days * 86400
+        placeholders = ", ".join("?" for _ in JobRecord.RESUMABLE)
+        with self._connect() as conn:
+            return conn.execute(f"DELETE FROM jobs WHERE updated_at < ? AND state NOT IN ({placeholders})",
+                                (cutoff, *JobRecord.RESUMABLE)).rowcount
+
+    def allocate_path(self, save_dir, stem):
+        """分配 save_dir 下以 stem 为名、尚未被占用的保存路径
+
+        依次为 stem.md、stem_1.md、stem_2.md……；每个前缀记录下一个序号，
+        因此通常一次即可得到可用路径，只有目录中存在库外创建的同名文件时才会顺延。
+        """
+        directory = os.path.abspath(save_dir)
+        with self._connect(immediate=True) as conn:
+            row = conn.execute("SELECT next FROM names WHERE directory = ? AND stem = ?",
+                               (directory, stem)).fetchone()
+            counter = row[0] if row else 0
+            while True:
+                name = f"{stem}_{counter}{FILE_EXTENSION}" if counter else f"{stem}{FILE_EXTENSION}"
+                path = os.path.join(directory, name)
+                counter += 1
+                if not (os.path.exists(path) or os.path.exists(path + PARTIAL_SUFFIX)):
+                    break
+            conn.execute("INSERT INTO names(directory, stem, next) VALUES(?, ?, ?) "
+                         "ON CONFLICT(directory, stem) DO UPDATE SET next = excluded.next",
+                         (directory, stem, counter))
+        return path
+
+
+def read_partial(part_path):
+    """读取中断任务已接收的内容，并原子地改写部分文件
+
+    崩溃时文件末尾可能只写入了半个UTF-8字符，读取时丢弃，并将清理后的内容
+    先写入临时文件再替换，之后即可在其后追加续写的内容。文件不存在时返回空字符串。
+    """
+    try:
+        with open(part_path, "rb") as f:
+            text = f.read().decode("utf-8", errors="ignore")
+    except OSError:
+        return ""
+    tmp_path = f"{part_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, part_path)
+    return text
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path):
+    """返回指定路径的任务记录库（同一路径复用同一个对象）"""
+    db_path = os.path.abspath(db_path)
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = JobStore(db_path)
+        return _stores[db_path]
@@ -1,67 +1,380 @@
+import startup
+startup.install_import_hook()
+
 import sys
 import os
+import re
 import json
+import threading
+import time
+import multiprocessing
 import ai
+import export
+import ingest
+import jobs
 import logging
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
+import metrics
+import profiling
+import remote
+from PyQt5.QtCore import (Qt, pyqtSignal, QSize, QObject, QRunnable, QThreadPool,
+                          QTimer, QUrl)
 from PyQt5.QtCore import QCoreApplication, QLibraryInfo
-from PyQt5.QtGui import QMovie
+from PyQt5.QtGui import QMovie, QDesktopServices
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QDialog, QLabel, 
                             QLineEdit, QTextEdit, QPushButton, QVBoxLayout, QHBoxLayout,
-                            QFileDialog, QMessageBox, QComboBox, QFormLayout)
+                            QFileDialog, QMessageBox, QComboBox, QFormLayout, QCheckBox,
+                            QSpinBox, QTableWidget, QTableWidgetItem, QHeaderView,
+                            QAbstractItemView)
+
+class WorkerSignals(QObject):
+    """Worker 的信号（QRunnable 不是 QObject，信号需单独承载）"""
+    # 信号参数：任务编号
+    started = pyqtSignal(int)
+    # 信号参数：任务编号，错误信息，保存路径，是否成功
+    finished = pyqtSignal(int, str, str, bool)
+    # 信号参数：任务编号，已接收字数，已用时（秒）
+    progress = pyqtSignal(int, int, float)
+    # 信号参数：任务编号，首字延迟（秒）
+    first_token = pyqtSignal(int, float)
+    # 信号参数：任务编号，部分内容文件路径
+    cancelled = pyqtSignal(int, str)
+
 
-class Worker(QThread):
-    # 信号参数：错误信息，生成内容，保存路径，是否成功
-    finished = pyqtSignal(str, str, str, bool)
+class Worker(QRunnable):
+    # 进度信号的最小发送间隔（秒），避免逐块刷新界面
+    PROGRESS_INTERVAL = 0.1
 
-    def __init__(self, title, ideas, config, save_path):
+    def __init__(self, job_id, title, ideas, config, save_path, use_cache=True, parallel_sections=False,
+                 record_id=None, candidates=1):
         super().__init__()
+        self.setAutoDelete(False)  # 由 PatentApp 持有引用，任务结束后仍需读取状态
+        self.job_id = job_id
         self.title = title
         self.ideas = ideas
         self.config = config
         self.save_path = save_path
-        self._is_running = True  # 线程运行标志
+        self.use_cache = use_cache
+        self.parallel_sections = parallel_sections
+        self.signals = WorkerSignals()
+        self.cancel_token = ai.CancelToken()
+        self.enqueued_at = time.perf_counter()
+        self.stats = None
+        # 候选稿数大于1时一次请求多份候选，保存得分最高的一份（不适用于分章节生成）
+        self.candidates = 1 if parallel_sections else max(1, candidates)
+        self.mode = "parallel" if parallel_sections else ("candidates" if self.candidates > 1 else "stream")
+        self.record_id = record_id  # 任务记录库中的编号（见 jobs.py）
+        self.interrupted = False
+        self.profile = None  # 以 --profile 启动时为本任务的 profiling.JobProfile
+
+    def stop(self, interrupted=False):
+        """协作式停止：关闭进行中的网络连接，保留已写入的部分文件
+
+        interrupted 为True表示因程序退出而停止，任务记录保持可恢复状态，下次启动时继续。
+        """
+        self.interrupted = interrupted
+        self.cancel_token.cancel()
+
+    def finish_record(self, state, error=""):
+        """更新任务记录的最终状态；记录库出错只写日志，不影响任务本身"""
+        if self.record_id is None:
+            return
+        try:
+            ai.get_job_store().finish(self.record_id, state, error)
+        except Exception as e:
+            logging.warning(f"任务记录更新失败: {e}")
 
-    def stop(self):
-        """安全停止线程"""
-        self._is_running = False
-        self.terminate()
+    def _cancelled_state(self):
+        return jobs.JobRecord.INTERRUPTED if self.interrupted else jobs.JobRecord.CANCELLED
+
+    def _start_record(self, save_path=None):
+        """记录任务开始，返回保存路径：恢复的任务沿用上次的路径，以便从部分文件续写"""
+        store = ai.get_job_store()
+        record = store.get(self.record_id) if self.record_id is not None else None
+        resumed = bool(record and record.save_path)
+        save_path = save_path or (record.save_path if resumed else ai.allocate_save_path(self.save_path, self.title))
+        if record is not None:
+            store.start(self.record_id, save_path)
+        return save_path, resumed
 
     def run(self):
+        with profiling.job(f"{self.mode}-{self.title}") as self.profile:
+            self.execute()
+
+    def execute(self):
+        save_path = ""
+        queue_wait = time.perf_counter() - self.enqueued_at
+        start = time.perf_counter()
+        error_msg = ""
+        completed = False
         try:
-            if not self._is_running:
+            if self.cancel_token.cancelled:
+                self.finish_record(self._cancelled_state(), "已取消")
                 return
+            self.signals.started.emit(self.job_id)
 
-            patent_doc = ai.generate_patent_document(self.title, self.ideas)
+            # 1. 分配不重名的保存路径并记录任务开始
+            save_path, resumed = self._start_record()
 
-            if not self._is_running:
+            # 2. 生成并写入文件
+            if self.parallel_sections:
+                completed = self._run_parallel(save_path)
+            elif self.candidates > 1:
+                completed = self._run_candidates(save_path)
+            else:
+                completed = self._run_streaming(save_path, resumed)
+            if not completed:
+                error_msg = "已取消"
+                self.finish_record(self._cancelled_state(), error_msg)
+                self.signals.cancelled.emit(self.job_id, save_path + ai.PARTIAL_SUFFIX)
                 return
 
-            # 2. 处理文件名
-            base_name = self.title[:10].strip().replace(" ", "_")
-            filename = f"{base_name}_专利交底书.md"
-            save_path = os.path.join(self.save_path, filename)
+            # 3. 更新索引并返回成功结果（内容已写入文件，不再在内存中保留全文）
+            self.finish_record(jobs.JobRecord.DONE)
+            ai.index_saved_document(save_path, self.title, self.ideas)
+            self.signals.finished.emit(self.job_id, "", save_path, True)
 
-            # 3. 处理文件重名
-            counter = 1
-            while os.path.exists(save_path):
-                new_name = f"{base_name}_专利交底书_{counter}.md"
-                save_path = os.path.join(self.save_path, new_name)
-                counter += 1
-                if counter > 100:  # 防止无限循环
-                    raise Exception("文件保存失败：尝试超过100次仍未找到可用文件名")
+        except ai.GenerationCancelled:
+            error_msg = "已取消"
+            self.finish_record(self._cancelled_state(), error_msg)
+            self.signals.cancelled.emit(self.job_id, "")
+        except Exception as e:
+            # 返回错误信息
+            error_msg = f"生成过程失败：{str(e)}"
+            self.finish_record(jobs.JobRecord.FAILED, error_msg)
+            self.signals.finished.emit(self.job_id, error_msg, "", False)
+        finally:
+            if save_path or error_msg:
+                self._record_metrics(queue_wait, time.perf_counter() - start, completed, error_msg, save_path)
+
+    def _record_metrics(self, queue_wait, total, success, error, save_path):
+        """将任务级指标（排队、生成、保存耗时与token用量）写入指标日志"""
+        stats = self.stats
+        ai.metrics_registry().record_job(
+            title=self.title,
+            mode=self.mode,
+            queue_wait=queue_wait,
+            total=total,
+            ttft=stats.ttft if stats is not None else None,
+            chars=stats.chars if stats is not None else 0,
+            output_bytes=stats.bytes if stats is not None else 0,
+            save_time=stats.write_time if stats is not None else None,
+            prompt_tokens=stats.prompt_tokens if stats is not None else None,
+            completion_tokens=stats.completion_tokens if stats is not None else None,
+            cached=self.mode in ("stream", "candidates") and stats is not None and not stats.requests,
+            validation_time=stats.validation.validation_time if stats is not None and stats.validation else None,
+            repair_tokens=(stats.validation.repair_prompt_tokens + stats.validation.repair_completion_tokens
+                           if stats is not None and stats.validation else None),
+            success=success,
+            error=error,
+            path=save_path if success else "",
+        )
+
+    @staticmethod
+    def _backend():
+        """配置了生成服务时通过服务生成（见 remote.py），否则直接调用模型接口"""
+        return remote if remote.enabled() else ai
 
-            # 4. 保存文件
-            with open(save_path, "w", encoding="utf-8") as f:
-                f.write(patent_doc)
+    def _run_streaming(self, save_path, resume=False):
+        """流式生成并边接收边写入文件，返回是否完整生成；resume 为True时从已有的部分文件续写"""
+        stats = self.stats = ai.StreamStats()
+        stream = self._backend().stream_patent_document(self.title, self.ideas, save_path, stats,
+                                                        use_cache=self.use_cache, cancel=self.cancel_token,
+                                                        resume=resume)
+        last_emit = 0.0
+        ttft_sent = False
+        try:
+            for _ in stream:
+                if not ttft_sent:
+                    ttft_sent = True
+                    self.signals.first_token.emit(self.job_id, stats.ttft)
+                    logging.info(f"[{self.title}] 首字延迟：{stats.ttft:.2f}秒")
+                if stats.elapsed - last_emit >= self.PROGRESS_INTERVAL:
+                    last_emit = stats.elapsed
+                    with profiling.stage("qt-signal"):
+                        self.signals.progress.emit(self.job_id, stats.chars, last_emit)
+        finally:
+            stream.close()
+
+        if not stats.completed:
+            logging.info(f"[{self.title}] 生成已取消，部分内容保留在：{save_path}{ai.PARTIAL_SUFFIX}")
+            return False
+
+        self.signals.progress.emit(self.job_id, stats.chars, stats.elapsed)
+        logging.info(f"[{self.title}] 生成完成：{stats.chars}字，用时{stats.elapsed:.2f}秒")
+        return True
 
-            # 5. 返回成功结果
-            self.finished.emit("", patent_doc, save_path, True)
+    def _run_parallel(self, save_path):
+        """分章节并发生成，全部完成后一次性写入文件，返回是否完整生成"""
+        start = time.perf_counter()
+        received = [0]
 
+        def on_section(number, content):
+            received[0] += len(content)
+            self.signals.progress.emit(self.job_id, received[0], time.perf_counter() - start)
+
+        patent_doc = self._backend().generate_patent_document_parallel(
+            self.title, self.ideas, self.use_cache, on_section=on_section, cancel=self.cancel_token)
+        if self.cancel_token.cancelled:
+            logging.info(f"[{self.title}] 生成已取消")
+            return False
+
+        write_start = time.perf_counter()
+        ai.write_document(save_path, patent_doc)
+        self.stats = ai.StreamStats()
+        self.stats.started_at = start
+        self.stats.chars = len(patent_doc)
+        self.stats.bytes = len(patent_doc.encode("utf-8"))
+        self.stats.write_time = time.perf_counter() - write_start
+        self.stats.completed = True
+        logging.info(f"[{self.title}] 分章节生成完成：{len(patent_doc)}字，用时{time.perf_counter() - start:.2f}秒")
+        return True
+
+
+    def _run_candidates(self, save_path):
+        """一次请求生成多份候选稿，得分最高的保存为 save_path，其余保存在旁边，返回是否完整生成"""
+        stats = self.stats = ai.StreamStats()
+        last_emit = [0.0]
+
+        def on_delta(delta):
+            # 可能在多个线程中回调，进度只需近似
+            if stats.elapsed - last_emit[0] >= self.PROGRESS_INTERVAL:
+                last_emit[0] = stats.elapsed
+                self.signals.progress.emit(self.job_id, stats.chars, last_emit[0])
+
+        candidates = self._backend().generate_patent_candidates(self.title, self.ideas, self.candidates, self.use_cache,
+                                                               cancel=self.cancel_token, stats=stats,
+                                                               on_delta=on_delta)
+        if stats.ttft is not None:
+            self.signals.first_token.emit(self.job_id, stats.ttft)
+        write_start = time.perf_counter()
+        paths = ai.write_candidates(save_path, candidates)
+        stats.write_time += time.perf_counter() - write_start
+        self.signals.progress.emit(self.job_id, stats.chars, stats.elapsed)
+        best = candidates[0].score
+        logging.info(f"[{self.title}] 已保存得分最高的候选稿（{best.score}/{best.max_score}），"
+                     f"其余{len(paths) - 1}份保存在同一目录")
+        return True
+
+
+class SectionWorker(Worker):
+    """只重新生成已保存文档中的指定章节，并原地改写文件（见 ai.regenerate_sections）"""
+
+    def __init__(self, job_id, path, numbers, ideas, feedback, config, record_id=None):
+        super().__init__(job_id, os.path.basename(path), ideas, config, path, use_cache=False,
+                         record_id=record_id)
+        self.numbers = numbers
+        self.feedback = feedback
+        self.mode = "regenerate"
+
+    def execute(self):
+        queue_wait = time.perf_counter() - self.enqueued_at
+        start = time.perf_counter()
+        error_msg = ""
+        success = False
+        try:
+            if self.cancel_token.cancelled:
+                self.finish_record(self._cancelled_state(), "已取消")
+                return
+            self.signals.started.emit(self.job_id)
+            # 改写在内存中完成后一次性替换文件，恢复时重新执行即可
+            self._start_record(self.save_path)
+            self.stats = ai.StreamStats()
+
+            def on_section(number, content):
+                self.stats.chars += len(content)
+                self.signals.progress.emit(self.job_id, self.stats.chars, time.perf_counter() - start)
+
+            ai.regenerate_sections(self.save_path, self.numbers, self.ideas, feedback=self.feedback,
+                                   on_section=on_section, cancel=self.cancel_token)
+            success = True
+            self.finish_record(jobs.JobRecord.DONE)
+            ai.index_saved_document(self.save_path)
+            logging.info(f"[{self.title}] 已重新生成第{'、'.join(map(str, self.numbers))}部分")
+            self.signals.finished.emit(self.job_id, "", self.save_path, True)
+        except ai.GenerationCancelled:
+            error_msg = "已取消"
+            self.finish_record(self._cancelled_state(), error_msg)
+            self.signals.cancelled.emit(self.job_id, "")
         except Exception as e:
-            # 返回错误信息
-            error_msg = f"生成过程失败：{str(e)}"
-            self.finished.emit(error_msg, "", "", False)
+            error_msg = f"重新生成失败：{str(e)}"
+            self.finish_record(jobs.JobRecord.FAILED, error_msg)
+            self.signals.finished.emit(self.job_id, error_msg, "", False)
+        finally:
+            if self.stats is not None:
+                self._record_metrics(queue_wait, time.perf_counter() - start, success, error_msg, self.save_path)
+
+
+class SectionDialog(QDialog):
+    """选择需要重新生成的章节，并可填写审阅意见"""
+
+    def __init__(self, path, available, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("重新生成章节")
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(f"文件：{os.path.basename(path)}"))
+
+        self.checks = {}
+        for number, name, *_ in ai.DOCUMENT_SECTIONS:
+            check = QCheckBox(f"{number}. {name}")
+            check.setEnabled(number in available)
+            self.checks[number] = check
+            layout.addWidget(check)
+
+        form = QFormLayout()
+        self.feedback_input = QLineEdit()
+        self.feedback_input.setPlaceholderText("可选，例如：对比表增加功耗指标")
+        form.addRow("审阅意见:", self.feedback_input)
+        layout.addLayout(form)
+
+        btn_layout = QHBoxLayout()
+        ok_btn = QPushButton("重新生成")
+        ok_btn.clicked.connect(self.accept)
+        cancel_btn = QPushButton("取消")
+        cancel_btn.clicked.connect(self.reject)
+        btn_layout.addStretch()
+        btn_layout.addWidget(ok_btn)
+        btn_layout.addWidget(cancel_btn)
+        layout.addLayout(btn_layout)
+        self.setLayout(layout)
+
+    def selected_sections(self):
+        return [number for number, check in self.checks.items() if check.isChecked()]
+
+    def feedback(self):
+        return self.feedback_input.text().strip()
+
+
+class GenerationJob:
+    """任务列表中的一条生成任务"""
+    QUEUED = "排队中"
+    RUNNING = "生成中"
+    DONE = "已完成"
+    FAILED = "失败"
+    CANCELLED = "已取消"
+
+    def __init__(self, job_id, title, worker):
+        self.job_id = job_id
+        self.title = title
+        self.worker = worker
+        self.state = self.QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.chars = 0
+        self.ttft = None
+        self.save_path = ""
+        self.error = ""
+
+    @property
+    def is_active(self):
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    def elapsed(self):
+        """运行用时（秒），尚未开始时为0"""
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.time()
+        return end - self.started_at
 
 
 class ConfigDialog(QDialog):
@@ -119,8 +432,21 @@ class ConfigDialog(QDialog):
             return
             
         try:
-            with open(ai.resource_path('config.json'), "w") as f:
-                json.dump({"openai_config": new_config}, f, indent=2)
+            # 保留配置文件中的其他配置段，只更新openai_config
+            config_path = ai.CONFIG_PATH
+            try:
+                with open(config_path, "r", encoding="utf-8") as f:
+                    file_config = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                file_config = {}
+            file_config["openai_config"] = {**file_config.get("openai_config", {}), **new_config}
+
+            # 先写临时文件再替换，避免热加载读到写了一半的文件
+            tmp_path = config_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(file_config, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, config_path)
+            self.config = file_config["openai_config"]
             self.accept()
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存失败: {str(e)}")
@@ -138,19 +464,41 @@ class ConfigDialog(QDialog):
             QMessageBox.critical(self, "错误", f"连接失败: {str(e)}")
 
 class PatentApp(QMainWindow):
+    # 任务列表的列
+    JOB_COLUMNS = ["发明名称", "状态", "已接收字数", "用时", "保存路径"]
+    # 检索结果的列
+    SEARCH_COLUMNS = ["标题", "摘录", "保存路径"]
+    # 信号参数：导出的文件路径列表，错误信息（全部成功时为空）
+    export_finished = pyqtSignal(list, str)
+    # 信号参数：已摘要片段数，已读取片段数，复用数
+    ingest_progress = pyqtSignal(int, int, int)
+    # 信号参数：合并后的创意要点，错误信息（成功时为空）
+    ingest_finished = pyqtSignal(str, str)
+
     def __init__(self):
         super().__init__()
         self.save_path = os.getcwd()  # 默认保存路径
+        self.jobs = {}  # 任务编号 -> GenerationJob
+        self.next_job_id = 1
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.config = None
+        self.initialized = False
+        self.first_painted = False
+        self.startup_report = "--startup-report" in sys.argv
+        # 配置读取、日志初始化与openai预热推迟到窗口首次绘制之后（见 deferred_init）
         self.init_ui()
-        self.worker = None
-        self.setup_logging()
-        self.config = self.load_config()
-        self.progress = None
+
+        # 每秒刷新运行中任务的用时与状态栏指标
+        self.elapsed_timer = QTimer(self)
+        self.elapsed_timer.timeout.connect(self.refresh_running_jobs)
+        self.elapsed_timer.timeout.connect(self.refresh_metrics)
+        self.elapsed_timer.start(1000)
 
     def init_ui(self):
         # 主窗口设置
         self.setWindowTitle("专利文档生成系统 v1.0")
-        self.setGeometry(300, 300, 600, 400)
+        self.setGeometry(300, 200, 760, 760)
 
         # 中心部件
         central_widget = QWidget()
@@ -170,11 +518,18 @@ class PatentApp(QMainWindow):
 
         # 技术特点
         feature_layout = QVBoxLayout()
+        feature_header = QHBoxLayout()
         feature_label = QLabel("技术特点：")
+        self.ingest_btn = QPushButton("导入资料…")
+        self.ingest_btn.setToolTip("从设计文档、代码摘录、测试报告等资料中提炼技术要点")
+        self.ingest_btn.clicked.connect(self.ingest_materials)
+        feature_header.addWidget(feature_label)
+        feature_header.addStretch()
+        feature_header.addWidget(self.ingest_btn)
         self.feature_input = QTextEdit()
         self.feature_input.setPlaceholderText("请输入技术方案要点（支持多行输入）")
         self.feature_input.setMaximumHeight(100)
-        feature_layout.addWidget(feature_label)
+        feature_layout.addLayout(feature_header)
         feature_layout.addWidget(self.feature_input)
 
         # 路径选择
@@ -200,22 +555,140 @@ class PatentApp(QMainWindow):
         open_btn.clicked.connect(self.open_file)
         open_btn.setStyleSheet("background-color: #2196F3; color: white;")
 
+        self.bypass_cache_check = QCheckBox("忽略缓存重新生成")
+        self.parallel_check = QCheckBox("分章节并行生成")
+        candidates_label = QLabel("候选稿数：")
+        self.candidates_spin = QSpinBox()
+        self.candidates_spin.setRange(1, 4)
+        self.candidates_spin.setToolTip("一次请求生成多份候选稿，按章节、字数、流程图与表格要求离线评分，保存得分最高的一份")
+
+        regenerate_btn = QPushButton("重新生成章节")
+        regenerate_btn.clicked.connect(self.regenerate_sections)
+
+        export_btn = QPushButton("导出Word/PDF")
+        export_btn.clicked.connect(self.export_documents)
+        self.export_finished.connect(self.handle_export_finished)
+        self.ingest_progress.connect(self.handle_ingest_progress)
+        self.ingest_finished.connect(self.handle_ingest_finished)
+
         btn_layout.addWidget(generate_btn)
         btn_layout.addWidget(open_btn)
+        btn_layout.addWidget(regenerate_btn)
+        btn_layout.addWidget(export_btn)
+        btn_layout.addWidget(self.bypass_cache_check)
+        btn_layout.addWidget(self.parallel_check)
+        btn_layout.addWidget(candidates_label)
+        btn_layout.addWidget(self.candidates_spin)
         btn_layout.addStretch()
 
+        # 任务列表
+        queue_layout = QHBoxLayout()
+        queue_label = QLabel("任务列表：")
+        workers_label = QLabel("同时生成数：")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 16)
+        self.workers_spin.setValue(self.pool.maxThreadCount())
+        self.workers_spin.valueChanged.connect(self.pool.setMaxThreadCount)
+        cancel_btn = QPushButton("取消所选")
+        cancel_btn.clicked.connect(self.cancel_selected_jobs)
+        clear_btn = QPushButton("清除已结束")
+        clear_btn.clicked.connect(self.clear_finished_jobs)
+
+        queue_layout.addWidget(queue_label)
+        queue_layout.addStretch()
+        queue_layout.addWidget(workers_label)
+        queue_layout.addWidget(self.workers_spin)
+        queue_layout.addWidget(cancel_btn)
+        queue_layout.addWidget(clear_btn)
+
+        self.job_table = QTableWidget(0, len(self.JOB_COLUMNS))
+        self.job_table.setHorizontalHeaderLabels(self.JOB_COLUMNS)
+        self.job_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.job_table.horizontalHeader().setStretchLastSection(True)
+        self.job_table.cellDoubleClicked.connect(self.open_job_file)
+
+        # 全文检索
+        search_layout = QHBoxLayout()
+        search_label = QLabel("全文检索：")
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("输入关键词，多个词用空格分隔，例如：特征提取 卷积")
+        self.search_input.returnPressed.connect(self.search_documents)
+        search_btn = QPushButton("搜索")
+        search_btn.clicked.connect(self.search_documents)
+        search_layout.addWidget(search_label)
+        search_layout.addWidget(self.search_input)
+        search_layout.addWidget(search_btn)
+
+        self.search_table = QTableWidget(0, len(self.SEARCH_COLUMNS))
+        self.search_table.setHorizontalHeaderLabels(self.SEARCH_COLUMNS)
+        self.search_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.search_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.search_table.verticalHeader().setVisible(False)
+        self.search_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.search_table.horizontalHeader().setStretchLastSection(True)
+        self.search_table.cellDoubleClicked.connect(self.open_search_result)
+
         # 组装主布局
         main_layout.addLayout(name_layout)
         main_layout.addLayout(feature_layout)
         main_layout.addLayout(path_layout)
         main_layout.addLayout(btn_layout)
-        main_layout.addStretch()
+        main_layout.addLayout(queue_layout)
+        main_layout.addWidget(self.job_table)
+        main_layout.addLayout(search_layout)
+        main_layout.addWidget(self.search_table)
 
          # 添加菜单栏
         menu = self.menuBar()
         config_action = menu.addAction("配置")
         config_action.triggered.connect(self.show_config)
 
+        # 状态栏右侧常驻显示滚动的耗时分位数与今日token用量
+        self.metrics_label = QLabel()
+        self.statusBar().addPermanentWidget(self.metrics_label)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_painted:
+            self.first_painted = True
+            startup.mark("first_paint")
+            QTimer.singleShot(0, self.deferred_init)
+
+    def deferred_init(self):
+        """窗口显示后再执行的初始化：日志、配置读取与后台预热（重复调用无副作用）"""
+        if self.initialized:
+            return
+        self.initialized = True
+        startup.uninstall_import_hook()
+        self.setup_logging()
+        self.config = self.load_config()
+        self.workers_spin.setValue(self.load_max_workers())
+        self.candidates_spin.setValue(self.load_candidates())
+        self.refresh_metrics()
+        self.update_search_index(self.save_path)
+        try:
+            self.resume_unfinished_jobs()
+        except Exception as e:
+            logging.warning(f"恢复未完成任务失败: {e}")
+        startup.mark("deferred_init")
+
+        def on_warm_up_done(seconds):
+            startup.record("openai预热", seconds)
+            startup.log_report()
+
+        warm_up = ai.warm_up(on_warm_up_done)
+        if self.startup_report:
+            warm_up.join()
+            print(startup.report_text())
+            QTimer.singleShot(0, QApplication.instance().quit)
+
+    def refresh_metrics(self):
+        # 状态栏汇总不需要配置：配置文件缺失或未填密钥时（等待用户在配置对话框中填写）也不能抛出异常
+        self.metrics_label.setText(metrics.get_registry().summary_text())
+
     def load_config(self):
         """加载配置文件并返回配置字典"""
         default_config = {
@@ -225,7 +698,7 @@ class PatentApp(QMainWindow):
         }
         
         try:
-            with open(ai.resource_path('config.json'), "r") as f:
+            with open(ai.CONFIG_PATH, "r") as f:
                 config_data = json.load(f)
                 return config_data.get("openai_config", default_config)
         except FileNotFoundError:
@@ -238,11 +711,30 @@ class PatentApp(QMainWindow):
             logging.error(f"配置加载异常: {str(e)}")
             return default_config
         
+    def load_max_workers(self):
+        """读取任务队列的并发数，默认2"""
+        try:
+            with open(ai.CONFIG_PATH, "r", encoding="utf-8") as f:
+                config_data = json.load(f)
+            return max(1, int(config_data.get("queue", {}).get("max_workers", 2)))
+        except Exception:
+            return 2
+
+    def load_candidates(self):
+        """读取默认的候选稿数，默认1"""
+        try:
+            with open(ai.CONFIG_PATH, "r", encoding="utf-8") as f:
+                config_data = json.load(f)
+            return max(1, int(config_data.get("generation_params", {}).get("candidates", 1)))
+        except Exception:
+            return 1
+
     def show_config(self):
+        self.deferred_init()
         dialog = ConfigDialog(self.config, self)
         if dialog.exec_() == QDialog.Accepted:
             self.config = dialog.config
-            QMessageBox.information(self, "提示", "配置已更新，新配置将在下次生成时生效")
+            QMessageBox.information(self, "提示", "配置已更新，将立即应用于新的生成任务")
 
     def setup_logging(self):
         logging.basicConfig(
@@ -262,6 +754,7 @@ class PatentApp(QMainWindow):
             self.save_path = directory
             self.path_display.setText(directory)
             logging.info(f"保存路径已更改为：{directory}")
+            self.update_search_index(directory)
 
     def validate_input(self):
         """验证输入有效性"""
@@ -281,102 +774,348 @@ class PatentApp(QMainWindow):
         return True
 
     def generate_document(self):
+        self.deferred_init()
         current_config = self.config.copy()
-        """生成文档主逻辑"""
+        """将当前输入加入生成队列"""
         if not self.validate_input():
             return
         
         try:
-             # 创建进度窗口
-            self.progress = QMessageBox(self)
-            self.progress.setWindowTitle("生成中...")
-            self.progress.setBaseSize(100, 50)
-            
-            # 添加取消按钮
-            self.progress.addButton("取消", QMessageBox.RejectRole)
-            self.progress.buttonClicked.connect(self.on_cancel_clicked)
-            
-            # 显示窗口
-            self.progress.show()
-            
-            # 启动工作线程
-            self.worker = Worker(
-                title=self.name_input.text().strip(),
-                ideas=self.feature_input.toPlainText().strip(),
+            title = self.name_input.text().strip()
+            ideas = self.feature_input.toPlainText().strip()
+            if not self.check_duplicates(title, ideas):
+                return
+            use_cache = not self.bypass_cache_check.isChecked()
+            parallel_sections = self.parallel_check.isChecked()
+            candidates = self.candidates_spin.value()
+            mode = "parallel" if parallel_sections else ("candidates" if candidates > 1 else "stream")
+            # 先登记任务记录，程序中途退出或崩溃后可在下次启动时恢复
+            record_id = ai.get_job_store().add(title, ideas, self.save_path, mode=mode,
+                                               params={"use_cache": use_cache, "candidates": candidates})
+
+            worker = Worker(
+                job_id=self.next_job_id,
+                title=title,
+                ideas=ideas,
                 config=current_config,  # 传递当前配置
-                save_path=self.save_path
+                save_path=self.save_path,
+                use_cache=use_cache,
+                parallel_sections=parallel_sections,
+                record_id=record_id,
+                candidates=candidates
             )
-            # self.worker = Worker(name, features, self.config, self.save_path)
-            self.worker.finished.connect(self.handle_generation_result)
-            self.worker.start()
+            self.enqueue_worker(worker, title)
+            self.statusBar().showMessage(f"已加入生成队列：{title}", 3000)
 
         except Exception as e:
-            self.progress.close()
             logging.error(f"生成错误：{str(e)}")
-            self.closeEvent(e)
             QMessageBox.critical(
                 self, "系统错误",
                 f"发生未知错误：\n{str(e)}",
                 buttons=QMessageBox.Ok
             )
 
-    def on_cancel_clicked(self, button):
-        """取消按钮点击处理"""
-        self.cancel_generation()
-        
+    def check_duplicates(self, title, ideas):
+        """生成前查找近似重复的历史输入，返回是否继续生成新文档
 
-    def start_close_animation(self):
-        """启动关闭动画"""
-        from PyQt5.QtCore import QPropertyAnimation
-        
-        self.animation = QPropertyAnimation(self.progress, b"windowOpacity")
-        self.animation.setDuration(300)  # 300ms动画
-        self.animation.setStartValue(1.0)
-        self.animation.setEndValue(0.0)
-        self.animation.finished.connect(lambda: self.progress.deleteLater())
-        self.animation.start()
-
-    def handle_generation_result(self, error_msg, content, save_path, success):
-        """处理生成完成信号"""
+        找到时由用户选择打开已有文档、复制已有文档后只重新生成部分章节，或仍然生成。
+        """
         try:
-            self.start_close_animation()
-            
-            # 处理生成结果
-            if success:
-                self.current_file = save_path
-                self.statusBar().showMessage(f"文档已保存至：{save_path}", 5000)
-                
-                # 显示成功弹窗
-                success_box = QMessageBox(self)
-                success_box.setWindowTitle("生成成功")
-                success_box.setText(f"文件已保存到：\n{save_path}")
-                success_box.setIcon(QMessageBox.Information)
-                success_box.exec_()
-                
-                # 自动打开文件
-                if os.path.exists(save_path):
-                    os.startfile(save_path)
+            matches = ai.find_duplicates(title, ideas)
+        except Exception as e:
+            logging.warning(f"近似重复检测失败: {e}")
+            return True
+        if not matches:
+            return True
+
+        best = matches[0]
+        box = QMessageBox(self)
+        box.setIcon(QMessageBox.Question)
+        box.setWindowTitle("发现相似的历史输入")
+        box.setText(f"本次输入与已生成的交底书相似度为 {best.similarity:.0%}：\n"
+                    f"{best.title}\n{best.path}")
+        if len(matches) > 1:
+            box.setInformativeText(f"另有{len(matches) - 1}篇相似文档")
+        open_btn = box.addButton("打开已有文档", QMessageBox.AcceptRole)
+        adapt_btn = box.addButton("基于已有文档修改", QMessageBox.AcceptRole)
+        generate_btn = box.addButton("仍然生成", QMessageBox.DestructiveRole)
+        box.addButton(QMessageBox.Cancel)
+        box.exec_()
+
+        clicked = box.clickedButton()
+        if clicked is open_btn:
+            self.current_file = best.path
+            self.open_file()
+        elif clicked is adapt_btn:
+            self.adapt_document(best.path, title)
+        return clicked is generate_btn
+
+    def adapt_document(self, source_path, title):
+        """复制已有交底书并改为本次的发明名称，再选择需要重新生成的章节"""
+        try:
+            with open(source_path, "r", encoding="utf-8") as f:
+                document = ai.parse_document(f.read())
+            heading = f"# {title} 专利交底书"
+            document.preamble, replaced = re.subn(r"^#\s+.*$", lambda _: heading, document.preamble,
+                                                  count=1, flags=re.M)
+            if not replaced:
+                document.preamble = f"{heading}\n\n{document.preamble}"
+            path = ai.allocate_save_path(self.save_path, title)
+            ai.write_document(path, document.render())
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"复制已有文档失败：{str(e)}")
+            return
+        self.current_file = path
+        self.choose_sections(path)
+
+    def regenerate_sections(self):
+        """选择已保存的交底书及其中的章节，只重新生成这些章节"""
+        self.deferred_init()
+        start_dir = getattr(self, 'current_file', '') or self.save_path
+        path, _ = QFileDialog.getOpenFileName(self, "选择专利交底书", start_dir, "Markdown文件 (*.md)")
+        if path:
+            self.choose_sections(path)
+
+    def choose_sections(self, path):
+        """打开章节选择对话框，并将所选章节的重新生成加入队列"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                document = ai.parse_document(f.read())
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"读取文件失败：{str(e)}")
+            return
+        if not document.sections:
+            QMessageBox.warning(self, "无法识别", "未在文件中找到编号章节")
+            return
+
+        dialog = SectionDialog(path, document.sections, self)
+        if dialog.exec_() != QDialog.Accepted or not dialog.selected_sections():
+            return
+
+        title = document.title or os.path.basename(path)
+        ideas = self.feature_input.toPlainText().strip()
+        try:
+            record_id = ai.get_job_store().add(
+                title, ideas, os.path.dirname(path), mode="regenerate", save_path=path,
+                params={"numbers": dialog.selected_sections(), "feedback": dialog.feedback()})
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"任务登记失败：{str(e)}")
+            return
+        worker = SectionWorker(self.next_job_id, path, dialog.selected_sections(), ideas, dialog.feedback(),
+                               self.config.copy(), record_id=record_id)
+        self.enqueue_worker(worker, f"{title}（重新生成章节）")
+
+    def enqueue_worker(self, worker, title):
+        """将任务加入任务列表与线程池"""
+        self.next_job_id += 1
+        worker.signals.started.connect(self.handle_job_started)
+        worker.signals.first_token.connect(self.handle_first_token)
+        worker.signals.progress.connect(self.handle_generation_progress)
+        worker.signals.finished.connect(self.handle_generation_result)
+        worker.signals.cancelled.connect(self.handle_job_cancelled)
+
+        job = GenerationJob(worker.job_id, title, worker)
+        self.jobs[worker.job_id] = job
+        self.add_job_row(job)
+        self.pool.start(worker)
+
+    def resume_unfinished_jobs(self):
+        """恢复上次退出或崩溃时未完成的任务
+
+        上次因程序退出而中断的任务总会恢复；执行中途崩溃（记录仍为执行中）达到 jobs.max_attempts
+        次的任务视为失败，避免反复导致崩溃的任务无限重试。
+        """
+        store = ai.get_job_store()
+        settings = ai.ConfigLoader().config['jobs']
+        store.purge(settings['keep_days'])
+        resumed = 0
+        for record in store.unfinished("gui"):
+            if record.state == jobs.JobRecord.RUNNING and record.attempts >= settings['max_attempts']:
+                store.finish(record.id, jobs.JobRecord.FAILED, f"已尝试{record.attempts}次仍未完成")
+                continue
+            if record.mode == "regenerate":
+                worker = SectionWorker(self.next_job_id, record.save_path, record.params["numbers"], record.ideas,
+                                       record.params["feedback"], self.config.copy(), record_id=record.id)
+                self.enqueue_worker(worker, f"{record.title}（重新生成章节）")
             else:
-                # 显示错误详情
-                error_box = QMessageBox(self)
-                error_box.setWindowTitle("生成失败")
-                error_box.setText(f"错误信息：\n{error_msg}")
-                error_box.setIcon(QMessageBox.Critical)
-                error_box.exec_()
-                
+                # 候选稿任务不写部分文件，恢复时重新请求全部候选；流式任务从部分文件续写
+                worker = Worker(self.next_job_id, record.title, record.ideas, self.config.copy(), record.save_dir,
+                                use_cache=record.params.get("use_cache", True),
+                                parallel_sections=record.mode == "parallel", record_id=record.id,
+                                candidates=record.params.get("candidates", 2) if record.mode == "candidates" else 1)
+                self.enqueue_worker(worker, record.title)
+            resumed += 1
+        if resumed:
+            logging.info(f"已恢复{resumed}个未完成的任务")
+            self.statusBar().showMessage(f"已恢复{resumed}个上次未完成的任务", 5000)
+
+    def add_job_row(self, job):
+        """在任务列表末尾添加一行"""
+        row = self.job_table.rowCount()
+        self.job_table.insertRow(row)
+        for column in range(len(self.JOB_COLUMNS)):
+            self.job_table.setItem(row, column, QTableWidgetItem())
+        self.job_table.item(row, 0).setData(Qt.UserRole, job.job_id)
+        self.update_job_row(job)
+
+    def find_job_row(self, job_id):
+        for row in range(self.job_table.rowCount()):
+            if self.job_table.item(row, 0).data(Qt.UserRole) == job_id:
+                return row
+        return -1
+
+    def update_job_row(self, job):
+        """刷新任务在列表中的显示"""
+        row = self.find_job_row(job.job_id)
+        if row < 0:
+            return
+        values = [job.title, job.state, str(job.chars), f"{job.elapsed():.0f}秒", job.save_path]
+        for column, value in enumerate(values):
+            self.job_table.item(row, column).setText(value)
+        tooltip = job.error
+        if job.ttft is not None:
+            tooltip = f"首字延迟 {job.ttft:.1f} 秒" + (f"\n{tooltip}" if tooltip else "")
+        self.job_table.item(row, 1).setToolTip(tooltip)
+
+    def refresh_running_jobs(self):
+        for job in self.jobs.values():
+            if job.state == GenerationJob.RUNNING:
+                self.update_job_row(job)
+
+    def handle_job_started(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.state = GenerationJob.RUNNING
+        job.started_at = time.time()
+        self.update_job_row(job)
+
+    def handle_first_token(self, job_id, ttft):
+        """记录首字延迟"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.ttft = ttft
+
+    def handle_generation_progress(self, job_id, chars, elapsed):
+        """刷新任务的实时字数"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        # 界面线程中的处理耗时计入对应任务的剖析结果
+        with profiling.stage("qt-slot", job.worker.profile):
+            job.chars = chars
+            self.update_job_row(job)
+
+    def handle_generation_result(self, job_id, error_msg, save_path, success):
+        """处理生成完成信号"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.finished_at = time.time()
+        if success:
+            job.state = GenerationJob.DONE
+            job.save_path = save_path
+            self.current_file = save_path
+            self.statusBar().showMessage(f"文档已保存至：{save_path}", 5000)
+        else:
+            job.state = GenerationJob.FAILED
+            job.error = error_msg
+            logging.error(f"[{job.title}] {error_msg}")
+            self.statusBar().showMessage(f"{job.title} 生成失败：{error_msg}", 5000)
+        self.update_job_row(job)
+
+    def handle_job_cancelled(self, job_id, part_path):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.state = GenerationJob.CANCELLED
+        job.finished_at = time.time()
+        if part_path and os.path.exists(part_path):
+            job.save_path = part_path
+            job.error = "已接收内容保留在部分文件中"
+        self.update_job_row(job)
+
+    def cancel_job(self, job, interrupted=False):
+        """取消任务：排队中的直接移出队列，运行中的中断连接
+
+        interrupted 为True（程序退出）时任务记录保持可恢复状态。
+        """
+        if job.state == GenerationJob.QUEUED and self.pool.tryTake(job.worker):
+            job.state = GenerationJob.CANCELLED
+            job.finished_at = time.time()
+            self.update_job_row(job)
+            if not interrupted:
+                job.worker.finish_record(jobs.JobRecord.CANCELLED, "已取消")
+        elif job.is_active:
+            job.worker.stop(interrupted)
+
+    def cancel_selected_jobs(self):
+        rows = {index.row() for index in self.job_table.selectionModel().selectedRows()}
+        for row in rows:
+            job = self.jobs.get(self.job_table.item(row, 0).data(Qt.UserRole))
+            if job is not None:
+                self.cancel_job(job)
+
+    def clear_finished_jobs(self):
+        """从列表中移除已结束的任务"""
+        for row in reversed(range(self.job_table.rowCount())):
+            job_id = self.job_table.item(row, 0).data(Qt.UserRole)
+            job = self.jobs.get(job_id)
+            if job is None or not job.is_active:
+                self.job_table.removeRow(row)
+                self.jobs.pop(job_id, None)
+
+    def update_search_index(self, directory):
+        """在后台线程中按修改时间增量索引目录中的交底书"""
+        def run():
+            try:
+                changed, removed = ai.get_search_index().update(directory)
+                if changed or removed:
+                    logging.info(f"全文索引已更新：{directory}（更新{changed}个，移除{removed}个）")
+            except Exception as e:
+                logging.warning(f"全文索引更新失败: {e}")
+
+        threading.Thread(target=run, name="search-index", daemon=True).start()
+
+    def search_documents(self):
+        """检索已生成的交底书并显示在结果列表中"""
+        query = self.search_input.text().strip()
+        if not query:
+            return
+        self.deferred_init()
+        start = time.perf_counter()
+        try:
+            hits = ai.get_search_index().search(query)
         except Exception as e:
-            logging.error(f"结果处理异常: {str(e)}")
-            QMessageBox.critical(
-                self, 
-                "系统错误", 
-                f"结果处理失败：{str(e)}"
-            )
+            QMessageBox.warning(self, "检索失败", str(e))
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        self.search_table.setRowCount(0)
+        for hit in hits:
+            row = self.search_table.rowCount()
+            self.search_table.insertRow(row)
+            for column, value in enumerate((hit.title, hit.snippet, hit.path)):
+                self.search_table.setItem(row, column, QTableWidgetItem(value))
+        self.statusBar().showMessage(f"找到{len(hits)}个文档（{elapsed:.0f}毫秒）", 5000)
+
+    def open_search_result(self, row, column):
+        """双击检索结果打开对应文件"""
+        self.current_file = self.search_table.item(row, 2).text()
+        self.open_file()
+
+    def open_job_file(self, row, column):
+        """双击已完成的任务打开对应文件"""
+        job = self.jobs.get(self.job_table.item(row, 0).data(Qt.UserRole))
+        if job is not None and job.state == GenerationJob.DONE:
+            self.current_file = job.save_path
+            self.open_file()
 
     def closeEvent(self, event):
-        """窗口关闭时安全终止线程"""
-        if self.worker and self.worker.isRunning():
-            self.worker.stop()
-            self.worker.wait(2000)  # 等待2秒
+        """窗口关闭时取消所有任务并等待线程退出"""
+        # 中断的任务在下次启动时恢复（见 resume_unfinished_jobs）
+        for job in self.jobs.values():
+            self.cancel_job(job, interrupted=True)
+        self.pool.waitForDone(2000)  # 等待2秒
         event.accept()
 
     def on_generate_finish(self, result, success, progress):
@@ -391,15 +1130,90 @@ class PatentApp(QMainWindow):
         
         
 
+    def export_documents(self):
+        """选择交底书并在后台导出为 config.json 中 export.formats 指定的格式"""
+        self.deferred_init()
+        start_dir = getattr(self, 'current_file', '') or self.save_path
+        paths, _ = QFileDialog.getOpenFileNames(self, "选择要导出的交底书", start_dir, "Markdown文件 (*.md)")
+        if not paths:
+            return
+        try:
+            options = ai.get_export_options()
+        except Exception as e:
+            QMessageBox.warning(self, "导出失败", str(e))
+            return
+
+        def run():
+            try:
+                results = export.export_documents(paths, options)
+            except Exception as e:
+                self.export_finished.emit([], str(e))
+                return
+            outputs = [output for result in results for output in result.outputs]
+            errors = "\n".join(f"{os.path.basename(result.path)}：{result.error}"
+                               for result in results if not result.success)
+            self.export_finished.emit(outputs, errors)
+
+        threading.Thread(target=run, name="export", daemon=True).start()
+        self.statusBar().showMessage(f"正在导出{len(paths)}个文档…")
+
+    def handle_export_finished(self, outputs, errors):
+        if outputs:
+            self.current_file = outputs[0]
+            self.statusBar().showMessage(f"已导出{len(outputs)}个文件：{outputs[0]}", 5000)
+        if errors:
+            QMessageBox.warning(self, "导出失败", errors)
+
+    def ingest_materials(self):
+        """选择技术资料，在后台摘要合并后填入技术特点（已填写的内容在合并时保留）"""
+        self.deferred_init()
+        extensions = " ".join(f"*{extension}" for extension in ingest.SUPPORTED_EXTENSIONS)
+        paths, _ = QFileDialog.getOpenFileNames(self, "选择技术资料", self.save_path, f"技术资料 ({extensions})")
+        if not paths:
+            return
+        title = self.name_input.text().strip()
+        ideas = self.feature_input.toPlainText().strip()
+
+        def run():
+            try:
+                result = ai.ingest_sources(paths, title, ideas, on_progress=self.ingest_progress.emit)
+            except Exception as e:
+                logging.error(f"资料导入失败: {e}")
+                self.ingest_finished.emit("", str(e))
+                return
+            self.ingest_finished.emit(result.ideas, "")
+
+        self.ingest_btn.setEnabled(False)
+        threading.Thread(target=run, name="ingest", daemon=True).start()
+        self.statusBar().showMessage(f"正在读取{len(paths)}个资料文件…")
+
+    def handle_ingest_progress(self, done, total, reused):
+        self.statusBar().showMessage(f"正在摘要资料：{done}/{total}个片段（复用{reused}个）")
+
+    def handle_ingest_finished(self, ideas, error):
+        self.ingest_btn.setEnabled(True)
+        if error:
+            self.statusBar().clearMessage()
+            QMessageBox.warning(self, "导入失败", error)
+            return
+        self.feature_input.setPlainText(ideas)
+        self.statusBar().showMessage("资料要点已填入技术特点，请检查后再生成", 5000)
+
     def open_file(self):
-        """打开生成的文件"""
+        """用系统默认程序打开生成的文件"""
         if hasattr(self, 'current_file') and os.path.exists(self.current_file):
-            os.startfile(self.current_file)
+            QDesktopServices.openUrl(QUrl.fromLocalFile(self.current_file))
         else:
             QMessageBox.warning(self, "文件不存在", "请先生成文档或选择有效文件")
 
 if __name__ == "__main__":
+    # 打包后的程序中，导出使用的渲染子进程需要由此进入
+    multiprocessing.freeze_support()
+    if "--profile" in sys.argv:
+        profiling.enable()
+    startup.mark("imports")
     app = QApplication(sys.argv)
     window = PatentApp()
+    startup.mark("window_created")
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,208 @@
+"""请求级指标与token统计
+
+每次上游请求与每个生成任务结束时记录一条结构化指标：以JSON行写入 "patent.metrics" 日志
+（随应用的日志配置进入 app.log），并保留最近若干条用于计算滚动的p50/p95与每日token用量，
+可选输出Prometheus文本格式。
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("patent.metrics")
+
+
+class RequestMetrics:
+    """一次上游补全请求的测量结果"""
+
+    def __init__(self, kind="document", queue_wait=0.0):
+        self.kind = kind
+        self.model = ""
+        self.endpoint = ""
+        self.queue_wait = queue_wait
+        self.connect_time = None
+        self.ttft = None
+        self.total_latency = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.usage_estimated = False
+        self.output_bytes = 0
+        self.attempts = 0
+        self.retries = 0
+        self.finish_reason = None
+        self.success = False
+        self.error = ""
+        self._started_at = time.perf_counter()
+
+    @property
+    def tokens_per_sec(self):
+        if not self.total_latency or not self.completion_tokens:
+            return None
+        decode_time = self.total_latency - (self.ttft or 0.0)
+        return self.completion_tokens / decode_time if decode_time > 0 else None
+
+    def elapsed(self):
+        return time.perf_counter() - self._started_at
+
+    def to_dict(self):
+        return {
+            "event": "request",
+            "kind": self.kind,
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "queue_wait": _round(self.queue_wait),
+            "connect_time": _round(self.connect_time),
+            "ttft": _round(self.ttft),
+            "total_latency": _round(self.total_latency),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "usage_estimated": self.usage_estimated,
+            "tokens_per_sec": _round(self.tokens_per_sec),
+            "output_bytes": self.output_bytes,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "finish_reason": self.finish_reason,
+            "success": self.success,
+            "error": self.error,
+        }
+
+
+def _round(value, digits=4):
+    return round(value, digits) if value is not None else None
+
+
+def _percentile(values, pct):
+    """最近秩法计算分位数，空列表返回None"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+class MetricsRegistry:
+    """汇总最近的请求指标"""
+
+    def __init__(self, window=1000):
+        self.requests = deque(maxlen=window)
+        self.jobs = deque(maxlen=window)
+        self.tokens_per_day = {}
+        self.totals = {"requests": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                       "jobs": 0, "job_failures": 0}
+        self.prometheus_file = ""
+        self._lock = threading.Lock()
+
+    def record_request(self, metrics):
+        """记录一次上游请求并写入日志"""
+        record = metrics.to_dict()
+        day = time.strftime("%Y-%m-%d")
+        with self._lock:
+            self.requests.append(record)
+            self.totals["requests"] += 1
+            self.totals["failures"] += 0 if metrics.success else 1
+            self.totals["prompt_tokens"] += metrics.prompt_tokens
+            self.totals["completion_tokens"] += metrics.completion_tokens
+            self.tokens_per_day[day] = (self.tokens_per_day.get(day, 0)
+                                        + metrics.prompt_tokens + metrics.completion_tokens)
+        logger.info(json.dumps(record, ensure_ascii=False))
+        self._dump_prometheus()
+
+    def record_job(self, **fields):
+        """记录一个生成任务（排队、生成、保存的整体耗时）并写入日志"""
+        record = {"event": "job"}
+        record.update({k: _round(v) if isinstance(v, float) else v for k, v in fields.items()})
+        with self._lock:
+            self.jobs.append(record)
+            self.totals["jobs"] += 1
+            self.totals["job_failures"] += 0 if record.get("success") else 1
+        logger.info(json.dumps(record, ensure_ascii=False))
+        self._dump_prometheus()
+
+    def record_event(self, event, **fields):
+        """记录其他结构化事件（如校验与修复结果），只写入日志"""
+        record = {"event": event}
+        record.update(fields)
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+    def summary(self):
+        """滚动汇总：任务总耗时与首字延迟的p50/p95、今日token用量"""
+        with self._lock:
+            latencies = [r["total"] for r in self.jobs if r.get("success") and r.get("total") is not None]
+            ttfts = [r["ttft"] for r in self.requests if r["success"] and r["ttft"] is not None]
+            tokens_today = self.tokens_per_day.get(time.strftime("%Y-%m-%d"), 0)
+            jobs = len(self.jobs)
+        return {
+            "jobs": jobs,
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+            "ttft_p50": _percentile(ttfts, 50),
+            "ttft_p95": _percentile(ttfts, 95),
+            "tokens_today": tokens_today,
+        }
+
+    def summary_text(self):
+        """状态栏使用的一行汇总"""
+        s = self.summary()
+        if not s["jobs"]:
+            return f"今日token：{s['tokens_today']}"
+        fmt = lambda v: f"{v:.1f}秒" if v is not None else "-"
+        return (f"近{s['jobs']}个任务 耗时p50 {fmt(s['latency_p50'])} / p95 {fmt(s['latency_p95'])}"
+                f" · 首字p50 {fmt(s['ttft_p50'])} · 今日token：{s['tokens_today']}")
+
+    def prometheus_text(self):
+        """以Prometheus文本格式导出计数器与延迟分位数"""
+        summary = self.summary()
+        with self._lock:
+            totals = dict(self.totals)
+            latencies = [r["total_latency"] for r in self.requests
+                         if r["success"] and r["total_latency"] is not None]
+        lines = [
+            "# HELP patent_requests_total 上游补全请求数",
+            "# TYPE patent_requests_total counter",
+            f'patent_requests_total{{status="success"}} {totals["requests"] - totals["failures"]}',
+            f'patent_requests_total{{status="failure"}} {totals["failures"]}',
+            "# HELP patent_tokens_total 累计token数",
+            "# TYPE patent_tokens_total counter",
+            f'patent_tokens_total{{type="prompt"}} {totals["prompt_tokens"]}',
+            f'patent_tokens_total{{type="completion"}} {totals["completion_tokens"]}',
+            "# HELP patent_jobs_total 生成任务数",
+            "# TYPE patent_jobs_total counter",
+            f'patent_jobs_total{{status="success"}} {totals["jobs"] - totals["job_failures"]}',
+            f'patent_jobs_total{{status="failure"}} {totals["job_failures"]}',
+            "# HELP patent_request_latency_seconds 上游请求总耗时",
+            "# TYPE patent_request_latency_seconds summary",
+        ]
+        for quantile in (50, 95, 99):
+            value = _percentile(latencies, quantile)
+            if value is not None:
+                lines.append(f'patent_request_latency_seconds{{quantile="{quantile / 100}"}} {value:.4f}')
+        lines.append(f"patent_request_latency_seconds_count {len(latencies)}")
+        lines += [
+            "# HELP patent_ttft_seconds 首字延迟",
+            "# TYPE patent_ttft_seconds summary",
+        ]
+        for key, quantile in (("ttft_p50", "0.5"), ("ttft_p95", "0.95")):
+            if summary[key] is not None:
+                lines.append(f'patent_ttft_seconds{{quantile="{quantile}"}} {summary[key]:.4f}')
+        return "\n".join(lines) + "\n"
+
+    def _dump_prometheus(self):
+        if not self.prometheus_file:
+            return
+        tmp_path = f"{self.prometheus_file}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.prometheus_file)
+        except OSError as e:
+            logger.warning(f"Prometheus指标写入失败: {e}")
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
@@ -0,0 +1,369 @@
+"""本地 OpenAI 兼容模拟服务
+
+实现 /v1/chat/completions（流式与非流式）和 /v1/models，
+可配置出字速率、首字延迟、错误注入与429限流，用于在不消耗真实API额度的情况下测试吞吐与延迟。
+429既可按概率随机注入，也可按每分钟请求数与同时处理的请求数真实限流（模拟服务商的额度）。
+请求中的 max_tokens 会截断输出（finish_reason="length"），带助手消息的请求按续写处理。
+
+用法示例：
+    python mock_server.py --port 8000 --token-rate 200 --first-token-delay 0.5 --error-rate 0.05
+然后在 config.json 中将 base_url 设为 http://127.0.0.1:8000/v1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模拟生成的交底书模板，结构与提示词要求的七个部分一致
+MOCK_DOCUMENT = """# 模拟专利交底书
+
+## 1. 专业领域
+
+本发明涉及图像处理技术领域，具体涉及一种基于深度学习的图像识别方法。
+
+## 2. 技术背景与现有技术
+
+{filler}
+
+```mermaid
+graph TD
+    A[图像采集] --> B[预处理]
+    B --> C[特征提取]
+    C --> D[分类识别]
+```
+
+## 3. 现有技术缺点与发明目的
+
+1. 识别精度不足：$E = 1 - \\frac{{TP}}{{TP + FN}}$
+2. 计算量大：$C = O(n^2)$
+3. 鲁棒性差：$\\Delta a = a_0 - a_1$
+
+## 4. 本发明技术详细方案
+
+{filler}
+
+$$f(x) = \\sum_{{i=0}}^n \\alpha_i x^i$$
+
+```mermaid
+graph TD
+    A[输入图像] --> B[归一化]
+    B --> C[卷积特征提取]
+    C --> D[注意力加权]
+    D --> E[特征融合]
+    E --> F[分类输出]
+```
+
+## 5. 关键点与保护范围
+
+1. 注意力加权的特征融合结构
+2. 多尺度卷积特征提取方法
+3. 自适应归一化步骤
+
+## 6. 技术优势对比
+
+| 指标 | 现有技术 | 本发明 |
+| --- | --- | --- |
+| 准确率 | 90% | 96% |
+| 处理速度 | 20fps | 30fps |
+| 模型大小 | 200MB | 80MB |
+| 功耗 | 15W | 9W |
+| 误报率 | 5% | 2% |
+
+## 7. 替代实施方案
+
+方案一：使用轻量级骨干网络，适用于嵌入式设备。
+方案二：使用Transformer结构，适用于服务器端高精度场景。
+"""
+
+FILLER = "本段为模拟服务生成的第{index}句占位文本，用于压测吞吐与延迟。"
+
+
+class MockOptions:
+    """模拟服务的行为参数"""
+
+    def __init__(self, token_rate=200.0, first_token_delay=0.5, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1, output_chars=3000, chars_per_token=2,
+                 rpm_limit=0, concurrency_limit=0, ignore_n=False, models=("gpt-4o-mini", "gpt-4-turbo", "gpt-3.5-turbo", "DeepSeek-R1")):
+        self.token_rate = token_rate
+        self.first_token_delay = first_token_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rpm_limit = rpm_limit
+        self.concurrency_limit = concurrency_limit
+        self.ignore_n = ignore_n
+        self.output_chars = output_chars
+        self.chars_per_token = chars_per_token
+        self.models = list(models)
+
+    def document(self):
+        filler_len = max(0, (self.output_chars - len(MOCK_DOCUMENT)) // 2)
+        # 句子带编号，避免文本周期性重复（续写时需要在文档中唯一定位已输出的末尾）
+        sentences = []
+        while sum(map(len, sentences)) < filler_len:
+            sentences.append(FILLER.format(index=len(sentences) + 1))
+        filler = "".join(sentences)[:filler_len]
+        return MOCK_DOCUMENT.format(filler=filler)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "PatentAssistantMock/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def options(self):
+        return self.server.options
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, error_type, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+    def _write_chunk(self, data):
+        """以HTTP/1.1分块编码写出一段数据"""
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            data = [{"id": model, "object": "model", "owned_by": "mock"} for model in self.options.models]
+            self._send_json(200, {"object": "list", "data": data})
+        else:
+            self._send_error(404, f"未知路径：{self.path}", "not_found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "请求体不是有效的JSON", "invalid_request_error")
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_error(404, f"未知路径：{self.path}", "not_found")
+            return
+
+        self.server.count_request()
+        retry_after = self.server.admit()
+        if retry_after is not None:
+            self._send_error(429, "超出请求额度", "rate_limit_exceeded", {"Retry-After": str(retry_after)})
+            return
+        try:
+            self._handle_completion(request)
+        finally:
+            self.server.release_slot()
+
+    def _handle_completion(self, request):
+        roll = random.random()
+        if roll < self.options.rate_limit_rate:
+            self._send_error(429, "请求过于频繁", "rate_limit_exceeded",
+                             {"Retry-After": str(self.options.retry_after)})
+            return
+        if roll < self.options.rate_limit_rate + self.options.error_rate:
+            self._send_error(500, "模拟的服务端错误", "server_error")
+            return
+
+        if request.get("stream"):
+            self._stream_completion(request)
+        else:
+            self._completion(request)
+
+    def _tokens(self, text):
+        step = self.options.chars_per_token
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+    def _reply(self, request):
+        """按请求生成回复的token列表与结束原因
+
+        最后一条助手消息视为已输出的内容，从其末尾在文档中的位置接着输出（模拟续写）；
+        超过 max_tokens 时截断并返回 finish_reason="length"。
+        """
+        text = self.options.document()
+        assistant = [m.get("content") or "" for m in request.get("messages", []) if m.get("role") == "assistant"]
+        if assistant and assistant[-1]:
+            tail = assistant[-1]
+            pos = text.find(tail)
+            if pos >= 0:
+                text = text[pos + len(tail):]
+        tokens = self._tokens(text)
+        max_tokens = request.get("max_tokens")
+        if max_tokens and len(tokens) > max_tokens:
+            return tokens[:max_tokens], "length"
+        return tokens, "stop"
+
+    def _usage(self, request, completion_tokens):
+        prompt_chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+        prompt_tokens = prompt_chars // self.options.chars_per_token
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _completion(self, request):
+        n = 1 if self.options.ignore_n else max(1, int(request.get("n") or 1))
+        tokens, finish_reason = self._reply(request)
+        time.sleep(self.options.first_token_delay + len(tokens) / self.options.token_rate)
+        choices = [{"index": i, "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": finish_reason} for i in range(n)]
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": choices,
+            "usage": self._usage(request, len(tokens) * n),
+        })
+
+    def _stream_completion(self, request):
+        n = 1 if self.options.ignore_n else max(1, int(request.get("n") or 1))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "mock")
+        tokens, finish_reason = self._reply(request)
+
+        def event(choices, usage=None):
+            payload = {"id": completion_id, "object": "chat.completion.chunk",
+                       "created": int(time.time()), "model": model, "choices": choices}
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            time.sleep(self.options.first_token_delay)
+            self._write_chunk(event([{"index": i, "delta": {"role": "assistant", "content": ""},
+                                      "finish_reason": None} for i in range(n)]))
+            interval = 1.0 / self.options.token_rate
+            next_at = time.perf_counter()
+            for token in tokens:
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self._write_chunk(event([{"index": i, "delta": {"content": token},
+                                          "finish_reason": None} for i in range(n)]))
+            self._write_chunk(event([{"index": i, "delta": {}, "finish_reason": finish_reason}
+                                     for i in range(n)]))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._write_chunk(event([], self._usage(request, len(tokens) * n)))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消或对冲落败时会主动断开连接
+            self.close_connection = True
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options=None, verbose=False):
+        super().__init__(address, MockHandler)
+        self.options = options or MockOptions()
+        self.verbose = verbose
+        self.requests = 0
+        self.rejected = 0
+        self.active = 0
+        self._admitted = deque()
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def admit(self):
+        """按每分钟请求数（滑动窗口）与并发数限流；放行时返回None，否则返回建议的 Retry-After 秒数"""
+        options = self.options
+        now = time.monotonic()
+        with self._lock:
+            while self._admitted and self._admitted[0] <= now - 60:
+                self._admitted.popleft()
+            if options.rpm_limit and len(self._admitted) >= options.rpm_limit:
+                self.rejected += 1
+                return max(1, int(self._admitted[0] + 60 - now + 0.999))
+            if options.concurrency_limit and self.active >= options.concurrency_limit:
+                self.rejected += 1
+                return options.retry_after
+            self._admitted.append(now)
+            self.active += 1
+            return None
+
+    def release_slot(self):
+        with self._lock:
+            self.active -= 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_mock_server(host="127.0.0.1", port=0, options=None, verbose=False):
+    """在后台线程启动模拟服务并返回服务对象；port=0 时自动选择空闲端口"""
+    server = MockServer((host, port), options, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_option_arguments(parser):
+    """向命令行解析器添加模拟服务行为参数（供 bench.py 复用）"""
+    parser.add_argument("--token-rate", type=float, default=200.0, help="每秒输出的token数，默认200")
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="首个token前的延迟（秒），默认0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500错误的概率，默认0")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率，默认0")
+    parser.add_argument("--retry-after", type=int, default=1, help="429响应中的Retry-After秒数，默认1")
+    parser.add_argument("--rpm-limit", type=int, default=0, help="每分钟最多接受的请求数，超出返回429，默认不限")
+    parser.add_argument("--concurrency-limit", type=int, default=0, help="最多同时处理的请求数，超出返回429，默认不限")
+    parser.add_argument("--ignore-n", action="store_true", help="忽略请求中的 n 参数，只返回一个候选")
+    parser.add_argument("--output-chars", type=int, default=3000, help="每次生成的字数，默认3000")
+
+
+def options_from_args(args):
+    return MockOptions(
+        token_rate=args.token_rate,
+        first_token_delay=args.first_token_delay,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        rpm_limit=args.rpm_limit,
+        concurrency_limit=args.concurrency_limit,
+        ignore_n=args.ignore_n,
+        output_chars=args.output_chars,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印每个请求")
+    add_option_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockServer((args.host, args.port), options_from_args(args), args.verbose)
+    print(f"模拟服务已启动：{server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
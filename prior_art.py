@@ -0,0 +1,618 @@
+"""本地专利摘要库的现有技术检索
+
+从专利摘要的 JSONL 导出文件（每行一条，含公开号、标题与摘要）建立 BM25 倒排索引，
+生成交底书时按发明名称与创意要点检索最相关的几篇，作为“技术背景与现有技术”的依据。
+
+索引是一个目录，由若干只读的索引段文件和 manifest.json 组成：
+- 每个索引段是一个文件，包含按字节序排列的词典、倒排表（文档号 u32 与词频 u16 两个数组）、
+  文档长度与摘要原文，打开时整体 mmap，查询时只读取用到的词典项与倒排表，冷启动无需加载；
+- 建立索引时逐行读取 JSONL，倒排表累积到 batch_postings 条就写出一个索引段，
+  索引段数超过 max_segments 时把最小的几个流式合并为一个，内存占用与语料大小无关；
+- 每个源文件记录已索引到的字节位置，追加了新记录的文件只读取新增部分（增量追加）；
+  源文件被改写时重建全部索引。
+中文与 search_index 一样按相邻两字切分为二元词，无需分词词典。
+
+用法示例：
+    python prior_art.py build abstracts.jsonl          # 一次性建立索引
+    python prior_art.py update abstracts.jsonl new.jsonl  # 增量追加
+    python prior_art.py query "一种基于卷积网络的图像去噪方法"
+"""
+import argparse
+import array
+import bisect
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from search_index import TOKEN
+
+MAGIC = b"PAIX"
+VERSION = 1
+MANIFEST = "manifest.json"
+SEGMENT_SUFFIX = ".seg"
+# 头部：魔数、版本、词项数、文档数、文档总长度，以及各部分的起始位置
+HEADER = struct.Struct("<4sIIIQ8Q")
+# 词典项：词项在词项区的偏移、倒排表起始序号、文档频率、词项字节数
+DICT_RECORD = struct.Struct("<QQII")
+SECTIONS = ("dict", "terms", "postings", "tfs", "lengths", "offsets", "store")
+ALIGNMENT = 8
+MAX_TF = 0xFFFF
+# 记录中公开号、标题、摘要可用的字段名（取第一个存在的）
+ID_FIELDS = ("id", "publication_number", "pub_no", "pn")
+TITLE_FIELDS = ("title", "name")
+ABSTRACT_FIELDS = ("abstract", "summary", "ab")
+# 判断源文件是否被改写时比较的开头字节数
+HEAD_BYTES = 4096
+# 一批中的词项数上限：词项较多时内存主要花在词典上
+MAX_BATCH_TERMS = 300_000
+# 查询时的候选文档数上限（见 PriorArtIndex.search）
+MAX_ACCUMULATORS = 5000
+# 在倒排表中二分查找一篇候选文档，约相当于顺序扫描多少条倒排记录
+BISECT_COST = 8
+# 一次合并的索引段数
+MERGE_FACTOR = 4
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+
+class PriorArtError(Exception):
+    """索引文件损坏或版本不符"""
+
+
+class PriorArt:
+    """一条检索结果"""
+
+    def __init__(self, id, title, abstract, score):
+        self.id = id
+        self.title = title
+        self.abstract = abstract
+        self.score = score
+
+
+def _native(typecode, buffer):
+    """把小端字节序的缓冲区视为数组；小端机器上不复制"""
+    if sys.byteorder == "little":
+        return memoryview(buffer).cast(typecode)
+    values = array.array(typecode)
+    values.frombytes(bytes(buffer))
+    values.byteswap()
+    return values
+
+
+def _little(values):
+    """数组按小端字节序输出（小端机器上直接写入数组的缓冲区，不复制）"""
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _field(record, names):
+    for name in names:
+        value = record.get(name)
+        if value:
+            return str(value).strip()
+    return ""
+
+
+def _terms(text):
+    """与 search_index.tokenize(text, trailing_unigram=False) 切分结果相同的词项计数（不拼接字符串，建索引时更快）"""
+    counts = Counter()
+    for cjk, word in TOKEN.findall(text):
+        if word:
+            counts[word.lower()] += 1
+        elif len(cjk) == 1:
+            counts[cjk] += 1
+        else:
+            counts.update(map(str.__add__, cjk, cjk[1:]))
+    return counts
+
+
+class _Segment:
+    """只读的索引段，整体 mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._mmap)
+        try:
+            magic, version, self.n_terms, self.n_docs, self.total_length, *offsets = \
+                HEADER.unpack_from(self._mmap)
+            if magic != MAGIC or version != VERSION:
+                raise PriorArtError(f"索引段格式不符：{path}")
+            bounds = dict(zip(SECTIONS, zip(offsets, offsets[1:])))
+            self._dict = view[slice(*bounds["dict"])]
+            self._terms = view[slice(*bounds["terms"])]
+            self.postings = _native("I", view[slice(*bounds["postings"])])
+            self.tfs = _native("H", view[slice(*bounds["tfs"])])
+            self.lengths = _native("I", view[slice(*bounds["lengths"])])
+            self._offsets = _native("Q", view[slice(*bounds["offsets"])])
+            self._store = view[slice(*bounds["store"])]
+        except Exception:
+            self.close()
+            raise
+
+    def _entry(self, i):
+        term_offset, posting_offset, df, length = DICT_RECORD.unpack_from(self._dict, i * DICT_RECORD.size)
+        return bytes(self._terms[term_offset:term_offset + length]), posting_offset, df
+
+    def lookup(self, term):
+        """二分查找词项，返回 (倒排表起始序号, 文档频率)，不存在时返回None"""
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            current, posting_offset, df = self._entry(middle)
+            if current < term:
+                low = middle + 1
+            elif current > term:
+                high = middle
+            else:
+                return posting_offset, df
+        return None
+
+    def iter_terms(self):
+        """按字节序逐个产出 (词项, 倒排表起始序号, 文档频率)"""
+        for i in range(self.n_terms):
+            yield self._entry(i)
+
+    def record(self, doc):
+        return json.loads(bytes(self._store[self._offsets[doc]:self._offsets[doc + 1]]))
+
+    def raw_record(self, doc):
+        return bytes(self._store[self._offsets[doc]:self._offsets[doc + 1]])
+
+    def close(self):
+        # 先释放全部视图，mmap 才能关闭
+        for name in ("_dict", "_terms", "postings", "tfs", "lengths", "_offsets", "_store", "_view"):
+            value = self.__dict__.pop(name, None)
+            if isinstance(value, memoryview):
+                value.release()
+        self._mmap.close()
+
+
+def _tagged_terms(i, segment):
+    """逐个产出 (词项, 索引段序号, 倒排表起始序号, 文档频率)，供多路归并"""
+    for term, offset, df in segment.iter_terms():
+        yield term, i, offset, df
+
+
+class _SegmentWriter:
+    """按词项字节序写入一个索引段
+
+    各部分先写入同目录下的临时文件，最后拼接为一个文件，内存占用与索引段大小无关。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.parts = {name: tempfile.TemporaryFile(dir=directory) for name in SECTIONS}
+        self.n_terms = self.n_postings = self.n_docs = self.total_length = 0
+        self.term_bytes = self.store_bytes = 0
+        self.parts["offsets"].write(struct.pack("<Q", 0))
+
+    def add_document(self, length, raw_record):
+        self.parts["lengths"].write(struct.pack("<I", length))
+        self.parts["store"].write(raw_record)
+        self.store_bytes += len(raw_record)
+        self.parts["offsets"].write(struct.pack("<Q", self.store_bytes))
+        self.n_docs += 1
+        self.total_length += length
+
+    def add_term(self, term, doc_ids, tfs):
+        """doc_ids 须递增；doc_ids 与 tfs 为 array('I') 与 array('H')"""
+        self.parts["dict"].write(DICT_RECORD.pack(self.term_bytes, self.n_postings, len(doc_ids), len(term)))
+        self.parts["terms"].write(term)
+        self.parts["postings"].write(_little(doc_ids))
+        self.parts["tfs"].write(_little(tfs))
+        self.term_bytes += len(term)
+        self.n_postings += len(doc_ids)
+        self.n_terms += 1
+
+    def finish(self, path):
+        """拼接为 path（先写临时文件再重命名），返回 (文档数, 文档总长度)"""
+        offsets = []
+        position = HEADER.size
+        for name in SECTIONS:
+            position += -position % ALIGNMENT
+            offsets.append(position)
+            position += self.parts[name].tell()
+        offsets.append(position)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, VERSION, self.n_terms, self.n_docs, self.total_length, *offsets))
+            for name, offset in zip(SECTIONS, offsets):
+                out.write(b"\0" * (offset - out.tell()))
+                part = self.parts[name]
+                part.seek(0)
+                while True:
+                    block = part.read(1 << 20)
+                    if not block:
+                        break
+                    out.write(block)
+            out.flush()
+            os.fsync(out.fileno())
+        self.close()
+        os.replace(temp_path, path)
+        return self.n_docs, self.total_length
+
+    def close(self):
+        for part in self.parts.values():
+            part.close()
+
+
+class _Batch:
+    """内存中累积的一批文档，倒排表或词项数达到上限时写出为一个索引段"""
+
+    def __init__(self):
+        # 词项 -> array('I')，文档号与词频交替存放，比每个词项两个数组省内存
+        self.postings = {}
+        self.records = []
+        self.count = 0
+
+    def add(self, raw_record, text):
+        doc = len(self.records)
+        counts = _terms(text)
+        postings = self.postings
+        for term, tf in counts.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = array.array("I")
+            entry.extend((doc, min(tf, MAX_TF)))
+        self.records.append((sum(counts.values()), raw_record))
+        self.count += len(counts)
+
+    def full(self, max_postings):
+        return self.count >= max_postings or len(self.postings) >= MAX_BATCH_TERMS
+
+    def write(self, writer):
+        for length, raw_record in self.records:
+            writer.add_document(length, raw_record)
+        # 字符串按码位排序与其 UTF-8 编码按字节排序的结果相同
+        for term in sorted(self.postings):
+            entry = self.postings[term]
+            writer.add_term(term.encode("utf-8"), entry[0::2], array.array("H", entry[1::2]))
+
+
+class PriorArtIndex:
+    """现有技术索引；查询与写入可在多个线程中调用（由同一把锁串行化）
+
+    其他进程更新了索引时（manifest.json 修改时间变化），下次查询会重新打开索引段。
+    """
+
+    def __init__(self, directory, batch_postings=2_000_000, max_segments=8):
+        self.directory = directory
+        self.batch_postings = batch_postings
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._mtime = None
+        self._segments = []
+
+    # ---- manifest 与索引段 ----
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def _empty_manifest(self):
+        return {"version": VERSION, "next_segment": 1, "segments": [], "sources": {}}
+
+    def _refresh(self):
+        """manifest.json 变化时重新打开索引段"""
+        try:
+            mtime = os.path.getmtime(self._manifest_path())
+        except OSError:
+            mtime = None
+        if self._manifest is not None and mtime == self._mtime:
+            return
+        self._close_segments()
+        if mtime is None:
+            self._manifest = self._empty_manifest()
+        else:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                self._manifest = json.load(f)
+            if self._manifest.get("version") != VERSION:
+                raise PriorArtError(f"索引版本不符，请重新建立索引：{self.directory}")
+            self._segments = [_Segment(os.path.join(self.directory, entry["name"]))
+                              for entry in self._manifest["segments"]]
+        self._mtime = mtime
+
+    def _close_segments(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+
+    def _save_manifest(self, manifest):
+        """原子写入 manifest.json 并重新打开索引段，再删除不再引用的索引段文件"""
+        temp_path = self._manifest_path() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self._manifest_path())
+        self._manifest = None
+        self._refresh()
+        self._remove_unused()
+
+    def _remove_unused(self):
+        used = {entry["name"] for entry in self._manifest["segments"]}
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX) and name not in used:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Windows 上其他进程仍映射着该文件，留待下次清理
+                    pass
+
+    def _new_segment_name(self, manifest):
+        name = f"{manifest['next_segment']:06d}{SEGMENT_SUFFIX}"
+        manifest["next_segment"] += 1
+        return name
+
+    def _write_batch(self, manifest, batch):
+        writer = _SegmentWriter(self.directory)
+        try:
+            batch.write(writer)
+            name = self._new_segment_name(manifest)
+            docs, length = writer.finish(os.path.join(self.directory, name))
+        except BaseException:
+            writer.close()
+            raise
+        manifest["segments"].append({"name": name, "docs": docs, "length": length})
+
+    # ---- 写入 ----
+
+    def _read_source(self, manifest, path, start):
+        """从 start 字节处读取源文件的完整行，分批写出索引段，返回 (新增文档数, 读到的位置)"""
+        added = 0
+        position = start
+        batch = _Batch()
+        with open(path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 末行可能仍在写入，留待下次追加
+                    break
+                position += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                title = _field(record, TITLE_FIELDS)
+                abstract = _field(record, ABSTRACT_FIELDS)
+                if not title and not abstract:
+                    continue
+                stored = {"id": _field(record, ID_FIELDS), "title": title, "abstract": abstract}
+                batch.add(json.dumps(stored, ensure_ascii=False).encode("utf-8"), f"{title}\n{abstract}")
+                added += 1
+                if batch.full(self.batch_postings):
+                    self._write_batch(manifest, batch)
+                    batch = _Batch()
+        if batch.records:
+            self._write_batch(manifest, batch)
+        return added, position
+
+    @staticmethod
+    def _head_digest(path, length):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read(min(length, HEAD_BYTES))).hexdigest()
+
+    def build(self, paths):
+        """丢弃已有索引，从 JSONL 文件一次性建立索引，返回文档数"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._refresh()
+            manifest = self._empty_manifest()
+            manifest["next_segment"] = self._manifest["next_segment"]
+            self._append(manifest, [os.path.abspath(path) for path in paths], full=True)
+            return self.count()
+
+    def update(self, paths):
+        """增量追加：新文件整体读取，已索引的文件只读取追加的部分，返回新增文档数
+
+        已索引的文件被改写（变短或开头内容变化）时重建全部索引，返回重建后的文档数。
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._refresh()
+            manifest = json.loads(json.dumps(self._manifest))
+            paths = [os.path.abspath(path) for path in paths]
+            for path in paths:
+                source = manifest["sources"].get(path)
+                if source is None:
+                    continue
+                size = os.path.getsize(path)
+                if size < source["offset"] or self._head_digest(path, source["offset"]) != source["head"]:
+                    return self.build(sorted(set(manifest["sources"]) | set(paths)))
+            return self._append(manifest, paths)
+
+    def _append(self, manifest, paths, full=False):
+        added = 0
+        for path in paths:
+            source = manifest["sources"].get(path, {"offset": 0})
+            count, position = self._read_source(manifest, path, source["offset"])
+            manifest["sources"][path] = {"offset": position, "head": self._head_digest(path, position)}
+            added += count
+        while len(manifest["segments"]) > (1 if full else self.max_segments):
+            self._merge_smallest(manifest, len(manifest["segments"]) if full else MERGE_FACTOR)
+        self._save_manifest(manifest)
+        return added
+
+    def _merge_smallest(self, manifest, count):
+        """把文档数最少的 count 个索引段流式合并为一个"""
+        entries = sorted(manifest["segments"], key=lambda entry: entry["docs"])[:count]
+        segments = [_Segment(os.path.join(self.directory, entry["name"])) for entry in entries]
+        writer = _SegmentWriter(self.directory)
+        try:
+            bases = []
+            for segment in segments:
+                bases.append(writer.n_docs)
+                for doc in range(segment.n_docs):
+                    writer.add_document(segment.lengths[doc], segment.raw_record(doc))
+            streams = [_tagged_terms(i, segment) for i, segment in enumerate(segments)]
+            current, doc_ids, tfs = None, array.array("I"), array.array("H")
+            for term, i, offset, df in heapq.merge(*streams):
+                if term != current:
+                    if current is not None:
+                        writer.add_term(current, doc_ids, tfs)
+                    current, doc_ids, tfs = term, array.array("I"), array.array("H")
+                segment, base = segments[i], bases[i]
+                # 不保留切片的引用，否则索引段关闭时 mmap 仍被占用
+                if base:
+                    doc_ids.extend([doc + base for doc in segment.postings[offset:offset + df]])
+                else:
+                    doc_ids.extend(segment.postings[offset:offset + df])
+                tfs.extend(segment.tfs[offset:offset + df])
+            if current is not None:
+                writer.add_term(current, doc_ids, tfs)
+            name = self._new_segment_name(manifest)
+            docs, length = writer.finish(os.path.join(self.directory, name))
+        except BaseException:
+            writer.close()
+            raise
+        finally:
+            for segment in segments:
+                segment.close()
+        merged = {entry["name"] for entry in entries}
+        manifest["segments"] = [entry for entry in manifest["segments"] if entry["name"] not in merged]
+        manifest["segments"].append({"name": name, "docs": docs, "length": length})
+
+    # ---- 查询 ----
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return sum(entry["docs"] for entry in self._manifest["segments"])
+
+    def search(self, text, limit=5, max_terms=16, max_df_ratio=0.2):
+        """按 BM25 检索与 text 最相关的摘要，返回 PriorArt 列表（得分从高到低）
+
+        出现在超过 max_df_ratio 的文档中的词（“一种”“方法”等）不参与计算，其余词按 IDF 从高到低
+        最多取 max_terms 个逐个累加得分；候选文档达到 MAX_ACCUMULATORS 篇后，后续较常见的词
+        只为已有候选加分（候选较少时在倒排表中二分查找），不再引入新文档，查询耗时有上界。
+        """
+        query = _terms(text)
+        if not query:
+            return []
+        with self._lock:
+            self._refresh()
+            entries = self._manifest["segments"]
+            total_docs = sum(entry["docs"] for entry in entries)
+            if not total_docs:
+                return []
+            average_length = sum(entry["length"] for entry in entries) / total_docs
+            weighted = []
+            for term, query_tf in query.items():
+                encoded = term.encode("utf-8")
+                found = [(segment, segment.lookup(encoded)) for segment in self._segments]
+                found = [(segment, location) for segment, location in found if location]
+                df = sum(location[1] for _, location in found)
+                if not df or df > max(1, max_df_ratio * total_docs):
+                    continue
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                weighted.append((idf, query_tf, found))
+            weighted = heapq.nlargest(max_terms, weighted, key=lambda item: item[0])
+            # 每个索引段的候选文档 -> 得分
+            scores = {segment: {} for segment in self._segments}
+            candidates = 0
+            # BM25 分母中与词频无关的部分：K1 * (1 - B + B * 文档长度 / 平均长度)
+            norm = K1 * (1 - B)
+            scale = K1 * B / average_length
+            for idf, query_tf, found in weighted:
+                weight = idf * query_tf * (K1 + 1)
+                for segment, (offset, df) in found:
+                    lengths = segment.lengths
+                    postings = segment.postings[offset:offset + df]
+                    tfs = segment.tfs[offset:offset + df]
+                    accumulators = scores[segment]
+                    if candidates < MAX_ACCUMULATORS:
+                        before = len(accumulators)
+                        get = accumulators.get
+                        # 先转为列表再遍历，比逐个读取 memoryview 快
+                        for doc, tf in zip(postings.tolist(), tfs.tolist()):
+                            accumulators[doc] = get(doc, 0.0) + weight * tf / (tf + norm + scale * lengths[doc])
+                        candidates += len(accumulators) - before
+                    elif len(accumulators) * BISECT_COST < df:
+                        for doc in accumulators:
+                            i = bisect.bisect_left(postings, doc)
+                            if i < df and postings[i] == doc:
+                                tf = tfs[i]
+                                accumulators[doc] += weight * tf / (tf + norm + scale * lengths[doc])
+                    else:
+                        for doc, tf in zip(postings.tolist(), tfs.tolist()):
+                            if doc in accumulators:
+                                accumulators[doc] += weight * tf / (tf + norm + scale * lengths[doc])
+            best = heapq.nlargest(limit, ((score, segment, doc) for segment, accumulators in scores.items()
+                                          for doc, score in accumulators.items()), key=lambda item: item[0])
+            results = []
+            for score, segment, doc in best:
+                record = segment.record(doc)
+                results.append(PriorArt(record["id"], record["title"], record["abstract"], round(score, 3)))
+            return results
+
+    def close(self):
+        with self._lock:
+            self._close_segments()
+            self._manifest = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory, **options):
+    """返回指定目录的索引对象（同一目录复用同一个对象）"""
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = PriorArtIndex(directory, **options)
+        return _indexes[directory]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="专利摘要库的现有技术检索")
+    parser.add_argument("--index", help="索引目录，默认使用 config.json 中的 prior_art.index_dir")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="从 JSONL 文件一次性建立索引（丢弃已有索引）")
+    build.add_argument("paths", nargs="+")
+    update = commands.add_parser("update", help="增量追加 JSONL 文件中的新记录")
+    update.add_argument("paths", nargs="+")
+    query = commands.add_parser("query", help="检索与发明名称、创意要点相关的摘要")
+    query.add_argument("query")
+    query.add_argument("-n", "--limit", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.index:
+        index = get_index(args.index)
+    else:
+        import ai
+        index = ai.get_prior_art_index()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        count = index.build(args.paths)
+        print(f"已建立索引，共{count}篇，用时{time.perf_counter() - start:.2f}秒")
+    elif args.command == "update":
+        added = index.update(args.paths)
+        print(f"新增{added}篇，共{index.count()}篇，用时{time.perf_counter() - start:.2f}秒")
+    else:
+        results = index.search(args.query, args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for result in results:
+            print(f"[{result.score}] {result.id} {result.title}\n  {result.abstract[:120]}")
+        print(f"共{len(results)}条结果（{elapsed:.1f}毫秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""生成流程的分阶段性能剖析
+
+以 --profile 启动界面、批量入口或基准测试时启用。每个任务结束后在剖析目录（默认 profiles/）中写出：
+- <任务>.stages.json：各阶段（提示词构造、客户端创建、限流等待、建立连接、接收与解码、校验、保存、
+  索引、界面信号等）的调用次数、墙钟时间、CPU时间与 tracemalloc 统计的内存净分配；
+  阶段可以嵌套，时间均包含内层阶段。墙钟时间明显大于CPU时间的阶段主要在等待网络或锁。
+- <任务>.collapsed：采样线程按固定间隔记录的任务各线程调用栈，折叠栈格式（"帧;帧;帧 次数"），
+  最外层为所在阶段，可直接交给 flamegraph.pl、speedscope、inferno 等工具绘制火焰图；
+- <任务>.pstats：任务各线程的 cProfile 统计，可用 pstats 或 snakeviz 查看。
+
+任务所在线程与经 bind() 包装后在其他线程中执行的函数都计入该任务。
+未启用时 stage()、bind()、timed_iter() 与 staged() 装饰的函数只做一次全局判断，几乎没有额外开销。
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_DIR = "profiles"
+# 采样间隔（秒）
+SAMPLE_INTERVAL = 0.005
+# 单个调用栈最多记录的帧数
+MAX_STACK_DEPTH = 128
+# stages.json 中列出的内存分配最多的代码行数
+TOP_ALLOCATIONS = 15
+
+_enabled = False
+_settings = {}
+_threads = {}  # 线程编号 -> _ThreadState
+_local = threading.local()
+_lock = threading.Lock()
+_NULL = contextlib.nullcontext()
+
+
+class _ThreadState:
+    """某个线程当前所属的任务与所在阶段"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.stages = []
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.alloc = 0
+
+    def to_dict(self):
+        return {"calls": self.calls, "wall": round(self.wall, 6), "cpu": round(self.cpu, 6),
+                "alloc_kb": round(self.alloc / 1024, 1)}
+
+
+class JobProfile:
+    """一个任务的剖析数据"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.total = None
+        self.stages = {}
+        self.stacks = {}
+        self.samples = 0
+        self.profilers = []
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, wall, cpu, alloc):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.alloc += alloc
+
+    def add_sample(self, stack):
+        with self._lock:
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def add_profiler(self, profiler):
+        with self._lock:
+            if not self.finished:
+                self.profilers.append(profiler)
+
+    def report(self):
+        with self._lock:
+            stages = {name: stats.to_dict()
+                      for name, stats in sorted(self.stages.items(), key=lambda item: -item[1].wall)}
+        return {
+            "event": "profile",
+            "job": self.name,
+            "total": round(self.total if self.total is not None else time.perf_counter() - self.started_at, 6),
+            "stages": stages,
+            "samples": self.samples,
+            "sample_interval": _settings.get("interval"),
+        }
+
+    def write(self, output_dir):
+        """写出 stages.json、collapsed 与 pstats 文件，返回文件名前缀"""
+        with self._lock:
+            self.finished = True
+            profilers = list(self.profilers)
+            stacks = dict(self.stacks)
+        os.makedirs(output_dir, exist_ok=True)
+        safe_name = re.sub(r'[\\/:*?"<>|\s]+', "_", self.name)[:60]
+        prefix = os.path.join(output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{id(self) & 0xffff:04x}")
+
+        report = self.report()
+        if tracemalloc.is_tracing():
+            report["memory_peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+            report["memory_top"] = [
+                {"where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]]
+        with open(prefix + ".stages.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        with open(prefix + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        if profilers:
+            stats = pstats.Stats(profilers[0])
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            stats.dump_stats(prefix + ".pstats")
+        return prefix
+
+
+def enable(output_dir=DEFAULT_DIR, interval=SAMPLE_INTERVAL, memory=True, cprofile=True):
+    """启用剖析；memory 控制 tracemalloc，cprofile 控制是否附加 cProfile 统计"""
+    global _enabled
+    with _lock:
+        if _enabled:
+            return
+        _settings.update(output_dir=output_dir, interval=interval, cprofile=cprofile)
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _enabled = True
+    threading.Thread(target=_sample_loop, name="profiling-sampler", daemon=True).start()
+    logging.info(f"已启用性能剖析，结果写入 {os.path.abspath(output_dir)}")
+
+
+def is_enabled():
+    return _enabled
+
+
+def current():
+    """当前线程所属任务的 JobProfile，未启用或不在任务中时返回None"""
+    state = getattr(_local, "state", None)
+    return state.profile if state is not None else None
+
+
+def _start_cprofile(profile):
+    if not _settings.get("cprofile"):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 部分Python版本同一时刻只允许一个剖析器，已被其他线程占用时跳过
+        return None
+    return profiler
+
+
+def _stop_cprofile(profile, profiler):
+    if profiler is not None:
+        profiler.disable()
+        profile.add_profiler(profiler)
+
+
+@contextlib.contextmanager
+def _attach(profile):
+    """在 with 块内把当前线程计入 profile"""
+    previous = getattr(_local, "state", None)
+    state = _local.state = _ThreadState(profile)
+    thread_id = threading.get_ident()
+    with _lock:
+        _threads[thread_id] = state
+    profiler = _start_cprofile(profile)
+    try:
+        yield
+    finally:
+        _stop_cprofile(profile, profiler)
+        _local.state = previous
+        with _lock:
+            if previous is not None:
+                _threads[thread_id] = previous
+            else:
+                _threads.pop(thread_id, None)
+
+
+@contextlib.contextmanager
+def job(name):
+    """剖析一个任务；结束时写出结果文件。未启用时产出None"""
+    if not _enabled:
+        yield None
+        return
+    profile = JobProfile(name)
+    try:
+        with _attach(profile):
+            yield profile
+    finally:
+        profile.total = time.perf_counter() - profile.started_at
+        try:
+            prefix = profile.write(_settings["output_dir"])
+            logging.info(f"[{name}] 剖析结果：{prefix}.*")
+        except OSError as e:
+            logging.warning(f"剖析结果写入失败: {e}")
+
+
+def bind(func):
+    """包装将在其他线程中执行的函数，使其计入当前任务；未启用或不在任务中时原样返回"""
+    profile = current() if _enabled else None
+    if profile is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with _attach(profile):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class _Stage:
+    __slots__ = ("name", "profile", "state", "start", "cpu", "memory")
+
+    def __init__(self, name, profile):
+        self.name = name
+        self.profile = profile
+        self.state = None
+
+    def __enter__(self):
+        if self.profile is None:
+            self.state = getattr(_local, "state", None)
+            if self.state is None:
+                return self
+            self.profile = self.state.profile
+            self.state.stages.append(self.name)
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is None:
+            return False
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        if self.state is not None:
+            self.state.stages.pop()
+        self.profile.add_stage(self.name, wall, cpu, memory - self.memory)
+        return False
+
+
+def stage(name, profile=None):
+    """统计一个阶段的耗时与内存分配
+
+    默认计入当前线程所属的任务；profile 不为None时计入指定任务（如在界面线程中处理某任务的信号）。
+    未启用时返回空的上下文管理器。
+    """
+    if not _enabled:
+        return _NULL
+    return _Stage(name, profile)
+
+
+def staged(name):
+    """装饰器：函数的每次调用计为一次阶段"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_iter(iterable, name):
+    """逐项计时的迭代：每次取下一项（如等待并解析下一个流式数据块）计为一次阶段；未启用时原样返回"""
+    if not _enabled:
+        return iterable
+    return _timed_iter(iter(iterable), name)
+
+
+def _timed_iter(iterator, name):
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample_loop():
+    interval = _settings["interval"]
+    own_id = threading.get_ident()
+    while True:
+        time.sleep(interval)
+        with _lock:
+            states = list(_threads.items())
+        if not states:
+            continue
+        frames = sys._current_frames()
+        for thread_id, state in states:
+            frame = frames.get(thread_id)
+            if frame is None or thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                # 略去本模块的包装函数，火焰图中只保留被剖析的代码
+                if frame.f_code.co_filename != __file__:
+                    labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.reverse()
+            stages = [f"[{name}]" for name in list(state.stages)] or ["[other]"]
+            state.profile.add_sample(";".join(stages + labels))
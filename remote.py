@@ -0,0 +1,244 @@
+"""连接团队共用生成服务（见 server.py）的瘦客户端
+
+config.json 中 remote.url 不为空时，界面的生成任务改为请求该服务，由服务端统一调用模型接口
+（共用响应缓存、限流与并发上限），本机无需配置模型密钥。这里的函数与 ai 模块中的同名函数
+参数与行为一致，调用方按 enabled() 选择其一即可。
+
+服务繁忙（HTTP 503）时按 Retry-After 等待后重试，最多 rate_limit.max_retries 次。
+"""
+import http.client
+import json
+import logging
+import os
+import socket
+import time
+from urllib.parse import urlsplit
+
+import ai
+
+GENERATE_PATH = "/v1/generate"
+
+
+class RemoteError(Exception):
+    """生成服务返回错误或连接中断"""
+
+
+class ServerBusy(RemoteError):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def enabled():
+    """是否配置为连接生成服务"""
+    return bool(ai.ConfigLoader().config['remote']['url'])
+
+
+def _connect():
+    settings = ai.ConfigLoader().config
+    url = urlsplit(settings['remote']['url'])
+    connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    conn = connection_class(url.hostname, url.port, timeout=settings['http']['timeout'])
+    return conn, url.path.rstrip("/")
+
+
+class _Closer:
+    """关闭连接的回调：先 shutdown 套接字，使其他线程中阻塞的读取立即返回
+
+    响应为 Connection: close 时 http.client 会把套接字交给响应对象并清空 conn.sock，
+    因此发出请求后需要另行保存套接字。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.sock = None
+
+    def __call__(self):
+        sock = self.sock or self.conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.conn.close()
+
+
+def _open_events(payload, cancel=None):
+    """提交生成请求，返回 (响应, 关闭连接的回调)；服务繁忙时抛出 ServerBusy"""
+    conn, base_path = _connect()
+    close = _Closer(conn)
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    api_key = ai.ConfigLoader().config['remote']['api_key']
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    if cancel is not None:
+        # 取消时关闭连接：阻塞中的读取立即结束，服务端随之取消任务
+        cancel.register(close)
+    try:
+        conn.request("POST", base_path + GENERATE_PATH, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                     headers)
+        close.sock = conn.sock
+        response = conn.getresponse()
+        if response.status == 200:
+            return response, close
+        try:
+            message = json.loads(response.read() or b"{}").get("error", "")
+        except ValueError:
+            message = ""
+    except BaseException:
+        _release(cancel, close)
+        raise
+    _release(cancel, close)
+    message = message or f"HTTP {response.status}"
+    if response.status == 503:
+        retry_after = response.getheader("Retry-After") or "0"
+        raise ServerBusy(message, float(retry_after) if retry_after.isdigit() else 0.0)
+    raise RemoteError(f"生成服务返回错误：{message}")
+
+
+def _release(cancel, close):
+    if cancel is not None:
+        cancel.unregister(close)
+    close()
+
+
+def _iter_events(response):
+    """解析 Server-Sent Events，逐个产出 (事件名, 数据)"""
+    event, data = "message", []
+    for raw in response:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+
+
+def _request_events(payload, cancel=None):
+    """请求生成并逐个产出事件；服务繁忙时退避重试，cancel 被触发时结束产出"""
+    max_retries = ai.ConfigLoader().config['rate_limit']['max_retries']
+    retry = 0
+    while True:
+        if cancel is not None and cancel.cancelled:
+            return
+        try:
+            response, close = _open_events(payload, cancel)
+            break
+        except ServerBusy as e:
+            if retry >= max_retries:
+                raise RemoteError(f"生成服务繁忙：{e}")
+            retry += 1
+            delay = max(e.retry_after, ai.backoff_delay(retry))
+            logging.warning(f"[{payload['title']}] 生成服务繁忙，{delay:.1f}秒后第{retry}次重试")
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+        except OSError:
+            if cancel is not None and cancel.cancelled:
+                return
+            raise
+    try:
+        for event, data in _iter_events(response):
+            if event == "error":
+                raise RemoteError(data.get("message") or "生成服务返回错误")
+            yield event, data
+            if event == "done":
+                return
+    except (OSError, http.client.HTTPException, AttributeError, ValueError):
+        # 取消时连接被关闭，读取会以各种方式失败
+        if cancel is not None and cancel.cancelled:
+            return
+        raise RemoteError("与生成服务的连接中断")
+    finally:
+        _release(cancel, close)
+    if cancel is None or not cancel.cancelled:
+        raise RemoteError("与生成服务的连接中断")
+
+
+def stream_patent_document(title, ideas, out_path=None, stats=None, use_cache=True, cancel=None, resume=False):
+    """通过生成服务流式生成专利交底书，逐块产出文本（与 ai.stream_patent_document 一致）
+
+    服务端看不到本机的部分文件，resume 为True时也会重新生成全文并覆盖部分文件。
+    服务端修复过流程图或公式时，修复后的全文覆盖写入文件，已产出的文本块仍为模型的原始输出。
+    """
+    if stats is None:
+        stats = ai.StreamStats()
+    part_path = out_path + ai.PARTIAL_SUFFIX if out_path else None
+    payload = {"title": title, "ideas": ideas, "mode": "stream", "use_cache": use_cache}
+    f = open(part_path, "w", encoding="utf-8") if part_path else None
+    try:
+        for event, data in _request_events(payload, cancel):
+            if event == "delta":
+                delta = data["text"]
+                if stats.first_token_at is None:
+                    stats.first_token_at = time.perf_counter()
+                stats.chars += len(delta)
+                stats.bytes += len(delta.encode("utf-8"))
+                if f:
+                    write_start = time.perf_counter()
+                    f.write(delta)
+                    f.flush()
+                    stats.write_time += time.perf_counter() - write_start
+                yield delta
+            elif event == "done":
+                if f and "content" in data:
+                    write_start = time.perf_counter()
+                    f.seek(0)
+                    f.truncate()
+                    f.write(data["content"])
+                    stats.write_time += time.perf_counter() - write_start
+                stats.completed = True
+    finally:
+        stats.finished_at = time.perf_counter()
+        if f:
+            f.close()
+            if stats.completed:
+                os.replace(part_path, out_path)
+
+
+def generate_patent_document_parallel(title, ideas, use_cache=True, max_workers=None, on_section=None,
+                                      cancel=None):
+    """通过生成服务分章节并发生成专利交底书（与 ai.generate_patent_document_parallel 一致）
+
+    章节并发数由服务端决定，max_workers 仅为保持参数一致而保留。
+    """
+    payload = {"title": title, "ideas": ideas, "mode": "parallel", "use_cache": use_cache}
+    for event, data in _request_events(payload, cancel):
+        if event == "section" and on_section is not None:
+            on_section(data["number"], data["text"])
+        elif event == "done":
+            return data["content"]
+    raise ai.GenerationCancelled()
+
+
+def generate_patent_candidates(title, ideas, n=None, use_cache=True, cancel=None, stats=None, on_delta=None):
+    """通过生成服务一次请求多份候选稿（与 ai.generate_patent_candidates 一致）
+
+    服务端已按得分排序，本地重新评分只是为了得到 scoring.CandidateScore（离线计算，开销很小）。
+    """
+    if stats is None:
+        stats = ai.StreamStats()
+    payload = {"title": title, "ideas": ideas, "mode": "candidates", "use_cache": use_cache,
+               "candidates": n or ai.ConfigLoader().config['generation_params']['candidates']}
+    try:
+        for event, data in _request_events(payload, cancel):
+            if event == "delta":
+                if stats.first_token_at is None:
+                    stats.first_token_at = time.perf_counter()
+                stats.chars += len(data["text"])
+                stats.bytes += len(data["text"].encode("utf-8"))
+                if on_delta is not None:
+                    on_delta(data["text"])
+            elif event == "done":
+                stats.completed = True
+                texts = [data["content"]] + data.get("alternates", [])
+                return [ai.Candidate(index, text, ai.score_document(text)) for index, text in enumerate(texts)]
+    finally:
+        stats.finished_at = time.perf_counter()
+    raise ai.GenerationCancelled()
@@ -0,0 +1,128 @@
+"""候选交底书的离线评分
+
+同一请求生成多份候选稿时，按提示词中的硬性要求逐项检查，选出最好的一份。
+只做本地的文本统计，不调用模型：
+- 各章节是否齐全；
+- 指定章节（技术方案）的正文字数是否达到要求，不计代码块、标题与空白；
+- 要求流程图的章节中语法正确的 Mermaid 流程图节点数是否达标；
+- 指定章节（技术优势对比）的 Markdown 表格数据行数是否达标。
+每项得分为 0~1 的达标比例，总分为各类检查平均得分的加权和；
+总分相同时公式问题少的优先，再相同时正文较长的优先。
+"""
+import re
+
+import validation
+
+TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+HEADING_LINE = re.compile(r"^\s*#+.*$", re.M)
+WHITESPACE = re.compile(r"\s+")
+# 各类检查的权重：缺章节最严重，其次是篇幅与流程图
+WEIGHTS = {"sections": 3.0, "length": 2.0, "flowchart": 2.0, "table": 1.0}
+LABELS = {"sections": "章节", "length": "正文字数", "flowchart": "流程图节点数", "table": "表格数据行数"}
+
+
+class Check:
+    """一项检查：value 为实际值，required 为要求值"""
+
+    def __init__(self, kind, section, value, required):
+        self.kind = kind
+        self.section = section
+        self.value = value
+        self.required = required
+
+    @property
+    def ratio(self):
+        return min(1.0, self.value / self.required) if self.required else 1.0
+
+    @property
+    def passed(self):
+        return self.value >= self.required
+
+    def __repr__(self):
+        return f"第{self.section}部分{LABELS[self.kind]}：{self.value}/{self.required}"
+
+
+class CandidateScore:
+    """一份候选稿的评分结果"""
+
+    def __init__(self, checks, latex_issues, chars):
+        self.checks = checks
+        self.latex_issues = latex_issues
+        self.chars = chars
+
+    @property
+    def score(self):
+        total = 0.0
+        for kind, weight in WEIGHTS.items():
+            ratios = [check.ratio for check in self.checks if check.kind == kind]
+            if ratios:
+                total += weight * sum(ratios) / len(ratios)
+        return round(total, 4)
+
+    @property
+    def max_score(self):
+        return sum(weight for kind, weight in WEIGHTS.items() if any(c.kind == kind for c in self.checks))
+
+    @property
+    def failed(self):
+        return [check for check in self.checks if not check.passed]
+
+    def sort_key(self):
+        """排序键：越大越好"""
+        return self.score, -self.latex_issues, self.chars
+
+    def to_dict(self):
+        return {
+            "score": self.score,
+            "max_score": self.max_score,
+            "failed": [repr(check) for check in self.failed],
+            "latex_issues": self.latex_issues,
+            "chars": self.chars,
+        }
+
+
+def count_chars(text):
+    """正文字数：去掉代码块、标题行与空白后的字符数"""
+    text = HEADING_LINE.sub("", validation.FENCED_BLOCK.sub("", text))
+    return len(WHITESPACE.sub("", text))
+
+
+def table_rows(text):
+    """文本中各 Markdown 表格数据行数的最大值（不计表头与分隔行）"""
+    best = 0
+    run = []
+    for line in text.splitlines() + [""]:
+        if TABLE_ROW.match(line):
+            run.append(line)
+            continue
+        if len(run) >= 2 and TABLE_SEPARATOR.match(run[1]):
+            best = max(best, len(run) - 2)
+        run = []
+    return best
+
+
+def flowchart_nodes(text):
+    """文本中语法正确的流程图节点数的最大值；没有合格的流程图时为0"""
+    best = 0
+    for match in validation.MERMAID_BLOCK.finditer(text):
+        problems, node_count = validation.check_mermaid(match.group(1))
+        if not problems:
+            best = max(best, node_count)
+    return best
+
+
+def score_document(text, sections, expected, min_chars=None, min_nodes=None, min_table_rows=None):
+    """为一份交底书评分，返回 CandidateScore
+
+    sections 为 {章节序号: 章节全文}（缺失的章节不在其中），expected 为应有的章节序号；
+    min_chars、min_nodes、min_table_rows 为 {章节序号: 要求值}。
+    """
+    checks = [Check("sections", number, 1 if number in sections else 0, 1) for number in expected]
+    for number, required in (min_chars or {}).items():
+        checks.append(Check("length", number, count_chars(sections.get(number, "")), required))
+    for number, required in (min_nodes or {}).items():
+        checks.append(Check("flowchart", number, flowchart_nodes(sections.get(number, "")), required))
+    for number, required in (min_table_rows or {}).items():
+        checks.append(Check("table", number, table_rows(sections.get(number, "")), required))
+    return CandidateScore(checks, len(validation.find_latex_issues(text)), count_chars(text))
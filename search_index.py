@@ -0,0 +1,314 @@
+"""已生成交底书的本地全文索引
+
+基于SQLite FTS5。中文按相邻两字切分为二元词（每段连续汉字的末字另作单字词），
+英文与数字按单词切分，因此“特征提取”“卷积”这类词无需分词词典即可检索。
+索引只保存倒排表，不保存正文；文件按 mtime 与大小增量更新，修改或删除的文件留下的
+旧索引行在比例过高时整体重建。
+
+用法示例：
+    python search_index.py update output/        # 增量索引目录中的交底书
+    python search_index.py query "特征提取 卷积"  # 多个词之间为“且”的关系
+"""
+import argparse
+import contextlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+DOCUMENT_SUFFIX = "_专利交底书"
+TOKEN = re.compile(r"([\u3400-\u9fff\uf900-\ufaff]+)|([A-Za-z0-9_]+)")
+# 孤立的旧索引行超过该比例时重建全部索引
+REBUILD_RATIO = 0.2
+# 命中文档很多时只对最新的这么多篇计算BM25，保证常见词的查询耗时有上界
+RANK_WINDOW = 500
+# 一次增量更新的文档数达到该值时合并索引段
+OPTIMIZE_THRESHOLD = 1000
+SNIPPET_CHARS = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title, body, content='', tokenize='unicode61 remove_diacritics 0'
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def tokenize(text, trailing_unigram=True):
+    """将文本切分为以空格分隔的索引词
+
+    连续汉字切为二元词；trailing_unigram 为True时每段末字另作单字词，
+    使单字查询与跨中英文边界的短语查询也能命中。
+    """
+    tokens = []
+    for cjk, word in TOKEN.findall(text):
+        if word:
+            tokens.append(word.lower())
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            if trailing_unigram:
+                tokens.append(cjk[-1])
+    return " ".join(tokens)
+
+
+def build_query(query):
+    """将查询串转换为FTS5表达式
+
+    空白或“+”分隔的每个词再按汉字/英文数字拆段：多字汉字段为二元词短语，单个汉字匹配
+    以该字开头的二元词或段末单字，英文数字段为单词；所有段之间取交集。
+    """
+    parts = []
+    for cjk, word in TOKEN.findall(query):
+        if word:
+            parts.append(f'"{word.lower()}"')
+        elif len(cjk) == 1:
+            parts.append(f"{cjk}*")
+        else:
+            parts.append(f'"{tokenize(cjk, trailing_unigram=False)}"')
+    return " AND ".join(parts)
+
+
+def is_document(name):
+    return name.endswith(".md") and DOCUMENT_SUFFIX in name
+
+
+def read_title(text, path):
+    """取文档首个一级标题作为标题，没有时使用文件名"""
+    match = re.search(r"^#\s+(.+?)\s*(专利交底书)?\s*$", text, re.M)
+    return match.group(1) if match else os.path.splitext(os.path.basename(path))[0]
+
+
+class SearchHit:
+    """一条检索结果"""
+
+    def __init__(self, path, title, score, snippet=""):
+        self.path = path
+        self.title = title
+        self.score = score
+        self.snippet = snippet
+
+
+class DocumentIndex:
+    """交底书全文索引；每次操作使用独立连接，可在多个线程中同时调用"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            migrate = self._needs_autoincrement(conn)
+            if migrate:
+                conn.execute("ALTER TABLE documents RENAME TO documents_old")
+            conn.executescript(SCHEMA)
+            if migrate:
+                conn.execute("INSERT INTO documents SELECT * FROM documents_old")
+                conn.execute("DROP TABLE documents_old")
+        if migrate:
+            # 旧索引中可能已有复用 rowid 留下的过期词项，整体重建一次
+            self.rebuild()
+
+    @staticmethod
+    def _needs_autoincrement(conn):
+        """旧版本建立的 documents 表没有 AUTOINCREMENT，删除最新一行后其 rowid 会被复用，
+        而无内容的 FTS 表中该 rowid 的旧词项仍在，需要迁移"""
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'documents'").fetchone()
+        return row is not None and "AUTOINCREMENT" not in row[0].upper()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """打开连接，正常结束时提交，异常时回滚，最后关闭"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _bump_orphans(self, conn, count):
+        conn.execute("INSERT INTO meta(key, value) VALUES('orphans', ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value", (count,))
+
+    def _index(self, conn, path, stat):
+        """(重新)索引单个文件；旧的索引行只从 documents 中移除，FTS中的旧行记为孤立行"""
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        title = read_title(text, path)
+        if conn.execute("DELETE FROM documents WHERE path = ?", (path,)).rowcount:
+            self._bump_orphans(conn, 1)
+        cursor = conn.execute("INSERT INTO documents(path, title, mtime, size) VALUES(?, ?, ?, ?)",
+                              (path, title, stat.st_mtime, stat.st_size))
+        conn.execute("INSERT INTO documents_fts(rowid, title, body) VALUES(?, ?, ?)",
+                     (cursor.lastrowid, tokenize(title), tokenize(text)))
+
+    def add(self, path):
+        """索引（或重新索引）一个文件，生成或改写文档后调用"""
+        path = os.path.abspath(path)
+        with self._write_lock, self._connect() as conn:
+            self._index(conn, path, os.stat(path))
+        self._maybe_rebuild()
+
+    def update(self, directory):
+        """按 mtime 与大小增量更新目录中的交底书，返回 (新增或更新数, 删除数)"""
+        directory = os.path.abspath(directory)
+        current = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and is_document(entry.name):
+                    current[os.path.join(directory, entry.name)] = entry.stat()
+
+        changed = removed = 0
+        with self._write_lock, self._connect() as conn:
+            known = {path: (mtime, size) for path, mtime, size in conn.execute(
+                "SELECT path, mtime, size FROM documents WHERE path LIKE ? ESCAPE '\\'",
+                (_like_prefix(directory),))
+                if os.path.dirname(path) == directory}
+            for path in known.keys() - current.keys():
+                conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+                removed += 1
+            self._bump_orphans(conn, removed)
+            for path, stat in current.items():
+                if known.get(path) != (stat.st_mtime, stat.st_size):
+                    try:
+                        self._index(conn, path, stat)
+                        changed += 1
+                    except OSError:
+                        continue
+            if changed >= OPTIMIZE_THRESHOLD:
+                conn.execute("INSERT INTO documents_fts(documents_fts) VALUES('optimize')")
+        self._maybe_rebuild()
+        return changed, removed
+
+    def _maybe_rebuild(self):
+        with self._connect() as conn:
+            documents = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            row = conn.execute("SELECT value FROM meta WHERE key = 'orphans'").fetchone()
+        orphans = row[0] if row else 0
+        if orphans and orphans > REBUILD_RATIO * max(documents, 1):
+            self.rebuild()
+
+    def rebuild(self):
+        """清空倒排表并重新索引所有已登记的文件（不存在的文件一并移除）"""
+        with self._write_lock, self._connect() as conn:
+            paths = [path for (path,) in conn.execute("SELECT path FROM documents")]
+            conn.execute("DELETE FROM documents")
+            conn.execute("INSERT INTO documents_fts(documents_fts) VALUES('delete-all')")
+            conn.execute("DELETE FROM meta WHERE key = 'orphans'")
+            for path in paths:
+                try:
+                    self._index(conn, path, os.stat(path))
+                except OSError:
+                    continue
+            conn.execute("INSERT INTO documents_fts(documents_fts) VALUES('optimize')")
+
+    def search(self, query, limit=20, snippets=True):
+        """检索交底书，按BM25相关度排序；snippets为True时从文件中截取命中位置附近的文字
+
+        命中超过 RANK_WINDOW 篇时只在最近索引的 RANK_WINDOW 篇中排序。
+        """
+        expression = build_query(query)
+        if not expression:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT d.path, d.title, bm25(documents_fts, 5.0, 1.0) AS score "
+                "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+                "WHERE documents_fts MATCH :query AND documents_fts.rowid >= coalesce(("
+                "    SELECT rowid FROM documents_fts WHERE documents_fts MATCH :query"
+                "    ORDER BY rowid DESC LIMIT 1 OFFSET :window), 0) "
+                "ORDER BY score LIMIT :limit",
+                {"query": expression, "window": RANK_WINDOW - 1, "limit": limit}).fetchall()
+        hits = [SearchHit(path, title, score) for path, title, score in rows]
+        if snippets:
+            terms = [cjk or word for cjk, word in TOKEN.findall(query)]
+            for hit in hits:
+                hit.snippet = _snippet(hit.path, terms)
+        return hits
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+
+def _like_prefix(directory):
+    escaped = directory.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def _snippet(path, terms):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    except OSError:
+        return ""
+    lowered = text.lower()
+    for term in terms:
+        pos = lowered.find(term.lower())
+        if pos >= 0:
+            start = max(0, pos - SNIPPET_CHARS)
+            return text[start:pos + len(term) + SNIPPET_CHARS].replace("\n", " ").strip()
+    return ""
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(db_path):
+    """返回指定路径的索引对象（同一路径复用同一个对象）"""
+    db_path = os.path.abspath(db_path)
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = DocumentIndex(db_path)
+        return _indexes[db_path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="交底书全文索引")
+    parser.add_argument("--index", help="索引文件路径，默认使用 config.json 中的 search.index_path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="增量索引目录中的交底书")
+    update.add_argument("directories", nargs="+")
+    query = commands.add_parser("query", help="检索，多个词之间为“且”的关系")
+    query.add_argument("query")
+    query.add_argument("-n", "--limit", type=int, default=20)
+    commands.add_parser("rebuild", help="重建全部索引")
+    args = parser.parse_args(argv)
+
+    if args.index:
+        index = get_index(args.index)
+    else:
+        import ai
+        index = ai.get_search_index()
+
+    if args.command == "update":
+        for directory in args.directories:
+            start = time.perf_counter()
+            changed, removed = index.update(directory)
+            print(f"{directory}：更新{changed}个，移除{removed}个，用时{time.perf_counter() - start:.2f}秒")
+    elif args.command == "rebuild":
+        index.rebuild()
+        print(f"已重建，共{index.count()}个文档")
+    else:
+        start = time.perf_counter()
+        hits = index.search(args.query, args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for hit in hits:
+            print(f"{hit.title}\n  {hit.path}\n  {hit.snippet}")
+        print(f"共{len(hits)}条结果（{elapsed:.1f}毫秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
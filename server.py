@@ -0,0 +1,467 @@
+"""团队共用的交底书生成服务
+
+以 asyncio 为核心的HTTP服务。多个用户通过它生成交底书时共用同一份响应缓存、
+客户端限流（见 ai.RateLimiter）与并发上限，各自的电脑上无需配置模型密钥（见 remote.py）。
+
+接口：
+- POST /v1/generate：请求体为 {"title", "ideas", "mode": "stream"、"parallel" 或 "candidates",
+  "candidates": 候选稿数, "use_cache": true}，以 Server-Sent Events 返回事件 queued（排队位置）、started、
+  delta（文本块，多候选时各候选交替）或 section（章节）、done（结束，服务端修复过格式、分章节或多候选生成时
+  附带完整正文，多候选时另附其余候选 alternates）与 error；
+- GET /health：运行状态、队列长度与各端点的限流状态（JSON）；
+- GET /metrics：Prometheus文本格式的指标（含队列长度与工作线程数）。
+
+生成在有界线程池中执行，等待执行的请求超过 server.queue_size 时立即返回 503 与 Retry-After，
+而不是无限堆积；客户端断开连接时取消对应的任务。配置了 server.api_keys 时，
+生成接口要求请求头 "Authorization: Bearer <key>"。
+
+用法示例：
+    python server.py --host 0.0.0.0 --port 8765 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ai
+import jobs
+import profiling
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+HEADER_TIMEOUT = 30
+# 长时间没有新事件时发送注释行，避免代理或客户端因空闲断开连接
+KEEPALIVE_INTERVAL = 15
+# 尚无完成的任务时，估算 Retry-After 使用的单个任务耗时（秒）
+DEFAULT_JOB_SECONDS = 60
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+TERMINAL_EVENTS = ("done", "error")
+MODES = ("stream", "parallel", "candidates")
+MAX_CANDIDATES = 4
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Request:
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "请求体不是有效的JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "请求体必须是JSON对象")
+        return data
+
+
+async def read_request(reader):
+    """读取一个HTTP请求；连接已关闭时返回None"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise HttpError(400, "请求不完整")
+    except asyncio.LimitOverrunError:
+        raise HttpError(413, "请求头过长")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "请求行格式错误")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "Content-Length 格式错误")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "请求体过大")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target.split("?", 1)[0], headers, body)
+
+
+def encode_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def coalesce_deltas(events):
+    """把已到达的相邻文本块合并为一个事件，减少慢客户端积压时的事件数"""
+    merged = []
+    for event, data in events:
+        if event == "delta" and merged and merged[-1][0] == "delta":
+            merged[-1] = ("delta", {"text": merged[-1][1]["text"] + data["text"]})
+        else:
+            merged.append((event, data))
+    return merged
+
+
+class PatentServer:
+    """生成服务：连接处理在事件循环中进行，生成本身在有界线程池中执行"""
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=4, queue_size=16, output_dir="server_output",
+                 api_keys=()):
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.output_dir = os.path.abspath(output_dir)
+        self.api_keys = set(api_keys or ())
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="generate")
+        self.slots = None
+        self.server = None
+        self.queued = 0
+        self.running = 0
+        self.totals = {"accepted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+        self.job_seconds = None  # 已完成任务耗时的EWMA，用于估算 Retry-After
+        self.started_at = time.time()
+
+    async def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._fail_orphaned_jobs()
+        self.slots = asyncio.Semaphore(self.workers)
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                 limit=MAX_HEADER_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info(f"生成服务已启动：http://{self.host}:{self.port}（{self.workers}个工作线程，队列{self.queue_size}）")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fail_orphaned_jobs(self):
+        """上次运行时未结束的任务，其客户端早已断开，直接标记为失败"""
+        store = ai.get_job_store()
+        for record in store.unfinished("server"):
+            store.finish(record.id, jobs.JobRecord.FAILED, "服务重启时任务未完成")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    return
+                await self.dispatch(request, reader, writer)
+            except HttpError as e:
+                await self.send_json(writer, e.status, {"error": str(e)}, e.headers)
+            except asyncio.TimeoutError:
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request, reader, writer):
+        routes = {
+            "/health": ("GET", self.handle_health),
+            "/metrics": ("GET", self.handle_metrics),
+            "/v1/generate": ("POST", self.handle_generate),
+        }
+        route = routes.get(request.path.rstrip("/") or "/")
+        if route is None:
+            raise HttpError(404, f"未知路径：{request.path}")
+        method, handler = route
+        if request.method != method:
+            raise HttpError(405, f"{request.path} 只接受 {method} 请求", {"Allow": method})
+        await handler(request, reader, writer)
+
+    async def send_response(self, writer, status, body, content_type, headers=None):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}",
+                 "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def send_json(self, writer, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self.send_response(writer, status, body, "application/json; charset=utf-8", headers)
+
+    def status(self):
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "queue_size": self.queue_size,
+            "uptime": round(time.time() - self.started_at, 1),
+            "totals": dict(self.totals),
+            "rate_limits": ai.rate_limiter_snapshot(),
+        }
+
+    async def handle_health(self, request, reader, writer):
+        await self.send_json(writer, 200, self.status())
+
+    def metrics_text(self):
+        lines = [
+            "# HELP patent_server_workers 工作线程数",
+            "# TYPE patent_server_workers gauge",
+            f"patent_server_workers {self.workers}",
+            "# HELP patent_server_running 正在执行的生成请求数",
+            "# TYPE patent_server_running gauge",
+            f"patent_server_running {self.running}",
+            "# HELP patent_server_queued 等待执行的生成请求数",
+            "# TYPE patent_server_queued gauge",
+            f"patent_server_queued {self.queued}",
+            "# HELP patent_server_requests_total 生成请求数（按结果）",
+            "# TYPE patent_server_requests_total counter",
+        ]
+        lines += [f'patent_server_requests_total{{status="{name}"}} {count}' for name, count in self.totals.items()]
+        return ai.metrics_registry().prometheus_text() + "\n".join(lines) + "\n"
+
+    async def handle_metrics(self, request, reader, writer):
+        await self.send_response(writer, 200, self.metrics_text().encode("utf-8"),
+                                 "text/plain; version=0.0.4; charset=utf-8")
+
+    def _check_auth(self, request):
+        if not self.api_keys:
+            return
+        auth = request.headers.get("authorization", "")
+        if not (auth.startswith("Bearer ") and auth[7:].strip() in self.api_keys):
+            raise HttpError(401, "缺少或错误的访问密钥", {"WWW-Authenticate": "Bearer"})
+
+    def retry_after(self):
+        """按当前排队数与平均任务耗时估算需要等待的秒数"""
+        seconds = self.job_seconds or DEFAULT_JOB_SECONDS
+        return max(1, round(seconds * (self.queued + 1) / self.workers))
+
+    async def handle_generate(self, request, reader, writer):
+        self._check_auth(request)
+        params = request.json()
+        title = str(params.get("title") or "").strip()
+        ideas = str(params.get("ideas") or "").strip()
+        mode = params.get("mode") or "stream"
+        if not title or not ideas:
+            raise HttpError(400, "title 与 ideas 均不能为空")
+        if mode not in MODES:
+            raise HttpError(400, f"mode 只能是 {'、'.join(MODES)} 之一")
+        try:
+            params["candidates"] = min(MAX_CANDIDATES, max(1, int(params.get("candidates") or 1)))
+        except (TypeError, ValueError):
+            raise HttpError(400, "candidates 必须是整数")
+        # 没有空闲工作线程且排队已满时拒绝，由客户端按 Retry-After 稍后重试
+        if self.slots.locked() and self.queued >= self.queue_size:
+            self.totals["rejected"] += 1
+            raise HttpError(503, "服务繁忙，请稍后重试", {"Retry-After": str(self.retry_after())})
+        self.totals["accepted"] += 1
+        accepted_at = time.perf_counter()
+
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                      "Cache-Control: no-cache\r\nConnection: close\r\nX-Accel-Buffering: no\r\n\r\n")
+                     .encode("latin-1"))
+        # 请求体已读完，之后读到连接结束即表示客户端已断开
+        disconnected = asyncio.ensure_future(reader.read())
+        try:
+            if not await self._wait_for_slot(writer, disconnected):
+                self.totals["cancelled"] += 1
+                return
+            try:
+                await self._run_job(params, title, ideas, mode, time.perf_counter() - accepted_at, writer,
+                                    disconnected)
+            finally:
+                self.slots.release()
+        finally:
+            disconnected.cancel()
+
+    async def _wait_for_slot(self, writer, disconnected):
+        """等待空闲的工作线程；客户端在排队期间断开时返回False"""
+        if not self.slots.locked():
+            await self.slots.acquire()
+            return True
+        self.queued += 1
+        try:
+            writer.write(encode_event("queued", {"position": self.queued, "retry_after": self.retry_after()}))
+            await writer.drain()
+            acquire = asyncio.ensure_future(self.slots.acquire())
+            await asyncio.wait({acquire, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if acquire.done():
+                return True
+            acquire.cancel()
+            return False
+        finally:
+            self.queued -= 1
+
+    async def _run_job(self, params, title, ideas, mode, queue_wait, writer, disconnected):
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        cancel = ai.CancelToken()
+
+        def emit(event, data):
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        self.running += 1
+        start = time.perf_counter()
+        task = loop.run_in_executor(self.executor, self.generate, title, ideas, mode, params["candidates"],
+                                    bool(params.get("use_cache", True)), queue_wait, cancel, emit)
+        try:
+            while True:
+                get = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({get, disconnected}, timeout=KEEPALIVE_INTERVAL,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    if disconnected in done:
+                        cancel.cancel()
+                        break
+                    writer.write(b": keep-alive\n\n")
+                    await writer.drain()
+                    continue
+                pending = [get.result()]
+                while not events.empty():
+                    pending.append(events.get_nowait())
+                finished = False
+                for event, data in coalesce_deltas(pending):
+                    writer.write(encode_event(event, data))
+                    finished = finished or event in TERMINAL_EVENTS
+                await writer.drain()
+                if finished:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            cancel.cancel()
+            raise
+        finally:
+            try:
+                state = await task
+            except Exception as e:
+                logging.error(f"[{title}] 生成任务异常: {e}")
+                state = "failed"
+            self.running -= 1
+            self.totals[state] += 1
+            if state == "done":
+                elapsed = time.perf_counter() - start
+                self.job_seconds = elapsed if self.job_seconds is None else 0.3 * elapsed + 0.7 * self.job_seconds
+
+    def generate(self, title, ideas, mode, candidates, use_cache, queue_wait, cancel, emit):
+        """在工作线程中生成并保存交底书，通过 emit 发出事件；返回任务的最终状态"""
+        store = ai.get_job_store()
+        try:
+            record_id = store.add(title, ideas, self.output_dir, mode=mode,
+                                  params={"use_cache": use_cache, "candidates": candidates}, source="server")
+        except Exception as e:
+            logging.error(f"[{title}] 任务记录失败: {e}")
+            emit("error", {"message": f"任务记录失败：{e}"})
+            return "failed"
+        stats = ai.StreamStats()
+        save_path = ""
+        state, error = "failed", ""
+        with profiling.job(f"server-{record_id}-{title}"):
+            try:
+                save_path = ai.allocate_save_path(self.output_dir, title)
+                store.start(record_id, save_path)
+                emit("started", {"job": record_id, "path": save_path})
+                content = None
+                alternates = None
+                if mode == "candidates":
+                    results = ai.generate_patent_candidates(
+                        title, ideas, candidates, use_cache, cancel=cancel, stats=stats,
+                        on_delta=lambda delta: emit("delta", {"text": delta}))
+                    ai.write_candidates(save_path, results)
+                    content = results[0].content
+                    alternates = [candidate.content for candidate in results[1:]]
+                elif mode == "parallel":
+                    content = ai.generate_patent_document_parallel(
+                        title, ideas, use_cache, cancel=cancel,
+                        on_section=lambda number, text: emit("section", {"number": number, "text": text}))
+                    ai.write_document(save_path, content)
+                    stats.chars = len(content)
+                    stats.bytes = len(content.encode("utf-8"))
+                    stats.finished_at = time.perf_counter()
+                    stats.completed = True
+                else:
+                    for delta in ai.stream_patent_document(title, ideas, save_path, stats, use_cache, cancel):
+                        emit("delta", {"text": delta})
+                    if stats.completed and stats.validation is not None and stats.validation.repaired:
+                        # 服务端修复过流程图或公式，客户端需要用修复后的全文替换已接收的内容
+                        with open(save_path, "r", encoding="utf-8") as f:
+                            content = f.read()
+                if not stats.completed:
+                    raise ai.GenerationCancelled()
+                state = "done"
+                store.finish(record_id, jobs.JobRecord.DONE)
+                ai.index_saved_document(save_path, title, ideas)
+                done = {"job": record_id, "path": save_path, "chars": stats.chars, "ttft": stats.ttft}
+                if content is not None:
+                    done["content"] = content
+                if alternates is not None:
+                    done["alternates"] = alternates
+                emit("done", done)
+            except ai.GenerationCancelled:
+                state, error = "cancelled", "客户端已断开"
+                store.finish(record_id, jobs.JobRecord.CANCELLED, error)
+                emit("error", {"message": error})
+            except Exception as e:
+                error = str(e)
+                logging.error(f"[{title}] 生成失败: {error}")
+                store.finish(record_id, jobs.JobRecord.FAILED, error)
+                emit("error", {"message": error})
+            finally:
+                ai.metrics_registry().record_job(
+                    title=title, mode=f"server-{mode}", queue_wait=queue_wait, total=stats.elapsed, ttft=stats.ttft,
+                    chars=stats.chars, output_bytes=stats.bytes, save_time=stats.write_time,
+                    prompt_tokens=stats.prompt_tokens, completion_tokens=stats.completion_tokens,
+                    validation_time=stats.validation.validation_time if stats.validation else None,
+                    success=state == "done", error=error, path=save_path if state == "done" else "")
+        return state
+
+
+def server_from_config(**overrides):
+    """按 config.json 中的 server 部分创建服务，overrides 中不为None的项优先"""
+    settings = dict(ai.ConfigLoader().config['server'])
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    settings['output_dir'] = ai.resource_path(settings['output_dir'])
+    return PatentServer(**settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="团队共用的交底书生成服务")
+    parser.add_argument("--host", help="监听地址，默认使用 config.json 中的 server.host")
+    parser.add_argument("--port", type=int, help="监听端口，默认使用 server.port")
+    parser.add_argument("--workers", type=int, help="同时生成的任务数，默认使用 server.workers")
+    parser.add_argument("--queue-size", type=int, help="最多排队的请求数，超出返回503，默认使用 server.queue_size")
+    parser.add_argument("-o", "--output", dest="output_dir", help="交底书保存目录，默认使用 server.output_dir")
+    parser.add_argument("--profile", nargs="?", const=profiling.DEFAULT_DIR, metavar="DIR",
+                        help=f"剖析每个任务的各阶段耗时，默认写入 {profiling.DEFAULT_DIR}/")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler('app.log', mode='a'), logging.StreamHandler()],
+    )
+    if args.profile:
+        profiling.enable(args.profile)
+    server = server_from_config(host=args.host, port=args.port, workers=args.workers,
+                                queue_size=args.queue_size, output_dir=args.output_dir)
+    ai.warm_up()
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,8 +22,8 @@ qt_plugin_path = find_qt_plugins()
 if qt_plugin_path:
     include_files.append((os.path.join(qt_plugin_path, "platforms"), "platforms"))
 
-# 排除不必要的包
-excludes = ["tkinter", "unittest", "email", "xml", "pydoc"]
+# 排除不必要的包（email 不能排除：远程模式使用的 http.client 依赖 email.parser）
+excludes = ["tkinter", "unittest", "xml", "pydoc"]
 
 # 需要显式包含的模块
 includes = ["PyQt5.QtCore", "PyQt5.QtGui", "PyQt5.QtWidgets"]
@@ -0,0 +1,92 @@
+"""启动耗时统计
+
+记录主程序各顶层模块的导入耗时、窗口首次绘制时间与后台预热耗时，
+启动完成后以JSON行写入 "patent.metrics" 日志（app.log），便于发现启动变慢的回归。
+本模块应当最先导入，导入时刻即视为启动起点。
+
+用法示例（打印启动报告后退出）：
+    python main.py --startup-report
+"""
+import builtins
+import json
+import logging
+import sys
+import threading
+import time
+
+_started_at = time.perf_counter()
+_main_thread = threading.get_ident()
+_original_import = builtins.__import__
+_lock = threading.Lock()
+_depth = 0
+_imports = {}  # 模块名 -> 导入耗时（秒）
+_marks = {}  # 阶段名 -> 距启动起点的秒数
+_background = {}  # 后台任务名 -> 耗时（秒）
+
+logger = logging.getLogger("patent.metrics")
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # 只统计主线程中最外层、且尚未加载过的导入，嵌套导入计入外层模块
+    global _depth
+    if (level or _depth or name in sys.modules
+            or threading.get_ident() != _main_thread):
+        return _original_import(name, globals, locals, fromlist, level)
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        _imports[name] = _imports.get(name, 0.0) + time.perf_counter() - start
+
+
+def install_import_hook():
+    """开始统计顶层导入耗时"""
+    builtins.__import__ = _timed_import
+
+
+def uninstall_import_hook():
+    """停止统计导入耗时，恢复原始导入函数"""
+    if builtins.__import__ is _timed_import:
+        builtins.__import__ = _original_import
+
+
+def mark(name):
+    """记录某个启动阶段完成的时刻"""
+    with _lock:
+        _marks.setdefault(name, time.perf_counter() - _started_at)
+
+
+def record(name, seconds):
+    """记录后台执行的启动任务（如预热导入openai）的耗时"""
+    with _lock:
+        _background[name] = seconds
+
+
+def report():
+    with _lock:
+        return {
+            "event": "startup",
+            "frozen": bool(getattr(sys, "frozen", False)),
+            "marks": {k: round(v, 4) for k, v in _marks.items()},
+            "imports": {k: round(v, 4) for k, v in sorted(_imports.items(), key=lambda item: -item[1])},
+            "background": {k: round(v, 4) for k, v in _background.items()},
+        }
+
+
+def report_text():
+    """可读的启动报告"""
+    data = report()
+    lines = ["启动阶段（距启动起点，秒）："]
+    lines += [f"  {name:<24}{seconds:>8.3f}" for name, seconds in data["marks"].items()]
+    lines.append("顶层模块导入耗时（秒）：")
+    lines += [f"  {name:<24}{seconds:>8.3f}" for name, seconds in data["imports"].items()]
+    if data["background"]:
+        lines.append("后台任务耗时（秒）：")
+        lines += [f"  {name:<24}{seconds:>8.3f}" for name, seconds in data["background"].items()]
+    return "\n".join(lines)
+
+
+def log_report():
+    logger.info(json.dumps(report(), ensure_ascii=False))
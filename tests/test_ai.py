@@ -0,0 +1,383 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import ai
+
+
+def test_coalesce_follower_honours_its_own_cancel():
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    leader = threading.Thread(target=lambda: ai._coalesce("coalesce-test", slow))
+    leader.start()
+    started.wait(5)
+    cancel = ai.CancelToken()
+    cancel.cancel()
+    try:
+        with pytest.raises(ai.GenerationCancelled):
+            ai._coalesce("coalesce-test", lambda: "unused", cancel)
+    finally:
+        release.set()
+        leader.join(5)
+
+
+
+def test_response_cache_key_depends_on_every_field():
+    messages = [{"role": "user", "content": "标题"}]
+    key = ai.ResponseCache.make_key("model", "url", messages, {"temperature": 0.7})
+    assert key == ai.ResponseCache.make_key("model", "url", list(messages), {"temperature": 0.7})
+    assert key != ai.ResponseCache.make_key("other", "url", messages, {"temperature": 0.7})
+    assert key != ai.ResponseCache.make_key("model", "url", messages, {"temperature": 0.2})
+
+
+def test_response_cache_round_trip_and_expiry(tmp_path):
+    cache = ai.ResponseCache(str(tmp_path), max_age_days=1)
+    cache.put("k", "内容")
+    assert cache.get("k") == "内容"
+    assert cache.get("missing") is None
+    old = time.time() - 2 * 86400
+    os.utime(tmp_path / "k.json", (old, old))
+    assert cache.get("k") is None
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ai.ResponseCache(str(tmp_path), max_size_mb=2500 / (1024 * 1024))
+    now = time.time()
+    for age, key in ((30, "a"), (20, "b")):
+        cache.put(key, "x" * 1000)
+        os.utime(tmp_path / f"{key}.json", (now - age, now - age))
+    cache.get("a")  # 命中后 a 成为最近使用的条目
+    cache.put("c", "x" * 1000)
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+
+
+def test_normalize_section_replaces_model_heading():
+    section = ai.DOCUMENT_SECTIONS[3]
+    assert ai._normalize_section(section, "4、详细方案\n\n正文") == "## 4. 本发明技术详细方案\n\n正文"
+    assert ai._normalize_section(section, "正文") == "## 4. 本发明技术详细方案\n\n正文"
+
+
+def test_section_dependencies_point_to_earlier_sections():
+    numbers = [section[0] for section in ai.DOCUMENT_SECTIONS]
+    for section in ai.DOCUMENT_SECTIONS:
+        assert all(numbers.index(n) < numbers.index(section[0]) for n in section[4])
+
+
+def test_parallel_sections_are_stitched_in_order(monkeypatch):
+    def complete(messages, use_cache=True, cancel=None, kind="chat", budget=None, requests=None):
+        number = int(kind[len("section"):])
+        time.sleep((8 - number) * 0.01)  # 后面的章节先完成
+        return f"第{number}部分正文"
+
+    monkeypatch.setattr(ai, "_complete", complete)
+    monkeypatch.setattr(ai, "find_prior_art", lambda title, ideas: [])
+    monkeypatch.setattr(ai, "postprocess_document", lambda text, **kwargs: (text, ai.validation.ValidationReport()))
+    monkeypatch.setattr(ai, "_record_validation", lambda report: None)
+    finished = []
+    content = ai.generate_patent_document_parallel("标题", "要点", on_section=lambda n, text: finished.append(n))
+    positions = [content.index(f"## {section[0]}. {section[1]}") for section in ai.DOCUMENT_SECTIONS]
+    assert positions == sorted(positions)
+    assert sorted(finished) == [section[0] for section in ai.DOCUMENT_SECTIONS]
+    assert content.startswith("# 标题 专利交底书\n\n")
+
+
+def _config_loader(path):
+    loader = object.__new__(ai.ConfigLoader)
+    loader.load_config(str(path))
+    return loader
+
+
+def _write_config(path, config, mtime):
+    path.write_text(json.dumps(config, ensure_ascii=False), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_config_is_merged_with_defaults(tmp_path):
+    path = tmp_path / "config.json"
+    _write_config(path, {"openai_config": {"api_key": "k"}, "cache": {"max_size_mb": 5}}, time.time())
+    config = _config_loader(path).config
+    assert config["openai_config"]["api_key"] == "k"
+    assert config["openai_config"]["model"] == "gpt-3.5-turbo"
+    assert config["cache"]["max_size_mb"] == 5
+    assert config["cache"]["max_age_days"] == 30
+
+
+def test_config_reload_keeps_previous_config_when_invalid(tmp_path, caplog):
+    path = tmp_path / "config.json"
+    now = time.time()
+    _write_config(path, {"openai_config": {"api_key": "k", "model": "a"}}, now - 20)
+    loader = _config_loader(path)
+    _write_config(path, {"openai_config": {"api_key": "k", "model": "b"}}, now - 10)
+    loader.reload_if_changed()
+    assert loader.config["openai_config"]["model"] == "b"
+    _write_config(path, {"openai_config": {"api_key": ""}}, now)
+    loader.reload_if_changed()
+    assert loader.config["openai_config"]["model"] == "b"
+    assert "配置重新加载失败" in caplog.text
+
+
+def test_cancel_token_runs_callbacks_once():
+    token = ai.CancelToken()
+    calls = []
+    token.register(lambda: calls.append("a"))
+    removed = lambda: calls.append("removed")
+    token.register(removed)
+    token.unregister(removed)
+    token.register(lambda: 1 / 0)  # 回调出错不影响其他回调
+    token.register(lambda: calls.append("b"))
+    assert not token.wait(0)
+    token.cancel()
+    token.cancel()
+    assert calls == ["a", "b"]
+    assert token.cancelled and token.wait(0)
+    token.register(lambda: calls.append("late"))
+    assert calls == ["a", "b", "late"]
+
+
+def test_parse_endpoints_inherits_top_level_fields():
+    config = {"base_url": "https://a", "api_key": "k", "model": "m",
+              "endpoints": [{"name": "primary"}, {"base_url": "https://b", "model": "n"}]}
+    assert ai._parse_endpoints(config) == [
+        {"base_url": "https://a", "api_key": "k", "model": "m", "name": "primary"},
+        {"base_url": "https://b", "api_key": "k", "model": "n", "name": "n@https://b"},
+    ]
+    assert [e["name"] for e in ai._parse_endpoints({"base_url": "https://a", "model": "m"})] == ["m@https://a"]
+
+
+def test_router_prefers_fast_endpoints_and_cools_down_failing_ones():
+    fast, slow, broken = ({"name": name} for name in ("fast", "slow", "broken"))
+    router = ai.EndpointRouter()
+    router.record_success(slow, 2.0)
+    router.record_success(fast, 0.5)
+    assert router.ranked([slow, fast]) == [fast, slow]
+    for _ in range(3):
+        router.record_failure(broken)
+    assert router.ranked([broken, slow, fast]) == [fast, slow, broken]
+    assert router.snapshot()["broken"]["cooling"]
+
+
+def test_hedge_delay_uses_latency_percentile():
+    endpoint = {"name": "e"}
+    router = ai.EndpointRouter()
+    routing = ai.ConfigLoader().config["routing"]
+    assert router.hedge_delay(endpoint) == max(routing["hedge_min_delay"], routing["hedge_default_delay"])
+    for latency in range(1, 21):
+        router.record_latency(endpoint, float(latency))
+    expected = sorted(range(1, 21))[min(19, int(20 * routing["hedge_percentile"] / 100))]
+    assert router.hedge_delay(endpoint) == max(routing["hedge_min_delay"], expected)
+
+
+def test_token_budget_reserves_and_settles():
+    budget = ai.TokenBudget(10000)
+    assert budget.reserve(1000, 4000) == 4000
+    assert budget.reserve(1000, None) == 4000  # 不限 max_tokens 时授予剩余额度
+    budget.settle(5000, 1500)
+    assert budget.spent == 6500
+    with pytest.raises(ai.GenerationTruncated):
+        budget.reserve(10000 - 6500 - ai.MIN_COMPLETION_TOKENS + 1, 1000)
+
+
+def test_unlimited_token_budget_passes_max_tokens_through():
+    budget = ai.TokenBudget(0)
+    assert budget.reserve(10 ** 9, 500) == 500
+    budget.settle(500, 100)
+    assert budget.spent == 100
+
+
+def test_generation_params_fit_context_window(monkeypatch):
+    monkeypatch.setattr(ai, "context_window", lambda: 4000)
+    messages = [{"role": "user", "content": "要点"}]
+    available = 4000 - ai.estimate_prompt_tokens(messages) - ai.CONTEXT_MARGIN
+    assert ai._generation_params(messages)["max_tokens"] == min(
+        ai.ConfigLoader().config["generation_params"]["max_tokens"] or available, available)
+    monkeypatch.setattr(ai, "context_window", lambda: 300)
+    with pytest.raises(ai.GenerationTruncated):
+        ai._generation_params(messages)
+
+
+def test_strip_overlap_removes_repeated_tail():
+    assert ai._strip_overlap("前文" + "0123456789abc", "0123456789abc后文") == "后文"
+    assert ai._strip_overlap("前文012", "012后文") == "012后文"  # 太短的重复不视为重叠
+
+
+def test_truncated_output_is_continued_without_duplication(monkeypatch):
+    first = "第一段内容" * 50
+    second = first[-30:] + "第二段内容"
+    replies = iter([(first, "length"), (second, "stop")])
+    seen = []
+
+    def stream_chat(messages, params, cancel=None, request_metrics=None):
+        seen.append(messages)
+        text, reason = next(replies)
+        request_metrics.finish_reason = reason
+        yield text
+
+    monkeypatch.setattr(ai, "_stream_chat", stream_chat)
+    messages = [{"role": "user", "content": "写"}]
+    text = "".join(ai._stream_document(messages, budget=ai.TokenBudget(0)))
+    assert text == first + "第二段内容"
+    assert seen[1][-2] == {"role": "assistant", "content": first}
+
+
+DOCUMENT = """# 一种图像识别方法 专利交底书
+
+## 1. 专业领域
+
+图像处理。
+
+## 2. 技术背景与现有技术
+
+背景。
+
+3. 背景中的编号列表不是章节标题
+
+**3. 现有技术缺点与发明目的**
+
+缺点。
+
+## 4. 本发明技术详细方案
+
+方案。
+"""
+
+
+def test_parse_document_finds_sections_and_round_trips():
+    document = ai.parse_document(DOCUMENT)
+    assert document.title == "一种图像识别方法"
+    assert sorted(document.sections) == [1, 2, 3, 4]
+    assert "编号列表" in document.sections[2]
+    assert document.sections[3].startswith("**3. 现有技术缺点与发明目的**")
+    assert document.render() == DOCUMENT
+
+
+def test_regenerate_sections_rewrites_only_selected_section(tmp_path, monkeypatch):
+    path = tmp_path / "doc.md"
+    path.write_text(DOCUMENT, encoding="utf-8")
+    requests = []
+
+    def complete(messages, use_cache=True, cancel=None, kind="chat", **kwargs):
+        requests.append((kind, messages))
+        return "## 4. 方案\n\n新的方案。"
+
+    monkeypatch.setattr(ai, "_complete", complete)
+    monkeypatch.setattr(ai, "postprocess_document", lambda text, **kwargs: (text, ai.validation.ValidationReport()))
+    monkeypatch.setattr(ai, "_record_validation", lambda report: None)
+    content = ai.regenerate_sections(str(path), [4], feedback="补充细节")
+    assert [kind for kind, _ in requests] == ["regenerate4"]
+    assert requests[0][1][-1]["content"].endswith("审阅意见：补充细节")
+    assert ai.parse_document(content).sections[4] == "## 4. 本发明技术详细方案\n\n新的方案。"
+    assert "背景。" in content
+    assert path.read_text(encoding="utf-8") == content
+    with pytest.raises(ValueError):
+        ai.regenerate_sections(str(path), [7])
+
+
+def _candidate_config(monkeypatch, max_document_tokens):
+    gen = ai.ConfigLoader().config["generation_params"]
+    monkeypatch.setitem(ai.ConfigLoader().config, "generation_params",
+                        dict(gen, use_n=True, max_tokens=1000, max_document_tokens=max_document_tokens))
+    monkeypatch.setattr(ai, "context_window", lambda: 100000)
+    monkeypatch.setattr(ai, "_cache_identity", lambda: ("candidate-test", "http://test"))
+    monkeypatch.setattr(ai, "_n_unsupported", set())
+
+
+def test_short_n_reply_is_completed_with_single_requests(monkeypatch):
+    _candidate_config(monkeypatch, 10000)
+    requested = {}
+
+    def fake_choices(messages, params, cancel, m, finish_reasons):
+        requested.update(params)
+        m.prompt_tokens, m.completion_tokens = 50, 20
+        finish_reasons[1] = "length"
+        yield 0, "甲"
+        yield 1, "乙"
+
+    prefixes = []
+
+    def fake_document(messages, cancel, kind, budget, requests, prefix):
+        prefixes.append(prefix)
+        yield "续"
+
+    monkeypatch.setattr(ai, "_stream_choices", fake_choices)
+    monkeypatch.setattr(ai, "_stream_document", fake_document)
+    texts = ai._request_candidates([{"role": "user", "content": "要点"}], 3)
+    assert texts == ["甲", "乙续", "续"]
+    assert requested["n"] == 3 and requested["max_tokens"] == 1000
+    assert sorted(prefixes) == ["", "乙"]
+    assert ("candidate-test", "http://test") in ai._n_unsupported
+
+
+def test_candidate_request_respects_shared_budget(monkeypatch):
+    messages = [{"role": "user", "content": "要点"}]
+    requested = {}
+
+    def fake_choices(messages, params, cancel, m, finish_reasons):
+        requested.update(params)
+        yield from enumerate(["甲", "乙", "丙"])
+
+    _candidate_config(monkeypatch, 100)
+    monkeypatch.setattr(ai, "_stream_choices", fake_choices)
+    assert ai._request_candidates(messages, 3) == ["甲", "乙", "丙"]
+    # 提示词只预留一次，剩余额度由三份候选平分
+    assert requested["max_tokens"] == (300 - ai.estimate_prompt_tokens(messages)) // 3
+    _candidate_config(monkeypatch, 80)
+    monkeypatch.setattr(ai, "_stream_choices", lambda *args: pytest.fail("预留额度不足时不应发起请求"))
+    with pytest.raises(ai.GenerationTruncated):
+        ai._request_candidates(messages, 3)
+
+
+def test_candidates_rank_and_are_written_side_by_side(tmp_path):
+    import mock_server
+    good = mock_server.MockOptions(output_chars=3000).document()
+    parsed = ai.parse_document(good)
+    missing = good.replace(parsed.sections[4], "")
+    assert ai.score_document(good).sort_key() > ai.score_document(missing).sort_key()
+    candidates = [ai.Candidate(0, good, None), ai.Candidate(1, missing, None)]
+    out_path = str(tmp_path / "交底书.md")
+    paths = ai.write_candidates(out_path, candidates)
+    assert paths == [out_path, str(tmp_path / "交底书_候选2.md")]
+    with open(paths[1], encoding="utf-8") as f:
+        assert f.read() == missing
+
+
+def test_ingest_sources_reuses_summaries_of_unchanged_chunks(tmp_path, monkeypatch):
+    import ingest
+    settings = dict(ai.ConfigLoader().config["ingest"], chunk_chars=300, max_chunk_chars=600,
+                    reduce_input_chars=200, workers=2)
+    monkeypatch.setitem(ai.ConfigLoader().config, "ingest", settings)
+    monkeypatch.setattr(ai, "_cache_identity", lambda: ("ingest-test", "http://test"))
+    store = ingest.SummaryStore(str(tmp_path / "ingest.db"))
+    monkeypatch.setattr(ai, "get_ingest_store", lambda: store)
+    calls = []
+
+    def fake_complete(messages, use_cache=True, cancel=None, kind="document", budget=None, requests=None):
+        calls.append(kind)
+        if kind == "ingest-map":
+            return "要点" * 20
+        return "合并要点" if "发明名称" in messages[1]["content"] else "中间要点" * 10
+
+    monkeypatch.setattr(ai, "_complete", fake_complete)
+    paragraphs = [f"第{i}段：" + "数据采集与处理模块" * (3 + i % 7) for i in range(60)]
+    path = tmp_path / "design.md"
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    first = ai.ingest_sources([str(path)], title="采集系统")
+    assert first.ideas == "合并要点"
+    assert first.chunks > 2 and first.reused == 0
+    assert calls.count("ingest-map") == first.chunks
+    # 摘要超过 reduce_input_chars 时先分组合并，最后一次合并才带上发明名称
+    assert calls.count("ingest-reduce") > 1
+
+    paragraphs[30] += "（补充说明）"
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    second = ai.ingest_sources([str(path)], title="采集系统")
+    assert second.reused >= second.chunks - 2
+    assert second.summarized == second.chunks - second.reused
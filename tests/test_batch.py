@@ -0,0 +1,26 @@
+import ai
+import batch
+
+
+def test_load_jobs_reads_jsonl_and_skips_incomplete_rows(tmp_path):
+    path = tmp_path / "ideas.jsonl"
+    path.write_text('{"title": "方法一", "ideas": "要点一"}\n'
+                    '\n'
+                    '{"title": "方法二", "ideas": ""}\n'
+                    '{"title": " 方法三 ", "ideas": "要点三"}\n', encoding="utf-8")
+    jobs = batch.load_jobs(str(path))
+    assert [(job.index, job.title, job.ideas) for job in jobs] == [(1, "方法一", "要点一"), (2, "方法三", "要点三")]
+
+
+def test_load_jobs_reads_csv_with_bom(tmp_path):
+    path = tmp_path / "ideas.csv"
+    path.write_text("\ufefftitle,ideas\n方法一,\"要点一,要点二\"\n", encoding="utf-8")
+    jobs = batch.load_jobs(str(path))
+    assert [(job.title, job.ideas) for job in jobs] == [("方法一", "要点一,要点二")]
+
+
+def test_write_document_leaves_no_partial_file(tmp_path):
+    path = str(tmp_path / "doc.md")
+    ai.write_document(path, "内容")
+    assert (tmp_path / "doc.md").read_text(encoding="utf-8") == "内容"
+    assert not (tmp_path / ("doc.md" + ai.PARTIAL_SUFFIX)).exists()
@@ -0,0 +1,34 @@
+import dedup
+
+IDEAS = "多尺度卷积特征提取；注意力加权的特征融合；自适应归一化；轻量级骨干网络部署在嵌入式设备"
+
+
+def test_shingles_ignore_punctuation_and_case():
+    assert dedup.shingles("CNN 识别", "") == dedup.shingles("cnn，识别", "")
+    assert dedup.shingles("a", "") == {"a"}
+    assert dedup.shingles("", "") == set()
+
+
+def test_signature_similarity_tracks_jaccard():
+    a = dedup.shingles("图像识别方法", IDEAS)
+    b = dedup.shingles("图像识别方法", IDEAS.replace("嵌入式设备", "移动终端"))
+    estimate = dedup.estimate_similarity(dedup.minhash(a), dedup.minhash(b))
+    assert abs(estimate - dedup.jaccard(a, b)) < 0.2
+    assert dedup.minhash(a) == dedup.minhash(set(a))  # 签名与进程、顺序无关
+
+
+def test_find_respects_threshold_and_missing_files(tmp_path):
+    store = dedup.DuplicateStore(str(tmp_path / "dedup.db"))
+    existing = tmp_path / "doc.md"
+    existing.write_text("x", encoding="utf-8")
+    store.add("图像识别方法", IDEAS, str(existing))
+    store.add("图像识别方法", IDEAS, str(tmp_path / "deleted.md"))
+    store.add("语音合成系统", "声学模型与声码器联合训练", str(existing))
+
+    near = IDEAS.replace("嵌入式设备", "移动终端")
+    matches = store.find("图像识别方法", near, threshold=0.7)
+    assert [match.path for match in matches] == [str(existing)]
+    assert 0.7 <= matches[0].similarity < 1.0
+    assert store.find("图像识别方法", near, threshold=0.99) == []
+    assert [m.similarity for m in store.find("图像识别方法", IDEAS)] == [1.0]
+    assert store.find("完全不同的题目", "区块链共识算法") == []
@@ -0,0 +1,81 @@
+import os
+
+import export
+
+MARKDOWN = """# 标题 专利交底书
+
+## 1. 专业领域
+
+本发明涉及
+图像处理 and CNN。
+
+- 要点一
+2. 要点二
+
+| 指标 | 本发明 |
+| --- | --- |
+| 准确率 | 96% |
+
+$$
+f(x) = \\sum_i x_i
+$$
+
+```mermaid
+graph TD
+    A[输入] --> B[输出]
+```
+
+---
+误差 $E = 1 - p$ 与 **关键** `code`
+"""
+
+
+def test_parse_markdown_blocks():
+    blocks = export.parse_markdown(MARKDOWN)
+    assert [(block.kind, block.level) for block in blocks] == [
+        ("heading", 1), ("heading", 2), ("paragraph", 0), ("bullet", 0), ("number", 0),
+        ("table", 0), ("math", 0), ("mermaid", 0), ("paragraph", 0)]
+    assert blocks[2].text == "本发明涉及图像处理 and CNN。"
+    assert blocks[5].text == [["指标", "本发明"], ["准确率", "96%"]]
+    assert blocks[6].text == "f(x) = \\sum_i x_i"
+    assert blocks[7].text.startswith("graph TD")
+
+
+def test_inline_segments_and_fragments():
+    assert export.inline_segments("误差 $E$ 与 **关键** `code`") == [
+        ("text", "误差 "), ("math", "E"), ("text", " 与 "), ("bold", "关键"), ("text", " "), ("code", "code")]
+    fragments = export.document_fragments(export.parse_markdown(MARKDOWN))
+    assert [kind for kind, _ in fragments] == ["math", "mermaid", "math"]
+    assert fragments[2] == ("math", "E = 1 - p")
+
+
+def test_parse_mermaid_nodes_and_edges():
+    direction, nodes, edges = export.parse_mermaid(
+        "graph LR\n    A[开始] --> B{判断}\n    B -->|是| C((结束)); B -.-> A\n    C --- D")
+    assert direction == "LR"
+    assert nodes == {"A": ("开始", "rect"), "B": ("判断", "diamond"), "C": ("结束", "circle"), "D": ("D", "rect")}
+    assert edges == [("A", "B", "", "arrow"), ("B", "C", "是", "arrow"), ("B", "A", "", "dotted"),
+                     ("C", "D", "", "line")]
+
+
+def test_layout_graph_breaks_cycles_and_routes_long_edges():
+    layers, back, routes = export.layout_graph(["A", "B", "C"], [("A", "B"), ("B", "C"), ("C", "A"), ("A", "C")])
+    assert back == {("C", "A")}
+    assert [[n for n in layer if not isinstance(n, tuple)] for layer in layers] == [["A"], ["B"], ["C"]]
+    assert routes[3] == [("dummy", 3, 0)]
+    assert ("dummy", 3, 0) in layers[1]
+
+
+def test_fragment_cache_lookup_and_eviction(tmp_path):
+    options = export.ExportOptions()
+    key = export.fragment_key("math", "x", options)
+    assert key != export.fragment_key("math", "x", export.ExportOptions(dpi=300))
+    assert export._cached(str(tmp_path), key) is None
+    (tmp_path / f"{key}.err").write_text("失败", encoding="utf-8")
+    assert export._cached(str(tmp_path), key) == ""
+    for name, age in (("old.png", 30), ("new.png", 10)):
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (1000 - age, 1000 - age))
+    os.utime(tmp_path / f"{key}.err", (1000, 1000))
+    export._evict(str(tmp_path), 120)
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{key}.err", "new.png"])
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+import ingest
+
+
+def _write_paragraphs(path, paragraphs, encoding="utf-8"):
+    path.write_text("\n\n".join(paragraphs) + "\n", encoding=encoding)
+    return str(path)
+
+
+def _paragraphs(count):
+    return [f"第{i}段：" + "数据采集与处理模块" * (3 + i % 7) for i in range(count)]
+
+
+def test_text_paragraphs_split_on_blank_lines(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("第一行\n第二行\n\n\n第三段  \n", encoding="utf-8")
+    assert list(ingest.iter_paragraphs(str(path))) == ["第一行\n第二行", "第三段"]
+
+
+def test_gb18030_file_is_detected(tmp_path):
+    path = _write_paragraphs(tmp_path / "notes.txt", ["中文资料", "第二段"], encoding="gb18030")
+    assert ingest._detect_encoding(path) == "gb18030"
+    assert list(ingest.iter_paragraphs(path)) == ["中文资料", "第二段"]
+    utf8 = _write_paragraphs(tmp_path / "utf8.md", ["中文资料"])
+    assert ingest._detect_encoding(utf8) == "utf-8-sig"
+
+
+def test_unsupported_extension_raises(tmp_path):
+    with pytest.raises(ingest.IngestError):
+        ingest.iter_paragraphs(str(tmp_path / "slides.pptx"))
+
+
+def test_split_long_cuts_by_line_then_hard():
+    paragraph = "\n".join(["a" * 4, "b" * 4, "c" * 12])
+    assert list(ingest._split_long(paragraph, 10)) == ["aaaa\nbbbb", "c" * 10, "cc"]
+    assert list(ingest._split_long("short", 10)) == ["short"]
+
+
+def test_chunks_respect_size_limits_and_keep_all_text(tmp_path):
+    paragraphs = _paragraphs(80)
+    path = _write_paragraphs(tmp_path / "design.md", paragraphs)
+    chunks = list(ingest.iter_chunks(path, target_chars=300, max_chars=600))
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    assert all(len(chunk.text) <= 600 for chunk in chunks)
+    assert all(len(chunk.text) >= 150 for chunk in chunks[:-1])
+    assert "\n\n".join(chunk.text for chunk in chunks) == "\n\n".join(paragraphs)
+
+
+def test_editing_one_paragraph_changes_few_chunks(tmp_path):
+    paragraphs = _paragraphs(80)
+    before = {chunk.digest for chunk in ingest.iter_chunks(
+        _write_paragraphs(tmp_path / "a.md", paragraphs), target_chars=300, max_chars=600)}
+    paragraphs[40] += "（补充说明）"
+    after = [chunk.digest for chunk in ingest.iter_chunks(
+        _write_paragraphs(tmp_path / "b.md", paragraphs), target_chars=300, max_chars=600)]
+    # 片段边界由段落内容决定，只有修改处附近的片段会变化
+    assert len([digest for digest in after if digest not in before]) <= 2
+
+
+def test_summary_store_get_put_purge(tmp_path, monkeypatch):
+    store = ingest.SummaryStore(str(tmp_path / "summaries.db"))
+    assert store.get("key") is None
+    store.put("key", "摘要")
+    store.put("old", "旧摘要")
+    assert store.get("key") == "摘要"
+    now = time.time()
+    monkeypatch.setattr(ingest.time, "time", lambda: now + 10 * 86400)
+    store.get("key")
+    assert store.purge(5) == 1
+    assert store.get("old") is None
+    assert store.get("key") == "摘要"
+    assert ingest.get_store(str(tmp_path / "summaries.db")) is ingest.get_store(str(tmp_path / "summaries.db"))
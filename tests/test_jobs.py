@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import jobs
+from jobs import JobRecord
+
+
+def test_allocate_path_skips_existing_files_and_reserved_names(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    (tmp_path / "标题_1.md").write_text("已存在", encoding="utf-8")
+    (tmp_path / "标题_2.md.part").write_text("生成中", encoding="utf-8")
+    first = store.allocate_path(str(tmp_path), "标题")
+    second = store.allocate_path(str(tmp_path), "标题")  # 未落盘的 标题.md 也不会重复分配
+    assert os.path.basename(first) == "标题.md"
+    assert os.path.basename(second) == "标题_3.md"
+    assert os.path.basename(store.allocate_path(str(tmp_path), "其他")) == "其他.md"
+
+
+def test_concurrent_allocations_are_unique(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = list(pool.map(lambda _: store.allocate_path(str(tmp_path), "标题"), range(40)))
+    assert len(set(paths)) == 40
+
+
+def test_job_lifecycle_and_resume_queries(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    done = store.add("甲", "要点", str(tmp_path), params={"use_cache": False})
+    running = store.add("乙", "要点", str(tmp_path), mode="candidates", params={"candidates": 3})
+    other = store.add("丙", "要点", str(tmp_path), source="batch:x")
+    store.start(done, str(tmp_path / "甲.md"))
+    store.finish(done, JobRecord.DONE)
+    store.start(running, str(tmp_path / "乙.md"))
+    record = store.get(running)
+    assert (record.state, record.attempts, record.mode, record.params) == (
+        JobRecord.RUNNING, 1, "candidates", {"candidates": 3})
+    assert record.part_path == str(tmp_path / "乙.md") + jobs.PARTIAL_SUFFIX
+    assert [r.id for r in store.unfinished("gui")] == [running]
+    assert [r.id for r in store.by_source("batch:x")] == [other]
+    assert store.purge(30) == 0
+    assert store.purge(-1) == 1  # 只删除已结束的任务
+    assert store.get(done) is None
+    assert store.get(running) is not None
+
+
+def test_read_partial_drops_truncated_utf8(tmp_path):
+    path = tmp_path / "doc.md.part"
+    path.write_bytes("完整内容".encode("utf-8") + "字".encode("utf-8")[:2])
+    assert jobs.read_partial(str(path)) == "完整内容"
+    assert path.read_text(encoding="utf-8") == "完整内容"
+    assert jobs.read_partial(str(tmp_path / "missing.part")) == ""
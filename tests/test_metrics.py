@@ -0,0 +1,50 @@
+import json
+import logging
+
+import metrics
+
+
+def _request(success=True, ttft=0.5, latency=2.0, prompt=10, completion=20):
+    m = metrics.RequestMetrics("document")
+    m.success = success
+    m.ttft = ttft
+    m.total_latency = latency
+    m.prompt_tokens = prompt
+    m.completion_tokens = completion
+    return m
+
+
+def test_tokens_per_sec_excludes_time_to_first_token():
+    assert _request(ttft=0.5, latency=2.5, completion=20).tokens_per_sec == 10
+    assert _request(completion=0).tokens_per_sec is None
+
+
+def test_registry_summary_and_totals(caplog):
+    registry = metrics.MetricsRegistry()
+    with caplog.at_level(logging.INFO, logger="patent.metrics"):
+        registry.record_request(_request(ttft=1.0))
+        registry.record_request(_request(success=False, ttft=None, prompt=5, completion=0))
+        registry.record_job(title="a", total=3.0, success=True)
+        registry.record_job(title="b", total=9.0, success=False)
+    summary = registry.summary()
+    assert summary["jobs"] == 2
+    assert summary["latency_p50"] == summary["latency_p95"] == 3.0
+    assert summary["ttft_p50"] == 1.0
+    assert summary["tokens_today"] == 35
+    assert registry.totals["failures"] == 1 and registry.totals["job_failures"] == 1
+    events = [json.loads(record.getMessage())["event"] for record in caplog.records]
+    assert events == ["request", "request", "job", "job"]
+
+
+def test_summary_text_without_jobs_shows_tokens():
+    assert metrics.MetricsRegistry().summary_text() == "今日token：0"
+
+
+def test_prometheus_file_is_written(tmp_path):
+    registry = metrics.MetricsRegistry()
+    registry.prometheus_file = str(tmp_path / "metrics.prom")
+    registry.record_request(_request())
+    text = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    assert 'patent_requests_total{status="success"} 1' in text
+    assert 'patent_tokens_total{type="completion"} 20' in text
+    assert "patent_request_latency_seconds_count 1" in text
@@ -0,0 +1,80 @@
+import http.client
+import json
+
+import pytest
+
+import bench
+import mock_server
+
+
+@pytest.fixture
+def server():
+    options = mock_server.MockOptions(token_rate=100000, first_token_delay=0, output_chars=400)
+    server = mock_server.start_mock_server(options=options)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, payload):
+    host, port = server.server_address[:2]
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.request("POST", "/v1/chat/completions", json.dumps(payload), {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    body = response.read().decode("utf-8")
+    conn.close()
+    return response, body
+
+
+def _events(body):
+    return [json.loads(line[len("data: "):]) for line in body.splitlines()
+            if line.startswith("data: ") and line != "data: [DONE]"]
+
+
+def test_completion_is_truncated_at_max_tokens(server):
+    response, body = _post(server, {"messages": [{"role": "user", "content": "写"}], "max_tokens": 10})
+    choice = json.loads(body)["choices"][0]
+    assert response.status == 200
+    assert choice["finish_reason"] == "length"
+    assert len(choice["message"]["content"]) == 10 * server.options.chars_per_token
+
+
+def test_stream_interleaves_n_choices_and_reports_usage(server):
+    payload = {"messages": [{"role": "user", "content": "写"}], "stream": True, "n": 2,
+               "stream_options": {"include_usage": True}}
+    response, body = _post(server, payload)
+    texts = {0: "", 1: ""}
+    finish = {}
+    usage = None
+    for event in _events(body):
+        usage = event.get("usage") or usage
+        for choice in event["choices"]:
+            texts[choice["index"]] += choice["delta"].get("content") or ""
+            if choice["finish_reason"]:
+                finish[choice["index"]] = choice["finish_reason"]
+    assert texts[0] == texts[1] == server.options.document()
+    assert finish == {0: "stop", 1: "stop"}
+    assert usage["completion_tokens"] == 2 * -(-len(texts[0]) // server.options.chars_per_token)
+
+
+def test_continuation_resumes_after_assistant_text(server):
+    document = server.options.document()
+    messages = [{"role": "user", "content": "写"}, {"role": "assistant", "content": document[:100]}]
+    _, body = _post(server, {"messages": messages})
+    assert json.loads(body)["choices"][0]["message"]["content"] == document[100:]
+
+
+def test_rpm_limit_returns_retry_after(server):
+    server.options.rpm_limit = 1
+    first, _ = _post(server, {"messages": []})
+    second, _ = _post(server, {"messages": []})
+    assert first.status == 200
+    assert second.status == 429
+    assert int(second.getheader("Retry-After")) >= 1
+
+
+def test_percentile_uses_nearest_rank():
+    assert bench.percentile([], 50) is None
+    assert bench.percentile([5, 1, 3, 2, 4], 50) == 3
+    assert bench.percentile(list(range(1, 101)), 95) == 95
+    assert bench.percentile([7], 99) == 7
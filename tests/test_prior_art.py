@@ -0,0 +1,103 @@
+import json
+from collections import Counter
+
+import pytest
+
+import prior_art
+import search_index
+
+TARGETS = [
+    {"id": "CN1", "title": "基于卷积网络的图像去噪方法", "abstract": "利用卷积神经网络估计噪声并去除图像噪点。"},
+    {"id": "CN2", "title": "锂电池热管理系统", "abstract": "通过液冷板与温度传感器控制电池包温度。"},
+]
+QUERIES = ["卷积网络图像去噪", "电池温度控制"]
+
+
+def _records(count, start=0):
+    return [{"id": f"F{i}", "title": f"widget{i} 装置", "abstract": f"model{i} part{i % 7} 组件"}
+            for i in range(start, start + count)]
+
+
+def _write(path, records, tail=""):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.write(tail)
+    return str(path)
+
+
+def _results(index):
+    return [[(item.id, item.score) for item in index.search(query)] for query in QUERIES]
+
+
+def test_terms_match_search_index_tokenize():
+    text = "基于CNN的图像去噪 Method，单 字"
+    assert prior_art._terms(text) == Counter(search_index.tokenize(text, False).split())
+
+
+def test_build_and_search(tmp_path):
+    path = _write(tmp_path / "abstracts.jsonl", _records(40) + TARGETS + [{"id": "empty"}, "not a record"])
+    index = prior_art.PriorArtIndex(str(tmp_path / "index"))
+    assert index.build([path]) == 42
+    assert index.search("卷积网络图像去噪")[0].id == "CN1"
+    best = index.search("电池温度控制", limit=1)
+    assert [(item.id, item.title) for item in best] == [("CN2", "锂电池热管理系统")]
+    assert index.search("") == []
+    # 其他进程写入后重新打开也能读到同样的结果
+    assert _results(prior_art.PriorArtIndex(str(tmp_path / "index"))) == _results(index)
+
+
+def test_segments_are_merged_without_changing_results(tmp_path):
+    path = _write(tmp_path / "abstracts.jsonl", _records(60) + TARGETS + _records(60, start=60))
+    single = prior_art.PriorArtIndex(str(tmp_path / "single"))
+    single.build([path])
+    assert len(single._segments) == 1
+    many = prior_art.PriorArtIndex(str(tmp_path / "many"), batch_postings=40, max_segments=100)
+    many.update([path])
+    merged = prior_art.PriorArtIndex(str(tmp_path / "merged"), batch_postings=40, max_segments=3)
+    merged.update([path])
+    assert len(many._segments) > 3 >= len(merged._segments)
+    assert many.count() == merged.count() == single.count() == 122
+    assert _results(many) == _results(merged) == _results(single)
+    rebuilt = prior_art.PriorArtIndex(str(tmp_path / "many"), batch_postings=40)
+    rebuilt.build([path])
+    assert len(rebuilt._segments) == 1
+    assert _results(rebuilt) == _results(single)
+
+
+def test_update_appends_complete_lines_only(tmp_path):
+    records = _records(20)
+    partial = json.dumps(TARGETS[0], ensure_ascii=False)
+    path = _write(tmp_path / "abstracts.jsonl", records, tail=partial)
+    index = prior_art.PriorArtIndex(str(tmp_path / "index"))
+    assert index.build([path]) == 20
+    assert index.search("卷积网络图像去噪") == []
+    # 末行写完后追加读取，不重复索引已有记录
+    _write(tmp_path / "abstracts.jsonl", records + TARGETS)
+    assert index.update([path]) == 2
+    assert index.count() == 22
+    assert index.search("卷积网络图像去噪")[0].id == "CN1"
+    other = _write(tmp_path / "more.jsonl", _records(5, start=100))
+    assert index.update([other]) == 5
+    assert index.count() == 27
+
+
+def test_rewritten_source_triggers_rebuild(tmp_path):
+    path = _write(tmp_path / "abstracts.jsonl", _records(20) + TARGETS)
+    index = prior_art.PriorArtIndex(str(tmp_path / "index"))
+    index.build([path])
+    _write(tmp_path / "abstracts.jsonl", TARGETS[1:] + _records(10))
+    assert index.update([path]) == 11
+    assert index.count() == 11
+    assert index.search("卷积网络图像去噪") == []
+
+
+def test_version_mismatch_is_reported(tmp_path):
+    path = _write(tmp_path / "abstracts.jsonl", TARGETS)
+    index = prior_art.PriorArtIndex(str(tmp_path / "index"))
+    index.build([path])
+    manifest = tmp_path / "index" / prior_art.MANIFEST
+    data = json.loads(manifest.read_text(encoding="utf-8"))
+    manifest.write_text(json.dumps(dict(data, version=prior_art.VERSION + 1)), encoding="utf-8")
+    with pytest.raises(prior_art.PriorArtError):
+        prior_art.PriorArtIndex(str(tmp_path / "index")).count()
@@ -0,0 +1,50 @@
+import json
+import threading
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def enabled(monkeypatch, tmp_path):
+    # 不调用 enable()：避免启动采样线程与 tracemalloc 影响其他测试
+    monkeypatch.setattr(profiling, "_enabled", True)
+    monkeypatch.setattr(profiling, "_settings", {"output_dir": str(tmp_path), "interval": 0.005,
+                                                  "cprofile": False})
+    return tmp_path
+
+
+def test_disabled_helpers_are_passthrough():
+    func = lambda: None
+    items = [1, 2]
+    assert profiling.bind(func) is func
+    assert profiling.timed_iter(items, "stream") is items
+    with profiling.job("任务") as profile:
+        assert profile is None
+        with profiling.stage("save"):
+            pass
+
+
+def test_job_collects_nested_and_bound_stages(enabled):
+    @profiling.staged("naming")
+    def allocate():
+        return "path"
+
+    with profiling.job("任务 A/B") as profile:
+        with profiling.stage("save"):
+            assert allocate() == "path"
+        worker = threading.Thread(target=profiling.bind(lambda: list(profiling.timed_iter([1, 2, 3], "stream"))))
+        worker.start()
+        worker.join()
+        assert profiling.current() is profile
+    assert profiling.current() is None
+    report = profile.report()
+    assert report["stages"]["save"]["calls"] == 1
+    assert report["stages"]["naming"]["calls"] == 1
+    assert report["stages"]["stream"]["calls"] == 4  # 最后一次取到 StopIteration 也计时
+    assert report["stages"]["save"]["wall"] >= report["stages"]["naming"]["wall"]
+    written = sorted(path.name for path in enabled.iterdir())
+    assert [name.split(".", 1)[1] for name in written] == ["collapsed", "stages.json"]
+    assert all("-任务_A_B-" in name for name in written)  # 文件名中的空白与路径分隔符被替换
+    assert json.loads((enabled / written[1]).read_text("utf-8"))["job"] == "任务 A/B"
@@ -0,0 +1,91 @@
+import email.utils
+import time
+
+import pytest
+
+import ai
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code, headers)
+
+
+@pytest.fixture
+def rate_settings(monkeypatch):
+    settings = dict(ai.ConfigLoader().config["rate_limit"], enabled=True, requests_per_minute=0,
+                    tokens_per_minute=0, headroom=1.0, initial_concurrency=4, min_concurrency=1,
+                    max_concurrency=8, backoff_base=1.0, backoff_max=60)
+    monkeypatch.setitem(ai.ConfigLoader().config, "rate_limit", settings)
+    return settings
+
+
+def test_retry_after_header_forms():
+    assert ai._retry_after(FakeError(429, {"Retry-After": "3"})) == 3.0
+    assert ai._retry_after(FakeError(429, {"retry-after-ms": "1500"})) == 1.5
+    future = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 < ai._retry_after(FakeError(503, {"Retry-After": future})) <= 60
+    assert ai._retry_after(FakeError(429, {"Retry-After": "soon"})) is None
+    assert ai._retry_after(FakeError(429)) is None
+    assert ai._retry_after(Exception()) is None
+
+
+def test_overload_and_retryable_classification():
+    assert ai._is_overload(FakeError(429)) and ai._is_overload(FakeError(502))
+    assert not ai._is_overload(FakeError(400))
+    assert ai._is_retryable(FakeError(408))
+
+
+def test_backoff_is_jittered_and_honours_retry_after(rate_settings):
+    for retry in range(4):
+        ceiling = min(60, 2 ** retry)
+        assert ceiling / 2 <= ai.backoff_delay(retry) <= ceiling
+    assert ai.backoff_delay(0, FakeError(429, {"Retry-After": "10"})) >= 10
+    assert ai.backoff_delay(20) <= 60
+
+
+def test_token_bucket_refills_at_the_configured_rate():
+    bucket = ai._TokenBucket(600)  # 每秒10个，容量为6秒的额度
+    assert bucket.capacity == 60
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(10, now) == pytest.approx(1.0)
+    assert bucket.wait_time(10, now + 1.0) == pytest.approx(0.0)
+    assert bucket.wait_time(1000, now + 1.0) == pytest.approx(5.0)  # 超过容量的请求等到桶满即可
+    bucket.take(-100)  # 归还的令牌不超过容量
+    assert bucket.level == 60
+    assert ai._TokenBucket(0).wait_time(10 ** 9, now) == 0.0
+
+
+def test_concurrency_is_increased_additively_and_halved_once_per_round(rate_settings):
+    limiter = ai.RateLimiter()
+    permits = [limiter.acquire(100) for _ in range(4)]
+    assert limiter.acquire(100, abandoned=lambda: True) is None
+    limiter.record_success()
+    assert limiter.limit == pytest.approx(4.25)
+    permits[0].release(error=FakeError(429))
+    permits[1].release(error=FakeError(503))  # 同一轮中的第二个失败不再减半
+    assert limiter.limit == pytest.approx(2.125)
+    permits[1].release(error=FakeError(503))  # 重复归还无效
+    assert limiter.in_flight == 2
+    permits[2].release()
+    permits[3].release()
+    permit = limiter.acquire(100)
+    permit.release(error=FakeError(500))
+    assert limiter.limit == pytest.approx(1.0625)
+
+
+def test_retry_after_pauses_the_endpoint(rate_settings):
+    limiter = ai.RateLimiter()
+    limiter.acquire(10).release(error=FakeError(429, {"Retry-After": "30"}))
+    assert limiter.snapshot()["paused"] > 29
+    start = time.monotonic()
+    assert limiter.acquire(10, abandoned=lambda: time.monotonic() - start > 0.3) is None
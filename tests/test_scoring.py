@@ -0,0 +1,42 @@
+import scoring
+
+CHAIN = (
+    "```mermaid\n"
+    "graph TD\n"
+    "    A[采集] --> B[预处理] --> C[特征提取] --> D[融合] --> E[输出]\n"
+    "```\n"
+)
+
+
+def test_flowchart_nodes_counts_labelled_chain():
+    assert scoring.flowchart_nodes(CHAIN) == 5
+
+
+def test_labelled_chart_outranks_broken_chart():
+    broken = CHAIN.replace("B[预处理]", "B[预处理")
+    good = scoring.score_document("", {4: CHAIN}, [4], min_nodes={4: 5})
+    bad = scoring.score_document("", {4: broken}, [4], min_nodes={4: 5})
+    assert good.failed == []
+    assert good.sort_key() > bad.sort_key()
+
+
+def test_count_chars_ignores_code_headings_and_whitespace():
+    assert scoring.count_chars("## 标题\n\n正文 内容\n```\ncode\n```\n") == 4
+
+
+def test_table_rows_counts_data_rows_of_largest_table():
+    table = "| a | b |\n| --- | --- |\n| 1 | 2 |\n| 3 | 4 |\n\n| c |\n| --- |\n| 5 |\n"
+    assert scoring.table_rows(table) == 2
+    assert scoring.table_rows("| a | b |\n| 1 | 2 |\n") == 0  # 没有分隔行的不算表格
+
+
+def test_score_weights_and_tie_breaks():
+    complete = scoring.score_document("正文", {1: "x", 4: "字" * 10}, [1, 4], min_chars={4: 20})
+    missing = scoring.score_document("正文", {4: "字" * 20}, [1, 4], min_chars={4: 20})
+    assert complete.score == 3.0 + 1.0  # 章节齐全，篇幅达到一半
+    assert missing.score == 1.5 + 2.0
+    assert complete.max_score == missing.max_score == 5.0
+    assert [repr(check) for check in complete.failed] == ["第4部分正文字数：10/20"]
+    with_formula_issue = scoring.score_document("$\\frac{a}$ 正文更长", {1: "x"}, [1])
+    clean = scoring.score_document("正文", {1: "x"}, [1])
+    assert clean.sort_key() > with_formula_issue.sort_key()
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+import search_index
+
+
+def _write(directory, name, text, mtime=None):
+    path = directory / f"{name}_专利交底书.md"
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_tokenize_and_build_query():
+    assert search_index.tokenize("特征提取 CNN") == "特征 征提 提取 取 cnn"
+    assert search_index.tokenize("特征提取", trailing_unigram=False) == "特征 征提 提取"
+    assert search_index.build_query("特征提取 卷") == '"特征 征提 提取" AND 卷*'
+
+
+def test_incremental_update_and_search(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write(docs, "a", "# 图像识别 专利交底书\n\n卷积特征提取方法")
+    b = _write(docs, "b", "# 语音识别 专利交底书\n\n声学模型")
+    (docs / "notes.md").write_text("特征提取", encoding="utf-8")
+    index = search_index.DocumentIndex(str(tmp_path / "index.db"))
+    assert index.update(str(docs)) == (2, 0)
+    assert index.update(str(docs)) == (0, 0)
+    hits = index.search("特征提取")
+    assert [hit.title for hit in hits] == ["图像识别"]
+    assert "特征提取" in hits[0].snippet
+    os.remove(b)
+    assert index.update(str(docs)) == (0, 1)
+    assert index.search("声学") == []
+    assert index.count() == 1
+
+
+def test_deleted_rowid_is_not_reused(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(9):
+        _write(docs, f"a{i}", f"# 甲{i} 专利交底书\n\n卷积网络", mtime=1000 + i)
+    index = search_index.DocumentIndex(str(tmp_path / "index.db"))
+    index.update(str(docs))
+    # 最新一行被删除；孤立行比例不足以触发重建，FTS 中仍留有它的旧词项
+    b = _write(docs, "b", "# 乙 专利交底书\n\n声学模型")
+    index.add(b)
+    os.remove(b)
+    index.update(str(docs))
+    index.add(_write(docs, "c", "# 丙 专利交底书\n\n光学镜头"))
+    assert index.search("声学") == []
+    assert [hit.title for hit in index.search("光学")] == ["丙"]
+
+
+def test_old_index_is_migrated_to_autoincrement(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    path = _write(docs, "a", "# 甲 专利交底书\n\n卷积网络")
+    db_path = str(tmp_path / "index.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(search_index.SCHEMA.replace(" AUTOINCREMENT", ""))
+    conn.execute("INSERT INTO documents(path, title, mtime, size) VALUES(?, '甲', 0, 0)", (path,))
+    conn.commit()
+    conn.close()
+    index = search_index.DocumentIndex(db_path)
+    with index._connect() as conn:
+        assert not index._needs_autoincrement(conn)
+    assert [hit.title for hit in index.search("卷积")] == ["甲"]
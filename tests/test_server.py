@@ -0,0 +1,92 @@
+import asyncio
+import io
+import threading
+import time
+
+import pytest
+
+import ai
+import jobs
+import remote
+import server
+
+
+def test_events_round_trip_through_the_client_parser():
+    stream = (server.encode_event("delta", {"text": "第一块"}) + b": keep-alive\n\n"
+              + server.encode_event("done", {"chars": 3}))
+    assert list(remote._iter_events(io.BytesIO(stream))) == [("delta", {"text": "第一块"}), ("done", {"chars": 3})]
+
+
+def test_coalesce_deltas_merges_only_adjacent_text():
+    events = [("delta", {"text": "a"}), ("delta", {"text": "b"}), ("section", {"number": 1}),
+              ("delta", {"text": "c"})]
+    assert server.coalesce_deltas(events) == [("delta", {"text": "ab"}), ("section", {"number": 1}),
+                                              ("delta", {"text": "c"})]
+
+
+def test_read_request_parses_headers_and_body():
+    async def parse(raw):
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await server.read_request(reader)
+
+    request = asyncio.run(parse(b"POST /v1/generate?x=1 HTTP/1.1\r\nContent-Length: 2\r\nX-A: b\r\n\r\n{}"))
+    assert (request.method, request.path, request.headers["x-a"], request.json()) == ("POST", "/v1/generate", "b", {})
+    assert asyncio.run(parse(b"")) is None
+    with pytest.raises(server.HttpError) as error:
+        asyncio.run(parse(b"POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (server.MAX_BODY_BYTES + 1)))
+    assert error.value.status == 413
+
+
+@pytest.fixture
+def running_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai, "get_job_store", lambda: jobs.JobStore(str(tmp_path / "jobs.db")))
+    release = threading.Event()
+
+    def generate(self, title, ideas, mode, candidates, use_cache, queue_wait, cancel, emit):
+        emit("started", {"job": 1, "path": ""})
+        if title == "阻塞":
+            release.wait(10)
+        emit("delta", {"text": f"{title}："})
+        emit("delta", {"text": ideas})
+        emit("done", {"job": 1, "path": "", "chars": len(ideas)})
+        return "done"
+
+    monkeypatch.setattr(server.PatentServer, "generate", generate)
+    instance = server.PatentServer(port=0, workers=1, queue_size=0, output_dir=str(tmp_path / "out"))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(instance.start(), loop).result(10)
+    monkeypatch.setitem(ai.ConfigLoader().config, "remote", {"url": f"http://127.0.0.1:{instance.port}", "api_key": ""})
+    yield instance, release
+    release.set()
+    loop.call_soon_threadsafe(instance.server.close)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_remote_client_streams_from_server(running_server, tmp_path):
+    out_path = str(tmp_path / "doc.md")
+    stats = ai.StreamStats()
+    deltas = list(remote.stream_patent_document("标题", "要点", out_path, stats))
+    assert "".join(deltas) == "标题：要点"
+    assert stats.completed
+    assert open(out_path, encoding="utf-8").read() == "标题：要点"
+
+
+def test_full_queue_is_rejected_with_retry_after(running_server):
+    instance, release = running_server
+    blocked = threading.Thread(target=lambda: list(remote._request_events({"title": "阻塞", "ideas": "要点"})))
+    blocked.start()
+    try:
+        for _ in range(100):
+            if instance.running:
+                break
+            time.sleep(0.05)
+        with pytest.raises(remote.ServerBusy) as busy:
+            remote._open_events({"title": "标题", "ideas": "要点"})
+        assert busy.value.retry_after >= 1
+        assert instance.totals["rejected"] == 1
+    finally:
+        release.set()
+        blocked.join(10)
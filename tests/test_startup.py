@@ -0,0 +1,31 @@
+import sys
+
+import startup
+
+
+def test_import_hook_times_only_outermost_new_imports(tmp_path, monkeypatch):
+    (tmp_path / "startup_outer.py").write_text("import startup_inner\n", encoding="utf-8")
+    (tmp_path / "startup_inner.py").write_text("VALUE = 1\n", encoding="utf-8")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    startup.install_import_hook()
+    try:
+        import startup_outer  # noqa: F401
+        import json  # noqa: F401  已加载的模块不计时
+    finally:
+        startup.uninstall_import_hook()
+        sys.modules.pop("startup_outer", None)
+        sys.modules.pop("startup_inner", None)
+    imports = startup.report()["imports"]
+    assert "startup_outer" in imports
+    assert "startup_inner" not in imports
+    assert "json" not in imports
+
+
+def test_mark_keeps_first_time_and_report_text_lists_it():
+    startup.mark("test-mark")
+    first = startup.report()["marks"]["test-mark"]
+    startup.mark("test-mark")
+    assert startup.report()["marks"]["test-mark"] == first
+    startup.record("test-background", 1.5)
+    text = startup.report_text()
+    assert "test-mark" in text and "test-background" in text
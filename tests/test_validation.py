@@ -0,0 +1,76 @@
+import validation
+
+
+def test_chain_of_labelled_nodes_counts_every_node():
+    problems, node_count = validation.check_mermaid("graph TD\n A[开始] --> B[处理] --> C[结束]\n")
+    assert problems == []
+    assert node_count == 3
+
+
+def test_five_node_chart_meets_requirement():
+    source = "graph TD\n A[采集] --> B[预处理]\n B --> C[特征提取] --> D{判断}\n D -->|是| E((输出))\n"
+    assert validation.check_mermaid(source) == ([], 5)
+
+
+def test_asymmetric_node_shape():
+    assert validation.check_mermaid("graph TD\n A[开始] --> F>标记]\n") == ([], 2)
+
+
+def test_unbalanced_bracket_is_reported():
+    problems, _ = validation.check_mermaid("graph TD\n A[开始 --> B\n")
+    assert problems and problems[0].startswith("括号不配对")
+
+
+def test_unclosed_dollar_absorbs_formula_on_same_line():
+    text = "公式 $\\frac{a}$ 和 $x 未闭合\n下一行 $y$"
+    issues = validation.find_latex_issues(text)
+    assert len(issues) == 1
+    issue = issues[0]
+    assert (issue.start, issue.end) == (0, text.index("\n"))
+    assert "\\frac 缺少参数" in issue.problems
+    assert "公式定界符 $ 未闭合" in issue.problems
+
+
+def test_check_latex_reports_structural_problems():
+    assert validation.check_latex(r"\frac{a}{b} + \left( x \right)") == []
+    assert validation.check_latex(r"\frac{a}{b") == ["花括号不配对"]
+    assert validation.check_latex(r"\left( x") == ["\\left 与 \\right 数量不一致（1/0）"]
+    assert validation.check_latex(r"\begin{matrix} a \end{cases}") == ["\\begin 与 \\end 不配对"]
+    assert validation.check_latex(r"\frac{a}") == ["\\frac 缺少参数"]
+    assert validation.check_latex(r"\frac12") == []
+
+
+def test_formulas_in_code_are_ignored():
+    text = "正文 `$未闭合` 与\n```\n$$\\frac{a}$$\n```\n以及 $x^2$"
+    assert validation.find_latex_issues(text) == []
+
+
+def test_issue_offsets_and_sections():
+    text = "## 3. 缺点\n\n误差 $\\frac{a}$ 较大\n\n## 4. 方案\n\n$$\\left( x$$\n"
+    issues = validation.validate_document(text)
+    assert [(issue.section, issue.text) for issue in issues] == [(3, "$\\frac{a}$"), (4, "$$\\left( x$$")]
+    for issue in issues:
+        assert text[issue.start:issue.end] == issue.text
+
+
+def test_missing_and_small_flowcharts_are_reported():
+    text = "## 2. 背景\n\n```mermaid\ngraph TD\n    A[开始] --> B[结束]\n```\n\n## 4. 方案\n\n正文\n"
+    issues = validation.find_mermaid_issues(text, {2: 5, 4: 5})
+    problems = {issue.section: (issue.problems, issue.repairable) for issue in issues}
+    assert problems[2] == (["流程图只有2个节点，要求至少5个"], True)
+    assert problems[4] == (["第4部分缺少流程图"], False)
+
+
+def test_postprocess_splices_repairs_back(monkeypatch):
+    import ai
+
+    text = "## 3. 缺点\n\n误差 $\\frac{a}$ 与 $\\left( x$ 较大\n"
+    replies = {"$\\frac{a}$": "$\\frac{a}{b}$", "$\\left( x$": "$\\left( x \\right)$"}
+
+    def complete(messages, use_cache=True, cancel=None, kind="chat", **kwargs):
+        return replies[messages[-1]["content"].rsplit("\n", 1)[-1]]
+
+    monkeypatch.setattr(ai, "_complete", complete)
+    repaired, report = ai.postprocess_document(text, repair=True)
+    assert repaired == "## 3. 缺点\n\n误差 $\\frac{a}{b}$ 与 $\\left( x \\right)$ 较大\n"
+    assert report.repaired == 2 and report.unresolved == []
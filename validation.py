@@ -0,0 +1,279 @@
+"""交底书中 Mermaid 流程图与 LaTeX 公式的离线校验
+
+只做本地的语法检查，不依赖网络或第三方库：
+- ```mermaid 代码块：图类型声明、每行语句的结构与括号配对、节点数；
+- $...$ 与 $$...$$ 公式：定界符配对、花括号配对、\\left/\\right 与 \\begin/\\end 配对、\\frac 参数个数。
+发现的问题以 BlockIssue 返回，由 ai.postprocess_document 只把有问题的代码块发回模型修复。
+"""
+import re
+
+MERMAID_BLOCK = re.compile(r"```mermaid[ \t]*\n(.*?)```", re.S)
+FENCED_BLOCK = re.compile(r"```.*?```", re.S)
+INLINE_CODE = re.compile(r"`[^`\n]*`")
+SECTION_HEADING = re.compile(r"^#+\s*(\d+)\s*[\.、．]", re.M)
+
+GRAPH_HEADER = re.compile(r"^(graph|flowchart)\s+(TD|TB|BT|RL|LR)\s*;?$")
+# 节点：ID 后可跟 [文本]、(文本)、((文本))、{文本}、>文本]、[(文本)]、[[文本]] 等形状
+NODE = r"[A-Za-z0-9_\u4e00-\u9fff]+(?:\[\[[^\]]*\]\]|\[\([^\]]*\)\]|\(\([^)]*\)\)|\[[^\]]*\]|\([^)]*\)|\{[^}]*\}|>[^\]]*\])?"
+# 连线：-->、---、-.->、==>、--o、--x，可带 |说明| 或 “-- 说明 -->”形式
+LINK = r"(?:<?(?:-{2,}|-\.+-|={2,})[->ox]?|--[^->|]+-->|==[^=>|]+==>)(?:\|[^|]*\|)?"
+NODE_GROUP = rf"{NODE}(?:\s*&\s*{NODE})*"
+EDGE_STATEMENT = re.compile(rf"^{NODE_GROUP}(?:\s*{LINK}\s*{NODE_GROUP})+\s*;?$")
+NODE_STATEMENT = re.compile(rf"^{NODE}\s*;?$")
+NODE_ID = re.compile(r"^[A-Za-z0-9_\u4e00-\u9fff]+$")
+# 不对称节点的 >文本] 只出现在节点ID之后，不能与 --> 等连线中的 > 混淆
+NODE_LABEL = re.compile(r"\[[^\]]*\]+|\(+[^)]*\)+|\{[^}]*\}|(?<=[A-Za-z0-9_\u4e00-\u9fff])>[^\]]*\]|\|[^|]*\|")
+LINK_SEPARATOR = re.compile(r"--[^->|]+-->|==[^=>|]+==>|<?(?:-{2,}|-\.+-|={2,})[->ox]?|&")
+KEYWORD_STATEMENT = re.compile(r"^(subgraph\b.*|end|direction\s+\w+|classDef\s+.+|class\s+.+|style\s+.+|"
+                               r"linkStyle\s+.+|click\s+.+|%%.*)$")
+BRACKETS = {"[": "]", "(": ")", "{": "}"}
+
+DISPLAY_MATH = re.compile(r"\$\$(.+?)\$\$", re.S)
+INLINE_MATH = re.compile(r"(?<![\\$])\$(?!\$)([^\n$]+?)(?<!\\)\$")
+
+
+class BlockIssue:
+    """一个有问题的代码块或公式
+
+    kind 为 "mermaid" 或 "latex"；start/end 为其在全文中的字符区间（含定界符），
+    text 为该区间的原文，problems 为问题描述列表，section 为所在章节序号（无法确定时为None）。
+    repairable 为False的问题（如缺少流程图）只报告、不发起修复。
+    """
+
+    def __init__(self, kind, start, end, text, problems, section=None, repairable=True):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.text = text
+        self.problems = problems
+        self.section = section
+        self.repairable = repairable
+
+    def __repr__(self):
+        return f"BlockIssue({self.kind}, 第{self.section}部分, {'；'.join(self.problems)})"
+
+
+def section_at(text, offset):
+    """offset 所在章节的序号（取其之前最近的“## n.”标题），找不到时返回None"""
+    number = None
+    for match in SECTION_HEADING.finditer(text, 0, offset):
+        number = int(match.group(1))
+    return number
+
+
+def _check_brackets(line):
+    """检查括号配对；节点ID后的 > 视为不对称节点 >文本] 的开括号，连线说明 |文本| 内的字符不计"""
+    stack = []
+    in_link_text = False
+    previous = ""
+    for ch in line:
+        if ch == "|" and not stack:
+            in_link_text = not in_link_text
+        elif in_link_text:
+            pass
+        elif ch in BRACKETS:
+            stack.append(BRACKETS[ch])
+        elif ch == ">" and not stack and NODE_ID.match(previous):
+            stack.append("]")
+        elif ch in BRACKETS.values():
+            if not stack or stack.pop() != ch:
+                return False
+        previous = ch
+    return not stack and not in_link_text
+
+
+def check_mermaid(source):
+    """校验流程图源码，返回 (问题列表, 节点数)"""
+    problems = []
+    lines = [line.strip() for line in source.strip().splitlines()]
+    lines = [line for line in lines if line and not line.startswith("%%")]
+    if not lines:
+        return ["流程图为空"], 0
+    if not GRAPH_HEADER.match(lines[0]):
+        problems.append(f"首行应为“graph TD”等图类型声明，实际为：{lines[0][:40]}")
+        body = lines if not lines[0].startswith(("graph", "flowchart")) else lines[1:]
+    else:
+        body = lines[1:]
+
+    nodes = set()
+    depth = 0
+    for line in body:
+        if KEYWORD_STATEMENT.match(line):
+            if line.startswith("subgraph"):
+                depth += 1
+            elif line == "end":
+                depth -= 1
+            continue
+        # 引号内的文本可以包含任意括号
+        line = re.sub(r'"[^"]*"', '""', line)
+        if not _check_brackets(line):
+            problems.append(f"括号不配对：{line[:40]}")
+            continue
+        if not (EDGE_STATEMENT.match(line) or NODE_STATEMENT.match(line)):
+            problems.append(f"无法识别的语句：{line[:40]}")
+            continue
+        # 去掉节点文本与连线说明后按连线拆开，剩下的就是节点ID
+        for piece in LINK_SEPARATOR.split(NODE_LABEL.sub("", line)):
+            piece = piece.strip().rstrip(";").strip()
+            if NODE_ID.match(piece):
+                nodes.add(piece)
+    if depth != 0:
+        problems.append("subgraph 与 end 数量不一致")
+    return problems, len(nodes)
+
+
+def _strip_code(text):
+    """把代码块与行内代码替换为等长空白，使公式扫描不受影响且偏移量不变"""
+    blank = lambda match: re.sub(r"[^\n]", " ", match.group(0))
+    return INLINE_CODE.sub(blank, FENCED_BLOCK.sub(blank, text))
+
+
+def _brace_groups(formula, start):
+    """从 start 开始跳过空白读取连续的 {...} 参数个数"""
+    count = 0
+    index = start
+    while True:
+        while index < len(formula) and formula[index] == " ":
+            index += 1
+        if index >= len(formula) or formula[index] != "{":
+            return count
+        depth = 0
+        while index < len(formula):
+            if formula[index] == "{" and formula[index - 1] != "\\":
+                depth += 1
+            elif formula[index] == "}" and formula[index - 1] != "\\":
+                depth -= 1
+                if depth == 0:
+                    break
+            index += 1
+        index += 1
+        count += 1
+
+
+def check_latex(formula):
+    """校验单个公式（不含定界符），返回问题列表"""
+    problems = []
+    if not formula.strip():
+        return ["公式为空"]
+    depth = 0
+    for index, ch in enumerate(formula):
+        if index and formula[index - 1] == "\\":
+            continue
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth < 0:
+                break
+    if depth != 0:
+        problems.append("花括号不配对")
+    lefts = len(re.findall(r"\\left\b", formula))
+    rights = len(re.findall(r"\\right\b", formula))
+    if lefts != rights:
+        problems.append(f"\\left 与 \\right 数量不一致（{lefts}/{rights}）")
+    begins = re.findall(r"\\begin\{(\w+\*?)\}", formula)
+    ends = re.findall(r"\\end\{(\w+\*?)\}", formula)
+    if sorted(begins) != sorted(ends):
+        problems.append("\\begin 与 \\end 不配对")
+    if not problems:
+        for match in re.finditer(r"\\[dt]?frac\b", formula):
+            if _brace_groups(formula, match.end()) < 2 and not re.match(r"\s*\w\w", formula[match.end():]):
+                problems.append("\\frac 缺少参数")
+                break
+    return problems
+
+
+def find_latex_issues(text):
+    """扫描全文中的公式，返回 BlockIssue 列表（包括未闭合的 $ 定界符）"""
+    issues = []
+    scan = _strip_code(text)
+    covered = []
+    for pattern in (DISPLAY_MATH, INLINE_MATH):
+        for match in pattern.finditer(scan):
+            if any(start <= match.start() < end for start, end in covered):
+                continue
+            covered.append((match.start(), match.end()))
+            problems = check_latex(match.group(1))
+            if problems:
+                issues.append(BlockIssue("latex", match.start(), match.end(), text[match.start():match.end()],
+                                         problems, section_at(text, match.start())))
+    # 去掉已配对的公式后仍残留的 $ 说明定界符未闭合，取所在行作为修复范围
+    remaining = list(scan)
+    for start, end in covered:
+        remaining[start:end] = " " * (end - start)
+    remaining = "".join(remaining)
+    for match in re.finditer(r"(?<!\\)\$", remaining):
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        line_end = text.find("\n", match.start())
+        line_end = len(text) if line_end < 0 else line_end
+        if any(issue.start == line_start and issue.end == line_end for issue in issues):
+            continue
+        # 整行修复会覆盖同一行内已报告的公式，合并它们的问题，避免拼回原文时区间重叠
+        inside = [issue for issue in issues if line_start <= issue.start and issue.end <= line_end]
+        problems = [problem for issue in inside for problem in issue.problems]
+        issues = [issue for issue in issues if issue not in inside]
+        issues.append(BlockIssue("latex", line_start, line_end, text[line_start:line_end],
+                                 problems + ["公式定界符 $ 未闭合"], section_at(text, match.start())))
+    return issues
+
+
+def find_mermaid_issues(text, min_nodes=None):
+    """扫描全文中的流程图，返回 BlockIssue 列表
+
+    min_nodes 为 {章节序号: 最少节点数}；该章节中节点最多的流程图仍达不到要求时报告问题，
+    章节中完全没有流程图时报告为不可修复的问题。
+    """
+    issues = []
+    largest = {}
+    for match in MERMAID_BLOCK.finditer(text):
+        section = section_at(text, match.start())
+        problems, node_count = check_mermaid(match.group(1))
+        issue = BlockIssue("mermaid", match.start(), match.end(), match.group(0), problems, section)
+        if problems:
+            issues.append(issue)
+        if section not in largest or node_count > largest[section][1]:
+            largest[section] = (issue, node_count)
+    for section, required in (min_nodes or {}).items():
+        if section not in largest:
+            if re.search(rf"^#+\s*{section}\s*[\.、．]", text, re.M):
+                issues.append(BlockIssue("mermaid", -1, -1, "", [f"第{section}部分缺少流程图"], section,
+                                         repairable=False))
+            continue
+        issue, node_count = largest[section]
+        if node_count < required:
+            issue.problems.append(f"流程图只有{node_count}个节点，要求至少{required}个")
+            if issue not in issues:
+                issues.append(issue)
+    return issues
+
+
+def validate_document(text, min_nodes=None):
+    """校验全文，返回按位置排序的 BlockIssue 列表"""
+    issues = find_mermaid_issues(text, min_nodes) + find_latex_issues(text)
+    return sorted(issues, key=lambda issue: issue.start)
+
+
+class ValidationReport:
+    """一次校验与修复的结果：校验耗时与修复的请求数、token用量分开统计"""
+
+    def __init__(self):
+        self.issues = []
+        self.repaired = 0
+        self.unresolved = []
+        self.validation_time = 0.0
+        self.repair_time = 0.0
+        self.repair_requests = 0
+        self.repair_prompt_tokens = 0
+        self.repair_completion_tokens = 0
+
+    def to_dict(self):
+        return {
+            "issues": len(self.issues),
+            "repaired": self.repaired,
+            "unresolved": [repr(issue) for issue in self.unresolved],
+            "validation_time": round(self.validation_time, 4),
+            "repair_time": round(self.repair_time, 4),
+            "repair_requests": self.repair_requests,
+            "repair_prompt_tokens": self.repair_prompt_tokens,
+            "repair_completion_tokens": self.repair_completion_tokens,
+        }